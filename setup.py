@@ -21,7 +21,7 @@ REQUIRED = [
 
 # What packages are optional?
 EXTRAS = {
-    # 'fancy feature': ['django'],
+    'bulk': ['numpy'],
 }
 
 # The rest you shouldn't have to touch too much :)
@@ -0,0 +1,117 @@
+"""
+Write-behind tracker for Datalogger.activity_at.
+
+Instead of saving the whole Datalogger row on every uplink, the endpoint
+records the last seen timestamp of each devid in memory and the tracker
+writes them to the database in one bulk UPDATE when either
+
+* THINGPARK_ACTIVITY_FLUSH_INTERVAL seconds (default 10) have passed, or
+* THINGPARK_ACTIVITY_FLUSH_SIZE devids (default 500) are pending.
+
+Pending timestamps are also flushed when the process exits, so
+Datalogger.activity_at lags behind reality by at most
+THINGPARK_ACTIVITY_FLUSH_INTERVAL seconds. Setting the interval to 0 writes
+every touch through immediately, like the old get_datalogger(update_activity=True).
+"""
+
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+
+logger = logging.getLogger('thingpark')
+
+
+class ActivityTracker:
+    """Collect last seen timestamps per devid and flush them in bulk."""
+
+    def __init__(self, interval=None, max_size=None):
+        if interval is None:
+            interval = getattr(settings, 'THINGPARK_ACTIVITY_FLUSH_INTERVAL', 10)
+        if max_size is None:
+            max_size = getattr(settings, 'THINGPARK_ACTIVITY_FLUSH_SIZE', 500)
+        self.interval = interval
+        self.max_size = max_size
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def touch(self, devid, timestamp=None):
+        """
+        Mark `devid` active at `timestamp` (default: now).
+        :param str devid: Datalogger's devid
+        :param datetime timestamp: timezone aware datetime
+        """
+        if timestamp is None:
+            timestamp = timezone.now()
+        with self._lock:
+            self._pending[devid] = timestamp
+            pending = len(self._pending)
+        if self.interval <= 0 or pending >= self.max_size:
+            self.flush()
+        else:
+            self._start()
+
+    def flush(self):
+        """
+        Write all pending timestamps to the database.
+        Missing Dataloggers are created, like get_datalogger() does.
+        :return: int number of flushed devids
+        """
+        # FIXME: same AppRegistryNotReady issue as in thingpark.utils.get_datalogger
+        from broker.models import Datalogger
+
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            try:
+                devids = list(pending.keys())
+                existing = set(Datalogger.objects.filter(devid__in=devids).values_list('devid', flat=True))
+                missing = [Datalogger(devid=devid, activity_at=pending[devid])
+                           for devid in devids if devid not in existing]
+                if missing:
+                    Datalogger.objects.bulk_create(missing, ignore_conflicts=True)
+                if existing:
+                    whens = [When(devid=devid, then=Value(pending[devid])) for devid in existing]
+                    Datalogger.objects.filter(devid__in=existing).update(
+                        activity_at=Case(*whens, output_field=DateTimeField()))
+            except Exception as err:
+                logger.exception(f'Failed to flush activity of {len(pending)} dataloggers: {err}')
+                # Put timestamps back, but don't overwrite newer ones touched meanwhile
+                with self._lock:
+                    for devid, timestamp in pending.items():
+                        self._pending.setdefault(devid, timestamp)
+                return 0
+            logger.debug(f'Flushed activity of {len(pending)} dataloggers')
+            return len(pending)
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='thingpark-activity', daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        while not self._wakeup.wait(self.interval):
+            self.flush()
+
+    def stop(self):
+        """Stop the background thread and flush everything still pending."""
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.interval + 5)
+        self.flush()
+
+
+activity_tracker = ActivityTracker()
@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class BuiltinpluginConfig(AppConfig):
     name = 'thingpark'
+
+    def ready(self):
+        from thingpark.signals import connect_signals
+
+        connect_signals()
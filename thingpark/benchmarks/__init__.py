@@ -0,0 +1,26 @@
+"""
+Micro-benchmarks for the decode path. Run them inside the broker project, e.g.
+
+    python -m thingpark.benchmarks.dispatch
+"""
+import os
+import timeit
+
+
+def setup_django():
+    import django
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "httpbroker.settings")
+    django.setup()
+
+
+def per_call(func, number=10000, repeat=5):
+    """
+    Run `func` `number` times `repeat` times and return the best time per call.
+    :return: float microseconds
+    """
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1e6
+
+
+def report(name, before, after):
+    print(f'{name:40} {before:9.2f} µs -> {after:9.2f} µs  ({before / after:5.2f}x)')
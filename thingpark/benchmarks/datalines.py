@@ -0,0 +1,104 @@
+"""
+Compare dict datalines (broker.utils.create_dataline) with thingpark.dataline.Dataline
+on a replay of multi-record mcf88 uplinks: memory held by the decoded datalines
+and time to decode, add rssi and pack the parsed data messages.
+"""
+import random
+import struct
+import timeit
+import tracemalloc
+
+from thingpark.benchmarks import report, setup_django
+
+UPLINKS = 20000
+RECORDS = 3  # T/H/P records per uplink, as LW12 sends them
+SEED = 20200101
+
+
+def replay_corpus():
+    """Multi-record mcf88 T/H/P uplinks with records 10 minutes apart, as bytes"""
+    rnd = random.Random(SEED)
+    day = (20 << 25) | (6 << 21) | (15 << 16)  # 2020-06-15
+    uplinks = []
+    for i in range(UPLINKS):
+        buf = b'\x04'
+        for r in range(RECORDS):
+            pres = rnd.randint(95000, 105000)
+            date = day | (i % 24) << 11 | (r * 10) << 5
+            buf += struct.pack('<IhBHB', date, rnd.randint(-3000, 3500),
+                               rnd.randint(0, 200), pres & 0xffff, pres >> 16)
+        uplinks.append(buf)
+    return uplinks
+
+
+def decode_dicts(buf, create_dataline):
+    """mcf88 T/H/P decoding as it was before Dataline"""
+    from thingpark.parsers.mcf88 import get_timestamp, thp_struct
+
+    values = thp_struct((len(buf) - 1) // 10).unpack_from(buf)
+    datalines = []
+    for i in range(1, len(values), 5):
+        date, temp, humi, pres_lo, pres_hi = values[i:i + 5]
+        datalines.append(create_dataline(get_timestamp(date), {
+            'temp': temp / 100,
+            'humi': humi / 2,
+            'pres': (pres_lo | pres_hi << 16) / 100,
+        }))
+    return datalines
+
+
+def retained_bytes(decode, uplinks):
+    """Memory held by the datalines of all uplinks, as a replay chunk holds them"""
+    tracemalloc.start()
+    decoded = [decode(buf) for buf in uplinks]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(decoded) == len(uplinks)
+    return size
+
+
+def per_uplink(func):
+    """Best time of running `func` (which processes all uplinks) in microseconds per uplink"""
+    return min(timeit.repeat(func, number=1, repeat=5)) / UPLINKS * 1e6
+
+
+def main():
+    setup_django()
+    from broker.utils import create_dataline, create_parsed_data_message, data_pack
+    from thingpark.dataline import as_dicts, set_value
+    from thingpark.parsers.mcf88 import decode_mcf88
+
+    uplinks = replay_corpus()
+
+    def decode_old(buf):
+        return decode_dicts(buf, create_dataline)
+
+    def publish_old():
+        for buf in uplinks:
+            datalines = decode_old(buf)
+            datalines[-1]['data']['rssi'] = -80.0
+            data_pack(create_parsed_data_message('BENCHMARK', datalines=datalines))
+
+    def publish_new():
+        for buf in uplinks:
+            datalines = decode_mcf88(buf)
+            set_value(datalines[-1], 'rssi', -80.0)
+            data_pack(create_parsed_data_message('BENCHMARK', datalines=as_dicts(datalines)))
+
+    for buf in uplinks[:100]:
+        old, new = decode_old(buf), decode_mcf88(buf)
+        old[-1]['data']['rssi'] = -80.0
+        set_value(new[-1], 'rssi', -80.0)
+        assert data_pack(create_parsed_data_message('BENCHMARK', datalines=old)) == \
+            data_pack(create_parsed_data_message('BENCHMARK', datalines=as_dicts(new)))
+
+    print(f'{UPLINKS} uplinks, {UPLINKS * RECORDS} datalines')
+    before, after = retained_bytes(decode_old, uplinks), retained_bytes(decode_mcf88, uplinks)
+    print(f'{"retained datalines":40} {before / 1e6:9.2f} MB -> {after / 1e6:9.2f} MB  ({before / after:5.2f}x)')
+    report('decode per uplink', per_uplink(lambda: [decode_old(buf) for buf in uplinks]),
+           per_uplink(lambda: [decode_mcf88(buf) for buf in uplinks]))
+    report('decode, add rssi and pack per uplink', per_uplink(publish_old), per_uplink(publish_new))
+
+
+if __name__ == '__main__':
+    main()
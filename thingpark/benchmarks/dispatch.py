@@ -0,0 +1,30 @@
+"""
+Compare per-message decoder dispatch through broker.utils.decode_payload()
+and thingpark.dispatch.decoder_table.
+"""
+from thingpark.benchmarks import per_call, report, setup_django
+
+PAYLOAD_HEX = '2a2a0021002c002800300056003b0045004704b000dc27ad3415'
+DECODER = 'thingpark.AQBurkDecoder'
+
+
+def main():
+    setup_django()
+    import thingpark.decoders  # noqa: F401 registers decoder plugins
+    from broker.models import Datalogger
+    from broker.utils import decode_payload
+    from thingpark.dispatch import decoder_table
+
+    datalogger = Datalogger(devid='BENCHMARK', decoder=DECODER)
+    plugin = decoder_table.plugins()[DECODER]
+    decoder_table.get(datalogger)  # Warm up the table
+
+    parse_only = per_call(lambda: plugin(PAYLOAD_HEX, 1))
+    before = per_call(lambda: decode_payload(datalogger, PAYLOAD_HEX, 1))
+    after = per_call(lambda: decoder_table.decode(datalogger, PAYLOAD_HEX, 1))
+    report('decode_payload vs decoder_table.decode', before, after)
+    report('dispatch overhead only', before - parse_only, after - parse_only)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Compare the layout based struct parsers with the hand written ones they replaced.
+The old implementations are kept here as reference and their output is checked too.
+"""
+import struct
+
+from thingpark.benchmarks import per_call, report
+from thingpark.parsers.aqburk import parse_aqburk
+from thingpark.parsers.clickey import parse_clickey_tempsens
+from thingpark.parsers.energiaburk import parse_davisweather, parse_victron, parse_victronphoenix
+
+
+def old_victron(hex_str):
+    val = struct.unpack('<Bbxxfffffffffii', bytes.fromhex(hex_str))
+    return {'mainvoltage': val[2], 'panelvoltage': val[3], 'panelpower': val[4], 'batterycurrent': val[5],
+            'errorcode': val[11], 'state': val[12]}
+
+
+def old_victronphoenix(hex_str):
+    val = struct.unpack('<BbHHHhHHHHHBBHHHBBBBBx', bytes.fromhex(hex_str))
+    return {'mpptmainvoltage': val[2], 'mpptpanelvoltage': val[3] / 10, 'mpptpanelpower': val[4],
+            'mpptbatterycurrent': val[5] / 10, 'mpptyieldTotal': val[6], 'mpptyieldToday': val[7],
+            'mpptmaxPowerToday': val[8], 'mpptyieldYesterday': val[9], 'mpptmaxPowerYesterday': val[10],
+            'mppterrorcode': val[11], 'mpptstate': val[12], 'p_V': val[13], 'p_AC_OUT_V': val[14],
+            'p_AC_OUT_S': val[15], 'p_AC_OUT_I': val[16], 'p_WARN': val[17], 'p_AR': val[18], 'p_CS': val[19],
+            'p_MODE': val[20]}
+
+
+def old_davisweather(hex_str):
+    val = struct.unpack('<BbHhBxhBBHBHBHHHHHHBHB', bytes.fromhex(hex_str))
+    return {'barometer': round(((val[2] / 1000) * 33.86389), 1),
+            'in_temperature': round((((val[3] / 10) - 32) / 1.8), 1), 'in_humity': val[4],
+            'out_temperature': round((((val[5] / 10) - 32) / 1.8), 1), 'windspeed': val[6], '10minwind': val[7],
+            'winddirection': val[8], 'out_humity': val[9], 'rain': val[10], 'raintoday': val[15]}
+
+
+def old_aqburk(hex_str):
+    data = {k: int(hex_str[i:i + 4], 16) / 10.0 for k, i in [
+        ('pm25min', 4), ('pm25max', 8), ('pm25avg', 12), ('pm25med', 16),
+        ('pm10min', 20), ('pm10max', 24), ('pm10avg', 28), ('pm10med', 32)]}
+    if len(hex_str) == 52:
+        data['temp'] = round(int(hex_str[36:40], 16) / 10.0 - 100, 1)
+        data['humi'] = int(hex_str[40:44], 16) / 10.0
+        data['pres'] = int(hex_str[44:48], 16) / 10.0
+        data['gas'] = int(hex_str[48:52], 16) / 10.0
+    return data
+
+
+def old_clickey_tempsens(hex_str):
+    def calc_temp(h):
+        return (300 * (int(h[0:2], 16) * 256 + int(h[2:4], 16)) / 4095) - 50
+
+    return {'temp1': calc_temp(hex_str[2:6]), 'temp2': calc_temp(hex_str[6:10]),
+            'volt': ((int(hex_str[10:12], 16) / 0.23) + 2400) / 1000}
+
+
+CASES = [
+    ('victron', old_victron, parse_victron,
+     '0a00000000e83c4600a83b4600000000000000000000ba42000000000000000000008041000081430000000000000000'),
+    ('victron phoenix', old_victronphoenix, parse_victronphoenix,
+     '0a0200000000000000000000000000000000000000004765d8590000fa0000090000'),
+    ('davis', old_davisweather, parse_davisweather,
+     '0700fd729601575293010b12fe00000000ffff7f580013b40000aa000002590300c1'),
+    ('aqburk', old_aqburk, parse_aqburk, '2a2a0021002c002800300056003b0045004704b000dc27ad3415'),
+    ('clickey', old_clickey_tempsens, parse_clickey_tempsens, '13040b03f5fe'),
+]
+
+
+def main():
+    for name, old, new, payload in CASES:
+        assert old(payload) == new(payload), name
+        report(name, per_call(lambda: old(payload)), per_call(lambda: new(payload)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+"""
+Local stub of Orion's NGSI v2 API and comparisons of the number of
+requests the NGSI forwards make to it: one request per entity vs batches,
+push_ngsi_orion (POST, PATCH, maybe POST again) vs NgsiUpserter, and
+upserting a backlog with and without coalescing.
+
+StubOrion keeps entities in memory and counts requests per method and
+path. Batches containing an entity whose id is in `reject` are rejected
+as a whole with 400, like Orion rejects batches with invalid entities.
+
+    python -m thingpark.benchmarks.orion
+"""
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit
+
+from thingpark.benchmarks import setup_django
+
+DEVICES = 200
+OBSERVATIONS = 5  # per device
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubOrion:
+    """
+    :param float latency: seconds each request takes
+    :param reject: entity ids which Orion refuses
+    """
+
+    def __init__(self, latency=0.0, reject=()):
+        self.latency = latency
+        self.reject = set(reject)
+        self.entities = {}
+        self.requests = Counter()
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler_class())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url_root(self):
+        return f'http://127.0.0.1:{self.server.server_address[1]}/v2'
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, method, path, body):
+        """:return: HTTP status code"""
+        with self.lock:
+            self.requests[f'{method} {re.sub("/entities/[^/]+", "/entities/ID", path)}'] += 1
+            if method == 'POST' and path == '/v2/op/update':
+                entities = body['entities']
+                if any(e.get('id') in self.reject or 'type' not in e for e in entities):
+                    return 400
+                for e in entities:
+                    self.entities.setdefault(e['id'], {}).update(e)
+                return 204
+            if method == 'POST' and path.rstrip('/') == '/v2/entities':
+                if body.get('id') in self.reject or 'type' not in body:
+                    return 400
+                if body['id'] in self.entities:
+                    return 422  # Already Exists
+                self.entities[body['id']] = dict(body)
+                return 201
+            match = re.fullmatch(r'/v2/entities/([^/]+)/attrs/?', path)
+            if method == 'PATCH' and match:
+                if match.group(1) not in self.entities:
+                    return 404
+                self.entities[match.group(1)].update(body)
+                return 204
+            return 405
+
+    def handler_class(self):
+        orion = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def respond(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length)) if length else {}
+                if orion.latency:
+                    time.sleep(orion.latency)
+                self.send_response(orion.handle(self.command, urlsplit(self.path).path, body))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            do_POST = do_PATCH = respond
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+class Datalogger:
+    country, locality, street = 'FI', 'Helsinki', 'Mannerheimintie'
+    lon, lat = None, None
+
+    def __init__(self, devid):
+        self.devid = devid
+
+
+def forward_all(forward, dataloggers, config):
+    for i in range(OBSERVATIONS):
+        for datalogger in dataloggers:
+            data = {'datalines': [{'time': f'2020-06-15T12:{i:02d}:00+00:00', 'data': {'wifi': i, 'ble': 1}}]}
+            forward.forward_data(datalogger, data, config)
+
+
+def push_ngsi_orion(data, url_root, username, password):
+    """Upsert as forward2ngsi did before thingpark.ngsi.NgsiUpserter"""
+    import requests
+
+    res = requests.post('{}/entities/'.format(url_root), auth=(username, password), json=data)
+    try:  # ...to update the entity...
+        patch_data = data.copy()
+        del patch_data['id']
+        del patch_data['type']
+        res = requests.patch('{}/entities/{}/attrs/?options=keyValues'.format(url_root, data['id']),
+                             auth=(username, password), json=patch_data)
+    except Exception as err:
+        print('Something went wrong PATCHing to Orion! Exception: {}'.format(err))
+    # ...if updating failed, the entity probably doesn't exist yet so create it
+    if not res or (res.status_code != 204):
+        res = requests.post('{}/entities/?options=keyValues'.format(url_root), auth=(username, password), json=data)
+    return res
+
+
+def air_quality_updates():
+    for i in range(OBSERVATIONS):
+        for d in range(DEVICES):
+            yield {'id': f'AQ{d:04d}', 'type': 'AirQualityObserved', 'dateObserved': f'2020-06-15T12:{i:02d}:00Z',
+                   'PM2.5': i, 'PM10': i * 2}
+
+
+def compare_upserts():
+    from thingpark.ngsi import NgsiUpserter
+
+    updates = DEVICES * OBSERVATIONS
+    with StubOrion() as orion:
+        for entity in air_quality_updates():
+            push_ngsi_orion(entity, orion.url_root, 'user', 'password')
+        requests = sum(orion.requests.values())
+        print(f'{"push_ngsi_orion":30} {requests:6} requests  {requests / updates:.2f} per update  '
+              f'{dict(orion.requests)}')
+
+    with StubOrion() as orion:
+        upserter = NgsiUpserter(orion.url_root)
+        for entity in air_quality_updates():
+            assert upserter.upsert(entity).status_code in (201, 204)
+        requests = sum(orion.requests.values())
+        print(f'{"NgsiUpserter":30} {requests:6} requests  {requests / updates:.2f} per update  '
+              f'{dict(orion.requests)}')
+        assert all(e['PM2.5'] == OBSERVATIONS - 1 for e in orion.entities.values())
+
+        # Restart forgets known entities and somebody deletes an entity from Orion
+        upserter = NgsiUpserter(orion.url_root)
+        upserter.upsert({'id': 'AQ0000', 'type': 'AirQualityObserved', 'PM2.5': 1})
+        del orion.entities['AQ0000']
+        upserter.upsert({'id': 'AQ0000', 'type': 'AirQualityObserved', 'PM2.5': 2})
+        assert orion.entities['AQ0000']['PM2.5'] == 2
+        print(f'After restart and deletion: {upserter.stats()}')
+
+
+def compare_coalescing(devices=100, backlog=50):
+    from thingpark.coalescer import Coalescer
+    from thingpark.ngsi import NgsiUpserter
+
+    def upsert_all(entities):
+        for entity in entities:
+            upserter.upsert(entity)
+
+    print(f'Backlog of {backlog} observations of {devices} devices')
+    for window in [0, 1.0]:
+        with StubOrion() as orion:
+            upserter = NgsiUpserter(orion.url_root)
+            coalescer = Coalescer(upsert_all, window=window)
+            start = time.time()
+            for i in range(backlog):
+                for d in range(devices):
+                    coalescer.add({'id': f'AQ{d:04d}', 'type': 'AirQualityObserved',
+                                   'dateObserved': f'2020-06-15T{i // 60:02d}:{i % 60:02d}:00Z', 'PM2.5': i})
+            coalescer.close()
+            print(f'{"coalescing window " + str(window) + " s":30} {sum(orion.requests.values()):6} requests '
+                  f'{time.time() - start:6.2f} s  {coalescer.stats()}')
+            assert all(e['PM2.5'] == backlog - 1 for e in orion.entities.values())
+
+
+def main():
+    setup_django()
+    from thingpark import ngsi
+    from thingpark.forwards.paxcounter2ngsi import Paxcounter2NGSIForward
+
+    logging.getLogger('runforwards').setLevel(logging.ERROR)  # Don't log each failed POST
+    forward = Paxcounter2NGSIForward()
+    dataloggers = [Datalogger(f'PAX{i:04d}') for i in range(DEVICES)]
+    print(f'{DEVICES} paxcounters, {OBSERVATIONS} observations each')
+
+    # Each entity is created once with POST /v2/entities, later POSTs fail, which is what
+    # one request per entity does with a real Orion too
+    with StubOrion(latency=0.002) as orion:
+        start = time.time()
+        forward_all(forward, dataloggers, {'url': f'{orion.url_root}/entities?options=keyValues', 'batch': False})
+        print(f'{"one request per entity":30} {sum(orion.requests.values()):6} requests '
+              f'{time.time() - start:6.2f} s  {dict(orion.requests)}')
+
+    rejected = {dataloggers[7].devid, dataloggers[123].devid}
+    for name, window in [('batches', 0), ('coalesced batches', 1.0)]:
+        with StubOrion(latency=0.002, reject=rejected) as orion:
+            start = time.time()
+            config = {'url': f'{orion.url_root}/entities?options=keyValues', 'coalesce_window': window}
+            forward_all(forward, dataloggers, config)
+            ngsi.get_forward_coalescer(config).close()
+            sink = ngsi.get_forward_sink(config)
+            sink.close()
+            print(f'{name:30} {sum(orion.requests.values()):6} requests '
+                  f'{time.time() - start:6.2f} s  {dict(orion.requests)}')
+            print(f'Batch sink: {sink.stats()}')
+            assert len(orion.entities) == DEVICES - len(rejected)
+            assert all(e['WiFi'] == OBSERVATIONS - 1 for e in orion.entities.values())
+
+    compare_upserts()
+    compare_coalescing()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+"""
+Throughput, allocation and golden output checks for all thingpark.parsers.
+
+Corpus (corpus.json) contains the sample payloads of the parser modules and
+synthetic variants of them, together with the expected (golden) output of
+each. Baseline (baseline.json) contains the per-parser decode time and peak
+allocation measured on a reference run.
+
+    python -m thingpark.benchmarks.parsers                  # check outputs and compare to baseline
+    python -m thingpark.benchmarks.parsers --margin 0.5     # allow 50 % slowdown
+    python -m thingpark.benchmarks.parsers --save-baseline  # store this run as the new baseline
+    python -m thingpark.benchmarks.parsers --write-corpus   # regenerate corpus after an intended output change
+
+Exit status is 1 if an output differs from the golden one or a parser is
+slower (or allocates more) than the baseline by more than the margin.
+Baseline is specific to the machine and Python version it was measured on,
+so it is not committed: save one before making changes and compare to it.
+"""
+import argparse
+import datetime
+import importlib
+import json
+import os
+import platform
+import random
+import struct
+import sys
+import tracemalloc
+
+from thingpark.benchmarks import per_call
+from thingpark.dataline import Dataline
+
+CORPUS_VERSION = 1
+CORPUS_FILE = os.path.join(os.path.dirname(__file__), 'corpus.json')
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+SEED = 20200101
+
+PARSERS = {
+    'aqburk': 'thingpark.parsers.aqburk:parse_aqburk',
+    'clickey_tempsens': 'thingpark.parsers.clickey:parse_clickey_tempsens',
+    'decentlab': 'thingpark.parsers.decentlab:parse_decentlab',
+    'decentlab_pm': 'thingpark.parsers.decentlab_pm:parse_decentlab_pm',
+    'decentlab_sht35': 'thingpark.parsers.decentlab:parse_decentlab_sht35',
+    'elsys': 'thingpark.parsers.elsys:parse_elsys',
+    'energiaburk': 'thingpark.parsers.energiaburk:parse_energiaburk',
+    'keyval': 'thingpark.parsers.keyval:parse_keyval',
+    'mcf88': 'thingpark.parsers.mcf88:parse_mcf88',
+    'paxcounter': 'thingpark.parsers.paxcounter:parse_paxcounter',
+    'sensornode': 'thingpark.parsers.sensornode:parse_sensornode',
+    'detect': 'thingpark.parsers:parse',
+}
+
+# Sample payloads from parser modules' docstrings and __main__ blocks: (parser, port, payload)
+SAMPLES = [
+    ('aqburk', 1, '2a2a0021002c002800300056003b0045004704b000dc27ad3415'),
+    ('aqburk', 1, '2a2a0021002c002800300056003b0000'),
+    ('clickey_tempsens', 1, '13040b03f5fe'),
+    ('decentlab_pm', 1, '022590000d0c4968bf5b2cc433'),
+    ('decentlab_pm', 1, '02258e000d0c2c68de5badc434'),
+    ('decentlab_pm', 1, '02258e000d0c2b69615c4cc452'),
+    ('decentlab_pm', 1, '022308000d0bd0689d5c74c401'),
+    ('decentlab_pm', 5, '021b50000f0c25002500270027002701f50107012c012d012d012d67bd618dbd10'),
+    ('decentlab_pm', 5, '021b50000d0c2567bd618dbd10'),
+    ('decentlab_pm', 5, '021b5000010c25'),
+    ('elsys', 5, '01010f022e04006605000601b6070e4e'),
+    ('elsys', 5, '0100d3020c04000b05000601aa070e41'),
+    ('elsys', 5, '0100e50212040041050006003a070e4f'),
+    ('elsys', 5, '0100c202100402d205000601cc070e49'),
+    ('elsys', 5, '0100ef024704010a0501070e04155326'),
+    ('energiaburk', 1, '0a00000000e83c4600a83b4600000000000000000000ba42000000000000000000008041000081430000000000000000'),
+    ('energiaburk', 1, '0a0200000000000000000000000000000000000000004765d8590000fa0000090000'),
+    ('energiaburk', 1, '0700fd729601575293010b12fe00000000ffff7f580013b40000aa000002590300c1'),
+    ('energiaburk', 1, '3a2c0000018906438046933f478a773cc82a00003501000000000000113b00002f000000'),
+    ('energiaburk', 1, 'd77e3700030002'),
+    ('energiaburk', 1, 'd77e070dae3700040001'),
+    ('keyval', 1, b'temp=24.61,hum=28.69'.hex()),
+    ('mcf88', 2, '04d276522a44fcb3649001147b522a3cfcb6579001d77e522a22fcb72e900152'),
+    ('mcf88', 2, '04bd79522a2ffcc8869001827d522a06fcc8549001c481522a12fcc84190015b'),
+    ('mcf88', 2, '042279522a68fca5489101e57c522a72fca62191012781522a6efca60691015c'),
+    ('mcf88', 2, '0462651527da078e4d8e01a4691527dd078f488e01676d1527e9078d1a8e015d'),
+    ('sensornode', 10, '01e32337f80e14941228ba01295701'),
+    ('sensornode', 10, 'ffffffffffff2b840846299108143414'),
+    ('sensornode', 21, '0d0016090028b30b143414'),
+]
+
+
+def random_bytes(rnd, n):
+    return bytes(rnd.randrange(256) for _ in range(n))
+
+
+def elsys_variant(rnd):
+    from thingpark.parsers.elsys import ELSYS_TYPES
+
+    types = rnd.sample(sorted(ELSYS_TYPES), rnd.randrange(1, 8))
+    return b''.join(bytes([t]) + random_bytes(rnd, ELSYS_TYPES[t][0]) for t in types)
+
+
+def sensornode_variant(rnd):
+    from thingpark.parsers.sensornode import SENSORNODE_TYPES
+
+    ids = rnd.sample(sorted(SENSORNODE_TYPES), rnd.randrange(1, 6))
+    payload = random_bytes(rnd, SENSORNODE_TYPES[ids[0]][0])
+    payload += b''.join(bytes([i]) + random_bytes(rnd, SENSORNODE_TYPES[i][0]) for i in ids[1:])
+    return ids[0], payload
+
+
+def decentlab_variant(rnd, model_name):
+    from thingpark.parsers.decentlab import DECENTLAB_MODELS
+
+    model = DECENTLAB_MODELS[model_name]
+    flags = rnd.randrange(1, 1 << len(model.sensors))
+    words = sum(s.length for i, s in enumerate(model.sensors) if flags >> i & 1)
+    return struct.pack('>BHH', 2, rnd.randrange(65536), flags) + random_bytes(rnd, 2 * words)
+
+
+def mcf88_variant(rnd):
+    records = b''
+    for _ in range(3):
+        date = (rnd.randrange(18, 30) << 25 | rnd.randrange(1, 13) << 21 | rnd.randrange(1, 29) << 16 |
+                rnd.randrange(24) << 11 | rnd.randrange(60) << 5 | rnd.randrange(30))
+        records += struct.pack('<I', date) + random_bytes(rnd, 6)
+    return b'\x04' + records + random_bytes(rnd, 1)
+
+
+def synthetic_variants(count=20, seed=SEED):
+    """Generate `count` random but well formed payloads of each parser: (parser, port, payload)"""
+    rnd = random.Random(seed)
+    cases = []
+    for _ in range(count):
+        cases.append(('aqburk', 1, (b'**' + random_bytes(rnd, rnd.choice([14, 24]))).hex()))
+        cases.append(('clickey_tempsens', 1, (b'\x13' + random_bytes(rnd, 5)).hex()))
+        cases.append(('decentlab', 1, decentlab_variant(rnd, 'DL-TRS12').hex()))
+        cases.append(('decentlab_pm', 1, decentlab_variant(rnd, 'DL-PM').hex()))
+        cases.append(('decentlab_sht35', 1, decentlab_variant(rnd, 'DL-SHT35').hex()))
+        cases.append(('elsys', 5, elsys_variant(rnd).hex()))
+        header, length = rnd.choice([(b'\x0a\x00', 48), (b'\x0a\x02', 34), (b'\x07\x00', 34),
+                                     (b'\x3a', 36), (b'\x09', 5)])
+        cases.append(('energiaburk', 1, (header + random_bytes(rnd, length - len(header))).hex()))
+        keyvals = ','.join(f'k{i}={rnd.uniform(-100, 100):.2f}' for i in range(rnd.randrange(1, 5)))
+        cases.append(('keyval', 1, keyvals.encode().hex()))
+        cases.append(('mcf88', 2, mcf88_variant(rnd).hex()))
+        cases.append(('paxcounter', '1', random_bytes(rnd, rnd.choice([2, 4])).hex()))
+        port, payload = sensornode_variant(rnd)
+        cases.append(('sensornode', port, payload.hex()))
+    # Auto-detection over payloads of all detectable formats
+    for parser, port, payload in SAMPLES + list(cases):
+        if parser in ('aqburk', 'clickey_tempsens', 'keyval', 'paxcounter'):
+            cases.append(('detect', port, payload))
+    return cases
+
+
+def get_parser(name):
+    module, func = PARSERS[name].split(':')
+    return getattr(importlib.import_module(module), func)
+
+
+def normalize(output):
+    """Convert parser output to JSON, which is what golden outputs are compared as"""
+
+    def default(o):
+        if isinstance(o, (datetime.datetime, datetime.date)):
+            return o.isoformat()
+        if isinstance(o, Dataline):
+            return o.as_dict()
+        return str(o)
+
+    return json.dumps(output, default=default, sort_keys=True, ensure_ascii=False)
+
+
+def run_parser(func, payload, port):
+    try:
+        return func(payload, port)
+    except Exception as err:
+        return {'raises': type(err).__name__}
+
+
+def write_corpus():
+    cases = []
+    for parser, port, payload in SAMPLES + synthetic_variants():
+        output = run_parser(get_parser(parser), payload, port)
+        cases.append({'parser': parser, 'port': port, 'payload': payload, 'expected': json.loads(normalize(output))})
+    with open(CORPUS_FILE, 'wt') as f:
+        json.dump({'version': CORPUS_VERSION, 'seed': SEED, 'cases': cases}, f, indent=1, ensure_ascii=False)
+    print(f'Wrote {len(cases)} cases to {CORPUS_FILE}')
+
+
+def load_json(path):
+    with open(path, 'rt') as f:
+        return json.load(f)
+
+
+def check_golden(cases):
+    """:return: number of outputs which differ from the golden ones"""
+    failures = 0
+    for case in cases:
+        output = run_parser(get_parser(case['parser']), case['payload'], case['port'])
+        if normalize(output) != normalize(case['expected']):
+            failures += 1
+            print(f'GOLDEN MISMATCH {case["parser"]} {case["payload"]}\n'
+                  f'  expected {normalize(case["expected"])}\n  got      {normalize(output)}')
+    return failures
+
+
+def peak_bytes(func, payloads):
+    """:return: largest peak of memory allocated while decoding one payload"""
+    peak = 0
+    tracemalloc.start()
+    try:
+        for payload, port in payloads:
+            tracemalloc.clear_traces()
+            before = tracemalloc.get_traced_memory()[0]
+            output = run_parser(func, payload, port)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+            del output
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def measure(cases, number, repeat):
+    """:return: dict of parser -> {'us_per_payload': float, 'peak_bytes': int}"""
+    results = {}
+    for name in PARSERS:
+        payloads = [(c['payload'], c['port']) for c in cases if c['parser'] == name]
+        if not payloads:
+            continue
+        func = get_parser(name)
+
+        def decode_all():
+            for payload, port in payloads:
+                run_parser(func, payload, port)
+
+        results[name] = {
+            'us_per_payload': per_call(decode_all, number=number, repeat=repeat) / len(payloads),
+            'peak_bytes': peak_bytes(func, payloads),
+        }
+    return results
+
+
+def compare(results, baseline, margin):
+    """Print results against baseline and return number of regressions"""
+    regressions = 0
+    print(f'{"parser":20} {"µs/payload":>11} {"payloads/s":>11} {"peak bytes":>11}  baseline')
+    for name, r in results.items():
+        b = baseline.get(name)
+        line = f'{name:20} {r["us_per_payload"]:11.2f} {1e6 / r["us_per_payload"]:11.0f} {r["peak_bytes"]:11d}'
+        if b is None:
+            print(f'{line}  -')
+            continue
+        slower = r['us_per_payload'] > b['us_per_payload'] * (1 + margin)
+        bigger = r['peak_bytes'] > b['peak_bytes'] * (1 + margin)
+        status = 'SLOWER ' if slower else ''
+        status += 'ALLOCATES MORE' if bigger else ''
+        print(f'{line}  {b["us_per_payload"]:.2f} µs, {b["peak_bytes"]} B  {status or "ok"}')
+        regressions += slower or bigger
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark thingpark.parsers against golden corpus and baseline')
+    parser.add_argument('--margin', type=float, default=0.25,
+                        help='Allowed slowdown and allocation growth as a fraction of baseline (default 0.25)')
+    parser.add_argument('--number', type=int, default=200, help='Decode the corpus this many times per repeat')
+    parser.add_argument('--repeat', type=int, default=7, help='Best of this many repeats is reported')
+    parser.add_argument('--save-baseline', action='store_true', help='Save results as the new baseline')
+    parser.add_argument('--write-corpus', action='store_true', help='Regenerate corpus and golden outputs')
+    args = parser.parse_args(argv)
+
+    if args.write_corpus:
+        write_corpus()
+        return 0
+    corpus = load_json(CORPUS_FILE)
+    if corpus['version'] != CORPUS_VERSION:
+        print(f'Corpus version {corpus["version"]} is not {CORPUS_VERSION}, run with --write-corpus')
+        return 1
+    failures = check_golden(corpus['cases'])
+    print(f'{len(corpus["cases"])} golden cases, {failures} mismatches')
+    results = measure(corpus['cases'], args.number, args.repeat)
+    if args.save_baseline:
+        with open(BASELINE_FILE, 'wt') as f:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(), 'parsers': results},
+                      f, indent=1)
+        print(f'Saved baseline to {BASELINE_FILE}')
+        return 1 if failures else 0
+    if os.path.exists(BASELINE_FILE):
+        baseline = load_json(BASELINE_FILE)
+    else:
+        print('No baseline yet, save one with --save-baseline')
+        baseline = {'python': platform.python_version(), 'parsers': {}}
+    if baseline['python'] != platform.python_version():
+        print(f'Note: baseline was measured with Python {baseline["python"]}, '
+              f'this is {platform.python_version()}')
+    regressions = compare(results, baseline['parsers'], args.margin)
+    return 1 if failures or regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,35 @@
+"""
+Compare dateutil's generic parser with thingpark.utils.parse_lorawan_time
+on the kind of Time strings Thingpark sends.
+"""
+import pytz
+from dateutil.parser import parse
+
+from thingpark.benchmarks import per_call, report, setup_django
+
+TIME_STRINGS = [
+    '2019-03-19T06:52:52.652+02:00',
+    '2019-07-01T12:00:03.1+03:00',
+    '2019-11-30T23:59:59.999999+02:00',
+    '2020-01-01T00:00:00.000Z',
+    '2020-06-15T08:15:42-04:00',
+]
+
+
+def dateutil_utc(time_str):
+    return parse(time_str).astimezone(pytz.UTC)
+
+
+def main():
+    setup_django()
+    from thingpark.utils import parse_lorawan_time
+
+    for time_str in TIME_STRINGS:
+        assert parse_lorawan_time(time_str) == dateutil_utc(time_str), time_str
+        report(time_str,
+               per_call(lambda: dateutil_utc(time_str), number=2000),
+               per_call(lambda: parse_lorawan_time(time_str), number=2000))
+
+
+if __name__ == '__main__':
+    main()
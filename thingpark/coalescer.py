@@ -0,0 +1,107 @@
+"""
+Latest-value coalescing of NGSI entities.
+
+Orion keeps only the current state of an entity, so when a device bursts
+or a forward catches up a backlog, all but the newest observation of an
+entity would be overwritten right away. Coalescer keeps only the newest
+entity of each id for `window` seconds (counted from the first entity
+added after the previous emit) and then passes them on with
+emit(entities). Superseded entities are dropped and counted.
+
+An entity is newer than another if its dateObserved is greater (both are
+ISO 8601 strings of the same sender) or, if either doesn't have one, if
+it was added later.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger('thingpark')
+
+
+def is_newer(entity, other):
+    date, other_date = entity.get('dateObserved'), other.get('dateObserved')
+    if isinstance(date, str) and isinstance(other_date, str):
+        return date >= other_date
+    return True
+
+
+class Coalescer:
+    """
+    :param emit: function(list of entities) called with the newest entity of each id
+    :param float window: seconds entities are held, 0 emits each entity at once
+    """
+
+    def __init__(self, emit, window=1.0):
+        self.emit = emit
+        self.window = window
+        self._latest = OrderedDict()  # entity id -> entity
+        self._first_added_at = None
+        self._lock = threading.Lock()
+        self._emit_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.received = 0
+        self.emitted = 0
+        self.dropped = 0
+        if window > 0:
+            threading.Thread(target=self._flush_periodically, name='ngsi-coalescer', daemon=True).start()
+
+    def add(self, entity):
+        """Hold `entity` (dict with id) until the window closes, replacing an older entity of the same id"""
+        if self.window <= 0:
+            self.received += 1
+            self.emitted += 1
+            self.emit([entity])
+            return
+        with self._lock:
+            self.received += 1
+            entity_id = entity['id']
+            held = self._latest.get(entity_id)
+            if held is None:
+                if not self._latest:
+                    self._first_added_at = time.monotonic()
+                self._latest[entity_id] = entity
+                return
+            self.dropped += 1
+            if is_newer(entity, held):
+                self._latest[entity_id] = entity
+
+    def flush(self):
+        """Emit held entities"""
+        with self._emit_lock:
+            with self._lock:
+                entities, self._latest = list(self._latest.values()), OrderedDict()
+                self.emitted += len(entities)
+            if entities:
+                try:
+                    self.emit(entities)
+                except Exception:
+                    logger.exception(f'Emitting {len(entities)} coalesced entities failed')
+
+    def _flush_periodically(self):
+        while not self._stopped.is_set():
+            with self._lock:
+                first_added_at = self._first_added_at if self._latest else None
+            if first_added_at is None:
+                wait = self.window
+            else:
+                wait = first_added_at + self.window - time.monotonic()
+                if wait <= 0:
+                    self.flush()
+                    continue
+            self._stopped.wait(wait)
+
+    def close(self):
+        """Stop the flusher and emit held entities"""
+        self._stopped.set()
+        self.flush()
+
+    def stats(self):
+        return {
+            'received': self.received,
+            'emitted': self.emitted,
+            'dropped': self.dropped,
+            'held': len(self._latest),
+        }
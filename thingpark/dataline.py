@@ -0,0 +1,70 @@
+"""
+Compact representation of decoded datalines.
+
+broker.utils.create_dataline() builds two dicts per reading:
+
+    {'time': '2021-02-18T15:09:04+00:00', 'data': {'temp': -9.2, 'humi': 82.5}}
+
+A Dataline keeps the timestamp, a field name tuple (usually shared by all
+datalines a parser creates) and a value tuple instead. It is converted to
+that dict format only when the parsed data message is packed, so decoded
+datalines held in memory (e.g. in replay chunks) take half the space.
+"""
+
+
+class Dataline:
+    """
+    One timestamped reading.
+    :param datetime timestamp: timezone aware datetime
+    :param tuple names: field names
+    :param tuple values: field values in the same order as names
+    """
+    __slots__ = ('timestamp', 'names', 'values')
+
+    def __init__(self, timestamp, names, values):
+        self.timestamp = timestamp
+        self.names = names
+        self.values = values
+
+    def __repr__(self):
+        return f'Dataline({self.timestamp.isoformat()}, {dict(zip(self.names, self.values))})'
+
+    def __eq__(self, other):
+        if not isinstance(other, Dataline):
+            return NotImplemented
+        return self.timestamp == other.timestamp and dict(zip(self.names, self.values)) == dict(
+            zip(other.names, other.values))
+
+    def __reduce__(self):
+        return Dataline, (self.timestamp, self.names, self.values)
+
+    def set(self, name, value):
+        """Set value of field `name`, adding the field if it doesn't exist"""
+        try:
+            i = self.names.index(name)
+        except ValueError:
+            self.names += (name,)
+            self.values += (value,)
+        else:
+            self.values = self.values[:i] + (value,) + self.values[i + 1:]
+
+    def copy(self):
+        return Dataline(self.timestamp, self.names, self.values)
+
+    def as_dict(self):
+        """Return dataline as broker.utils.create_dataline() would have created it"""
+        return {'time': self.timestamp.isoformat(), 'data': dict(zip(self.names, self.values))}
+
+
+def set_value(dataline, name, value):
+    """Set a field of a Dataline or a dataline dict"""
+    if isinstance(dataline, Dataline):
+        dataline.set(name, value)
+    else:
+        dataline['data'][name] = value
+
+
+def as_dicts(datalines):
+    """Return datalines as dicts, like broker.utils.create_dataline() creates"""
+    return [d.as_dict() if isinstance(d, Dataline) else d for d in datalines]
+
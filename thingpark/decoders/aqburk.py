@@ -1,10 +1,15 @@
 from broker.providers.decoder import DecoderProvider
-from thingpark.parsers import parse_aqburk
+from thingpark.parsers import aqburk, parse_aqburk
 
 
 class AQBurkDecoder(DecoderProvider):
     description = 'Decode AQBurk payload'
+    pure = True
 
     def decode_payload(self, hex_payload, port, **kwargs):
         data = parse_aqburk(hex_payload, port)
         return data
+
+    def decode_bytes(self, buf, port, **kwargs):
+        data = aqburk.decode_bytes(buf, port)
+        return data
@@ -1,10 +1,15 @@
 from broker.providers.decoder import DecoderProvider
-from thingpark.parsers import parse_decentlab
+from thingpark.parsers import decentlab, parse_decentlab
 
 
 class DecentlabDecoder(DecoderProvider):
     description = 'Decode Decentlab payload'
+    pure = True
 
     def decode_payload(self, hex_payload, port, **kwargs):
         data = parse_decentlab(hex_payload, port)
         return data
+
+    def decode_bytes(self, buf, port, **kwargs):
+        data = decentlab.decode_bytes(buf, port)
+        return data
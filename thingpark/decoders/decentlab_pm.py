@@ -1,10 +1,15 @@
 from broker.providers.decoder import DecoderProvider
-from thingpark.parsers import parse_decentlab_pm
+from thingpark.parsers import decentlab_pm, parse_decentlab_pm
 
 
 class DecentlabPmDecoder(DecoderProvider):
     description = 'Decode Decentlab PM payload'
+    pure = True
 
     def decode_payload(self, hex_payload, port, **kwargs):
         data = parse_decentlab_pm(hex_payload, port)
         return data
+
+    def decode_bytes(self, buf, port, **kwargs):
+        data = decentlab_pm.decode_bytes(buf, port)
+        return data
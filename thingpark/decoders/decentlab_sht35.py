@@ -0,0 +1,16 @@
+from broker.providers.decoder import DecoderProvider
+from thingpark.parsers import parse_decentlab_sht35
+from thingpark.parsers.decentlab import DL_SHT35
+
+
+class DecentlabSht35Decoder(DecoderProvider):
+    description = 'Decode Decentlab DL-SHT35 payload'
+    pure = True
+
+    def decode_payload(self, hex_payload, port, **kwargs):
+        data = parse_decentlab_sht35(hex_payload, port)
+        return data
+
+    def decode_bytes(self, buf, port, **kwargs):
+        data = DL_SHT35.decode(buf)
+        return data
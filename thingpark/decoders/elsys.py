@@ -4,7 +4,12 @@ from thingpark.parsers import elsys
 
 class ElsysDecoder(DecoderProvider):
     description = 'Decode ELSYS payload'
+    pure = True
 
     def decode_payload(self, hex_payload, port, **kwargs):
         data = elsys.parse_elsys(hex_payload, port)
         return data
+
+    def decode_bytes(self, buf, port, **kwargs):
+        data = elsys.decode_bytes(buf, port)
+        return data
@@ -1,10 +1,15 @@
 from broker.providers.decoder import DecoderProvider
-from thingpark.parsers import parse_energiaburk
+from thingpark.parsers import energiaburk, parse_energiaburk
 
 
 class EnergiaBurkDecoder(DecoderProvider):
     description = 'Decode EnergiaBurk payload'
+    pure = True
 
     def decode_payload(self, hex_payload, port, **kwargs):
         data = parse_energiaburk(hex_payload, port)
         return data
+
+    def decode_bytes(self, buf, port, **kwargs):
+        data = energiaburk.decode_bytes(buf, port)
+        return data
@@ -4,7 +4,12 @@ from thingpark.parsers import mcf88
 
 class Mcf88Decoder(DecoderProvider):
     description = 'Decode MCF88 payload'
+    pure = True
 
     def decode_payload(self, hex_payload, port, **kwargs):
         data = mcf88.parse_mcf88(hex_payload, port)
         return data
+
+    def decode_bytes(self, buf, port, **kwargs):
+        data = mcf88.decode_bytes(buf, port)
+        return data
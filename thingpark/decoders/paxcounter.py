@@ -1,10 +1,16 @@
 from broker.providers.decoder import DecoderProvider
+from thingpark.parsers import paxcounter
 from thingpark.parsers.paxcounter import parse_paxcounter
 
 
 class PaxcounterDecoder(DecoderProvider):
     description = 'Decode PAXCOUNTER payload'
+    pure = True
 
     def decode_payload(self, payload_hex, port, **kwargs):
         data = parse_paxcounter(payload_hex, port)
         return data
+
+    def decode_bytes(self, buf, port, **kwargs):
+        data = paxcounter.decode_bytes(buf, port)
+        return data
@@ -1,10 +1,15 @@
 from broker.providers.decoder import DecoderProvider
-from thingpark.parsers import parse_sensornode
+from thingpark.parsers import parse_sensornode, sensornode
 
 
 class SensornodeDecoder(DecoderProvider):
     description = 'Decode Sensornode payload'
+    pure = True
 
     def decode_payload(self, hex_payload, port, **kwargs):
         data = parse_sensornode(hex_payload, port)
         return data
+
+    def decode_bytes(self, buf, port, **kwargs):
+        data = sensornode.decode_bytes(buf, port)
+        return data
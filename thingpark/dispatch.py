@@ -0,0 +1,79 @@
+"""
+Precompiled devid -> decoder dispatch table.
+
+broker.utils.decode_payload() resolves the decoder plugin by name for every
+message. DecoderDispatchTable resolves it once per device and keeps the bound
+decode_payload method, so decoding a message is a dict lookup and a call.
+Decoders which implement `decode_bytes(buf, port, **kwargs)` get the payload
+as bytes, converted from hex only once. Decoders which declare
+`pure = True` are called through thingpark.payloadcache.
+"""
+
+import functools
+import threading
+
+from broker.providers.decoder import DecoderProvider
+from broker.utils import get_datalogger_decoder
+from thingpark.payloadcache import payload_cache
+
+
+def decode_hex(decode_bytes, payload_hex, port, **kwargs):
+    """Convert hex payload to bytes and call decoder's decode_bytes()"""
+    return decode_bytes(bytes.fromhex(payload_hex), port, **kwargs)
+
+
+class DecoderDispatchTable:
+
+    def __init__(self):
+        self._plugins = None
+        self._pure = set()
+        self._decode_bytes = {}
+        self._table = {}
+        self._lock = threading.Lock()
+
+    def plugins(self):
+        """
+        :return: dict of decoder name -> bound decode_payload method
+        """
+        if self._plugins is None:
+            with self._lock:
+                if self._plugins is None:
+                    plugins = list(DecoderProvider.get_plugins())
+                    self._pure = {f'{p.app}.{p.name}' for p in plugins if getattr(p, 'pure', False)}
+                    self._decode_bytes = {f'{p.app}.{p.name}': p.decode_bytes
+                                          for p in plugins if hasattr(p, 'decode_bytes')}
+                    self._plugins = {f'{p.app}.{p.name}': p.decode_payload for p in plugins}
+        return self._plugins
+
+    def get(self, datalogger):
+        """
+        Return decoder name and callable for `datalogger`.
+        The entry is rebuilt when Datalogger.decoder differs from the one it was built for.
+        :raises ValueError: if the decoder is not found
+        """
+        entry = self._table.get(datalogger.devid)
+        if entry is None or entry[0] != datalogger.decoder:
+            name = get_datalogger_decoder(datalogger)
+            func = self.plugins().get(name)
+            if func is None:
+                raise ValueError(f'Decoder "{name}" not found for "{datalogger.devid}"')
+            if name in self._decode_bytes:
+                func = functools.partial(decode_hex, self._decode_bytes[name])
+            if name in self._pure:
+                func = functools.partial(payload_cache.decode, name, func)
+            entry = (datalogger.decoder, name, func)
+            self._table[datalogger.devid] = entry
+        return entry[1], entry[2]
+
+    def decode(self, datalogger, payload_hex, port, **kwargs):
+        name, func = self.get(datalogger)
+        return func(payload_hex, port, **kwargs)
+
+    def invalidate(self, devid=None):
+        if devid is None:
+            self._table.clear()
+        else:
+            self._table.pop(devid, None)
+
+
+decoder_table = DecoderDispatchTable()
@@ -5,9 +5,10 @@ from django.http.response import HttpResponse
 
 from broker.providers.endpoint import EndpointProvider
 from broker.utils import (
-    decode_json_body, get_datalogger, create_routing_key,
+    decode_json_body, create_routing_key,
     serialize_django_request, data_pack, send_message
 )
+from thingpark.activity import activity_tracker
 
 
 class ThingparkEndpoint(EndpointProvider):
@@ -28,7 +29,7 @@ class ThingparkEndpoint(EndpointProvider):
             return HttpResponse(f'JSON ERROR: {body}', status=400, content_type='text/plain')
         uplink = body.get('DevEUI_uplink')
         if uplink is not None:
-            datalogger, created = get_datalogger(devid=devid, update_activity=True)
+            activity_tracker.touch(devid)
             if devid is not None:
                 pass
                 # process_data.delay(devid, serialised_request)
@@ -1,4 +1,38 @@
+import logging
+
 from broker.providers.forward import ForwardProvider
+from thingpark.ngsi import get_forward_coalescer
+
+logger = logging.getLogger('runforwards')
+
+
+def create_air_quality_entity(datalogger, dataline):
+    """
+    Create AirQualityObserved entity (key-values) from AQBurk dataline.
+    :return: dict or None if dataline has no PM values or datalogger has no location
+    """
+    values = dataline['data']
+    if 'pm25avg' not in values or not (datalogger.lon and datalogger.lat):
+        return None
+    has_address = datalogger.country and datalogger.locality and datalogger.street
+    return {
+        'id': datalogger.devid,
+        'type': 'AirQualityObserved',
+        'address': {
+            'addressCountry': datalogger.country if has_address else '',
+            'addressLocality': datalogger.locality if has_address else '',
+            'streetAddress': datalogger.street if has_address else '',
+        },
+        'dateObserved': dataline['time'],
+        'location': {
+            'type': 'Point',
+            'coordinates': [datalogger.lon, datalogger.lat]
+        },
+        'source': 'https://fvh.io/ilmanlaatu2019',
+        'reliability': 0.5,
+        'PM2.5': values['pm25avg'],
+        'PM10': values.get('pm10avg'),
+    }
 
 
 class AQBurk2NGSIForward(ForwardProvider):
@@ -8,4 +42,11 @@ class AQBurk2NGSIForward(ForwardProvider):
         super().__init__(args, kwargs)
 
     def forward_data(self, datalogger, data, config):
+        entity = create_air_quality_entity(datalogger, data['datalines'][0])
+        if entity is None:
+            logger.debug(f'AQBurk {datalogger.devid} without PM data or location')
+            return False
+        # Newest entity of each device is sent in batches to NGSI v2 root `url_root` (or the root of `url`)
+        # of config field
+        get_forward_coalescer(config).add(entity)
         return True
@@ -1,9 +1,12 @@
+import copy
 import json
 import logging
 
-import requests
+from django.conf import settings
 
 from broker.providers.forward import ForwardProvider
+from thingpark.httpclient import get_client, get_option
+from thingpark.ngsi import get_forward_coalescer, get_forward_sink, spool_entities, url_root_of
 
 logger = logging.getLogger('runforwards')
 
@@ -35,8 +38,8 @@ class Paxcounter2NGSIForward(ForwardProvider):
         super().__init__(args, kwargs)
 
     def forward_data(self, datalogger, data, config):
-        # Copy template
-        m = ngsi_template.copy()
+        # Copy template, deep because requests may be sent concurrently
+        m = copy.deepcopy(ngsi_template)
         # Replace data with real values
         m['id'] = datalogger.devid
         dline = data['datalines'][0]
@@ -57,12 +60,33 @@ class Paxcounter2NGSIForward(ForwardProvider):
             "streetAddress": datalogger.street
         }
         logger.debug(json.dumps(m, indent=2))
+        if get_option(config, 'batch', True, prefix='THINGPARK_NGSI_'):
+            # Upsert newest entity of each device in batches to NGSI v2 root of `url` (or `url_root`) of config field
+            get_forward_coalescer(config).add(m)
+            get_forward_sink(config).client.maybe_log_stats(getattr(settings, 'THINGPARK_HTTP_STATS_INTERVAL', 300))
+            return True
         # POST data to an endpoint, which is defined in Forward's or DataloggerForward's config field
         # TODO: add authentication and other
-        res = requests.post(config['url'], json=m)
-        if 200 <= res.status_code < 300:
-            logger.info(f'POST request to {config["url"]} returned success code {res.status_code}')
-            return True
-        else:
-            logger.warning(f'POST request to {config["url"]} returned error code {res.status_code}')
-            return False
+        # With max_in_flight in config (or THINGPARK_HTTP_MAX_IN_FLIGHT) the request is sent in the background
+        # and True means that it was queued, errors are only logged
+        url = config['url']
+        get_forward_sink(config)  # Replays entities which log_response() spools
+        client = get_client(url, config)
+        result = client.submit(url, m, lambda res, err: log_response(url, m, res, err))
+        client.maybe_log_stats(getattr(settings, 'THINGPARK_HTTP_STATS_INTERVAL', 300))
+        return result
+
+
+def log_response(url, entity, res, err):
+    if err is not None:
+        logger.warning(f'POST request to {url} failed: {err}')
+        spool_entities(url_root_of(url), [entity])
+        return False
+    if 200 <= res.status_code < 300:
+        logger.info(f'POST request to {url} returned success code {res.status_code}')
+        return True
+    else:
+        logger.warning(f'POST request to {url} returned error code {res.status_code}')
+        if res.status_code >= 500:
+            spool_entities(url_root_of(url), [entity])
+        return False
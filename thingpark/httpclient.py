@@ -0,0 +1,200 @@
+"""
+Pooled keep-alive HTTP clients for forwards.
+
+A bare requests.post() opens a new TCP (and TLS) connection for every call.
+get_client() returns the HttpClient of the target's scheme://host:port,
+whose requests.Session keeps a pool of connections which all forwards
+posting to the same target reuse.
+
+With max_in_flight > 0, submit() sends requests from a thread pool, so a
+slow target doesn't block the caller. At most max_in_flight requests are
+being sent or waiting to be sent at a time; submit() blocks when the limit
+is reached.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger('thingpark')
+
+
+def get_option(config, name, default, prefix='THINGPARK_HTTP_'):
+    """Return option `name` from forward config, <prefix><NAME> setting or `default`"""
+    if config and name in config:
+        return config[name]
+    return getattr(settings, f'{prefix}{name.upper()}', default)
+
+
+class HttpClient:
+    """
+    Pooled session for one target.
+    :param str base_url: scheme://host:port of the target
+    :param int pool_size: max number of kept-alive connections
+    :param float connect_timeout: seconds to wait for a connection
+    :param float read_timeout: seconds to wait for the response
+    :param bool keep_alive: False closes the connection after each request
+    :param int max_in_flight: max number of requests submit() sends concurrently, 0 sends them in the caller
+    """
+
+    def __init__(self, base_url, pool_size=10, connect_timeout=5, read_timeout=30, keep_alive=True,
+                 max_in_flight=0):
+        self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_in_flight = max_in_flight
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, max_in_flight))
+        self.session.mount(base_url, self.adapter)
+        if not keep_alive:
+            self.session.headers['Connection'] = 'close'
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = None
+        if max_in_flight > 0:
+            self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='httpclient')
+            self._slots = threading.BoundedSemaphore(max_in_flight)
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight_seen = 0
+        self.closed_connections = 0
+        self.stats_logged_at = time.monotonic()
+
+    def request(self, method, url, json, **kwargs):
+        """
+        Send `json` to `url` using a pooled connection. Other arguments (e.g. auth, params) are passed
+        to requests.Session.request().
+        :return: requests.Response
+        :raises requests.RequestException: on connection errors and timeouts
+        """
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            if self.in_flight > self.max_in_flight_seen:
+                self.max_in_flight_seen = self.in_flight
+        try:
+            return self.session.request(method, url, json=json, timeout=self.timeout, **kwargs)
+        except requests.RequestException:
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def post(self, url, json, **kwargs):
+        return self.request('POST', url, json, **kwargs)
+
+    def patch(self, url, json, **kwargs):
+        return self.request('PATCH', url, json, **kwargs)
+
+    def submit(self, url, json, callback):
+        """
+        POST `json` to `url` in the thread pool and call callback(response, error) when done.
+        Blocks while max_in_flight requests are pending. Without a thread pool posts in the caller.
+        :return: callback's return value if posted in the caller, True if queued
+        """
+        if self._executor is None:
+            try:
+                response = self.post(url, json)
+            except requests.RequestException as err:
+                return callback(None, err)
+            return callback(response, None)
+        self._slots.acquire()
+        try:
+            self._executor.submit(self._post_and_call, url, json, callback)
+        except BaseException:
+            self._slots.release()
+            raise
+        return True
+
+    def _post_and_call(self, url, json, callback):
+        try:
+            try:
+                response = self.post(url, json)
+            except requests.RequestException as err:
+                callback(None, err)
+            else:
+                callback(response, None)
+        except Exception:
+            logger.exception(f'Callback of POST to {url} failed')
+        finally:
+            self._slots.release()
+
+    def connections(self):
+        """Return number of connections opened so far"""
+        pools = self.adapter.poolmanager.pools
+        return self.closed_connections + sum(
+            pool.num_connections for pool in (pools.get(key) for key in pools.keys()) if pool is not None)
+
+    def stats(self):
+        """
+        :return: dict of request, error and connection counts and current and max in-flight requests
+        """
+        connections = self.connections()
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'errors': self.errors,
+                'connections': connections,
+                'reused': max(self.requests - connections, 0),
+                'in_flight': self.in_flight,
+                'max_in_flight': self.max_in_flight_seen,
+            }
+
+    def maybe_log_stats(self, interval):
+        """Log stats if `interval` seconds have passed since they were logged last time"""
+        now = time.monotonic()
+        if interval <= 0 or now - self.stats_logged_at < interval:
+            return
+        self.stats_logged_at = now
+        logger.info(f'HTTP client {self.base_url}: {self.stats()}')
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        self.closed_connections = self.connections()
+        self.session.close()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(url, config=None):
+    """
+    Return the shared HttpClient of `url`'s scheme://host:port.
+    Options (pool_size, connect_timeout, read_timeout, keep_alive, max_in_flight) are read from forward
+    `config` or THINGPARK_HTTP_* settings when the client is created, i.e. the first forward posting to
+    a target decides them.
+    """
+    parts = urlsplit(url)
+    base_url = f'{parts.scheme}://{parts.netloc}'
+    client = _clients.get(base_url)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(base_url)
+            if client is None:
+                client = HttpClient(
+                    base_url,
+                    pool_size=get_option(config, 'pool_size', 10),
+                    connect_timeout=get_option(config, 'connect_timeout', 5),
+                    read_timeout=get_option(config, 'read_timeout', 30),
+                    keep_alive=get_option(config, 'keep_alive', True),
+                    max_in_flight=get_option(config, 'max_in_flight', 0),
+                )
+                _clients[base_url] = client
+    return client
+
+
+def stats():
+    """
+    :return: dict of base URL -> HttpClient.stats()
+    """
+    return {base_url: client.stats() for base_url, client in list(_clients.items())}
@@ -1,20 +1,32 @@
 import json
 import logging
+import multiprocessing
+import queue
+import signal
+import sys
+import zlib
 
-import pytz
-from dateutil.parser import parse
+from django import db
 from django.conf import settings
+from django.core.management.base import CommandError
 from influxdb.exceptions import InfluxDBClientError
 
 from broker.management.commands import RabbitCommand
-from thingpark.utils import create_influxdb_obj, get_influxdb_client
+from thingpark.dataline import as_dicts, set_value
+from thingpark.dispatch import decoder_table
+from thingpark.models import ParseFailMessage
+from thingpark.payloadcache import payload_cache
+from thingpark.utils import (
+    create_influxdb_obj, get_influxdb_client,
+    get_datalogger, get_application_headers, parse_lorawan_time
+)
 
 from broker.utils import (
     create_dataline, create_parsed_data_message,
     data_pack, data_unpack,
     get_datalogger_decoder,
     save_parse_fail_datalogger_message,
-    decode_json_body, get_datalogger, decode_payload,
+    decode_json_body,
     create_routing_key, send_message
 )
 
@@ -24,69 +36,87 @@ logger = logging.getLogger('thingpark')
 def send_to_exchange(devid, datalogger, datalines, override_measurement=None):
     # RabbitMQ part
     key = create_routing_key('thingpark', devid)
-    message = create_parsed_data_message(devid, datalines=datalines)
+    message = create_parsed_data_message(devid, datalines=as_dicts(datalines))
     packed_message = data_pack(message)
     exchange = settings.PARSED_DATA_HEADERS_EXCHANGE
-    logger.debug(f'exchange={settings.PARSED_DATA_EXCHANGE} key={key}  packed_message={packed_message}')
-    config = {}
+    if logger.isEnabledFor(logging.DEBUG):  # Don't format packed_message for nothing
+        logger.debug(f'exchange={settings.PARSED_DATA_EXCHANGE} key={key}  packed_message={packed_message}')
     # TODO: implement and use get_datalogger_config()
-    if datalogger.application:
-        config = json.loads(datalogger.application.config)
-    # TODO: get influxdb variables from Application / Datalogger / Forward etc config
-    if 'influxdb_database' in config and 'influxdb_measurement' in config:
-        config['influxdb'] = '1'
-        if override_measurement is not None:
-            config['influxdb_measurement'] = override_measurement
-    send_message(exchange, '', packed_message, headers=config)
+    template, influxdb_enabled = get_application_headers(datalogger.application)
+    headers = dict(template)
+    if influxdb_enabled and override_measurement is not None:
+        headers['influxdb_measurement'] = override_measurement
+    send_message(exchange, '', packed_message, headers=headers)
 
 
-def parse_thingpark_request(serialised_request, data):
+def decode_thingpark_request(serialised_request, data, datalogger):
+    """
+    Decode the payload of a Thingpark uplink to datalines.
+    :param dict serialised_request: serialised request
+    :param dict data: decoded JSON body, containing DevEUI_uplink
+    :param datalogger: Datalogger of the uplink's DevEUI
+    :return: list of (override_measurement, datalines) tuples
+    :raises ValueError: if the decoder fails to parse the payload
+    """
     d = data['DevEUI_uplink']
-    devid = d['DevEUI']
     port = d['FPort']
-    datalogger, created = get_datalogger(devid=devid, update_activity=False)
-    timestamp = parse(d['Time'])
-    timestamp = timestamp.astimezone(pytz.UTC)
     payload_hex = d['payload_hex']
     rssi = d['LrrRSSI']
-    # TODO: This may fail, so prepare to handle exception properly
-    # Test it by configuring wrong decoder for some Datalogger
-    try:
-        payload = decode_payload(datalogger, payload_hex, port, serialised_request=serialised_request)
-    except ValueError as err:
-        decoder = get_datalogger_decoder(datalogger)
-        err_msg = f'Failed to parse "{payload_hex}" using "{decoder}" for "{devid}": {err}'
-        logger.warning(err_msg)
-        serialised_request['parse_fail'] = {
-            'error_message': str(err),
-            'decoder': get_datalogger_decoder(datalogger)
-        }
-        save_parse_fail_datalogger_message(devid, data_pack(serialised_request))
-        return True
+    payload = decoder_table.decode(datalogger, payload_hex, port, serialised_request=serialised_request)
     logging.debug(payload)
 
     # Some sensors may already return a dict of lists of datalines
     if not payload:
-        return True
+        return []
+    results = []
     if isinstance(payload, dict) and isinstance(payload[list(payload.keys())[0]], dict):
         parsed_data = payload
         for k in parsed_data.keys():
             datalines = parsed_data[k]['datalines']
             if len(datalines) > 0:
-                datalines[-1]['data']['rssi'] = float(rssi)  # Add rssi value to the latest dataline
-                send_to_exchange(devid, datalogger, datalines, override_measurement=k)
+                set_value(datalines[-1], 'rssi', float(rssi))  # Add rssi value to the latest dataline
+                results.append((k, datalines))
     else:  # Some sensors may already return a list of datalines
         if isinstance(payload, list):
             datalines = payload  # Use payload as datalines (which already have timestamps)
         else:
+            timestamp = parse_lorawan_time(d['Time'])
             dataline = create_dataline(timestamp, payload)  # Create dataline from LoRaWAN timestamp and payload
             datalines = [dataline]
-        datalines[-1]['data']['rssi'] = float(rssi)  # Add rssi value to the latest dataline
-        send_to_exchange(devid, datalogger, datalines)
+        set_value(datalines[-1], 'rssi', float(rssi))  # Add rssi value to the latest dataline
+        results.append((None, datalines))
+    return results
+
+
+def parse_thingpark_request(serialised_request, data):
+    d = data['DevEUI_uplink']
+    devid = d['DevEUI']
+    datalogger, created = get_datalogger(devid=devid, update_activity=False)
+    # TODO: This may fail, so prepare to handle exception properly
+    # Test it by configuring wrong decoder for some Datalogger
+    try:
+        results = decode_thingpark_request(serialised_request, data, datalogger)
+    except ValueError as err:
+        payload_hex = d['payload_hex']
+        decoder = get_datalogger_decoder(datalogger)
+        err_msg = f'Failed to parse "{payload_hex}" using "{decoder}" for "{devid}": {err}'
+        logger.warning(err_msg)
+        serialised_request['parse_fail'] = {
+            'error_message': str(err),
+            'decoder': get_datalogger_decoder(datalogger)
+        }
+        packed_request = data_pack(serialised_request)
+        save_parse_fail_datalogger_message(devid, packed_request)
+        if getattr(settings, 'THINGPARK_PARSE_FAIL_ARCHIVE', True):
+            ParseFailMessage.objects.create(devid=devid, decoder=decoder, error_message=str(err),
+                                            message=packed_request)
+        return True
+    for override_measurement, datalines in results:
+        send_to_exchange(devid, datalogger, datalines, override_measurement=override_measurement)
     return True
 
 
-def consumer_callback(channel, method, properties, body, options=None):
+def handle_message(body):
     serialised_request = data_unpack(body)
     ok, data = decode_json_body(serialised_request['request.body'])
     if ok and 'DevEUI_uplink' in data:
@@ -94,15 +124,196 @@ def consumer_callback(channel, method, properties, body, options=None):
         logger.debug(json.dumps(data, indent=2))
     else:
         logger.warning(f'DevEUI_uplink was not found in data.')
+
+
+def consumer_callback(channel, method, properties, body, options=None):
+    handle_message(body)
     channel.basic_ack(method.delivery_tag)
 
 
+def limit_prefetch(channel, prefetch_count):
+    """
+    Limit unacked deliveries on the command's `channel` to `prefetch_count`.
+    RabbitCommand has started consuming when a consumer callback first sees the channel, and QoS with
+    global=False only applies to consumers started after it. The limit is therefore set for the whole
+    channel (global=True), which RabbitMQ applies to deliveries of its running consumer too.
+    """
+    channel.basic_qos(prefetch_count=prefetch_count, global_qos=True)
+
+
+class BatchConsumer:
+    """
+    Consumer callback which collects up to `batch_size` messages, handles them
+    together and acks the whole batch with one basic_ack(multiple=True).
+    A partial batch is handled after `batch_timeout` seconds.
+    Messages which raise an exception are rejected one by one.
+    RabbitMQ delivers one batch before waiting for acks.
+    """
+
+    def __init__(self, batch_size, batch_timeout):
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.prefetch_count = batch_size
+        self.batch = []
+        self.timer = None
+        self.prefetch_limited = False
+
+    def __call__(self, channel, method, properties, body, options=None):
+        if self.prefetch_limited is False:
+            limit_prefetch(channel, self.prefetch_count)
+            self.prefetch_limited = True
+        self.batch.append((method.delivery_tag, body))
+        if len(self.batch) >= self.batch_size:
+            self.flush(channel)
+        elif self.timer is None:
+            self.timer = channel.connection.call_later(self.batch_timeout, lambda: self.flush(channel))
+
+    def flush(self, channel):
+        if self.timer is not None:
+            channel.connection.remove_timeout(self.timer)
+            self.timer = None
+        batch, self.batch = self.batch, []
+        last_ok_tag = None
+        for delivery_tag, body in batch:
+            try:
+                handle_message(body)
+                last_ok_tag = delivery_tag
+            except Exception as err:
+                logger.exception(f'Failed to handle message {delivery_tag}: {err}')
+                channel.basic_reject(delivery_tag, requeue=False)
+        # All earlier deliveries are either in this batch or already settled,
+        # so acking up to the last successful tag acks exactly the successful ones
+        if last_ok_tag is not None:
+            channel.basic_ack(last_ok_tag, multiple=True)
+        logger.debug(f'Handled batch of {len(batch)} messages')
+
+
+def decode_worker(tasks, results):
+    """
+    Worker process main loop: handle (delivery_tag, body) tuples from `tasks`
+    until None is received and report (delivery_tag, success) to `results`.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Parent process takes care of shutting down
+    for delivery_tag, body in iter(tasks.get, None):
+        try:
+            handle_message(body)
+            results.put((delivery_tag, True))
+        except Exception as err:
+            logger.exception(f'Failed to handle message {delivery_tag}: {err}')
+            results.put((delivery_tag, False))
+    logger.info(f'Payload cache: {payload_cache.stats()}')
+
+
+class WorkerPoolConsumer:
+    """
+    Consumer callback which fans messages out to `workers` processes.
+    Messages are sharded by routing key (which contains the devid), so
+    messages of one device are always handled in order by the same worker.
+    A message is acked only after its worker has published the result.
+    Prefetch limits the number of messages queued to the workers.
+    If a worker dies (e.g. it is killed for running out of memory), the
+    messages it hadn't finished are requeued and the worker is restarted.
+    """
+    poll_interval = 0.05
+
+    def __init__(self, workers, prefetch_per_worker=20):
+        self.prefetch_count = workers * prefetch_per_worker
+        self.channel = None
+        self.ctx = multiprocessing.get_context('fork')
+        self.results = self.ctx.Queue()
+        self.tasks = [None] * workers
+        self.processes = [None] * workers
+        self.outstanding = [set() for _ in range(workers)]  # unsettled delivery tags of each worker
+        self.shard_of = {}  # delivery tag -> worker
+        for shard in range(workers):
+            self.start_worker(shard)
+        logger.info(f'Started {workers} decode workers')
+
+    def start_worker(self, shard):
+        # Forked children must not share parent's database connections
+        db.connections.close_all()
+        # A new queue, because a killed worker may leave the old one's lock held
+        self.tasks[shard] = self.ctx.Queue()
+        self.processes[shard] = self.ctx.Process(target=decode_worker, args=(self.tasks[shard], self.results),
+                                                 daemon=True)
+        self.processes[shard].start()
+
+    def __call__(self, channel, method, properties, body, options=None):
+        if self.channel is None:
+            self.channel = channel
+            limit_prefetch(channel, self.prefetch_count)
+            channel.connection.call_later(self.poll_interval, self.poll)
+        shard = zlib.crc32(method.routing_key.encode()) % len(self.tasks)
+        self.outstanding[shard].add(method.delivery_tag)
+        self.shard_of[method.delivery_tag] = shard
+        self.tasks[shard].put((method.delivery_tag, body))
+
+    def poll(self):
+        self.settle()
+        self.restart_dead_workers()
+        self.channel.connection.call_later(self.poll_interval, self.poll)
+
+    def restart_dead_workers(self):
+        """Requeue unsettled messages of workers which have died and start new workers in their place."""
+        for shard, process in enumerate(self.processes):
+            if process.is_alive():
+                continue
+            tags = sorted(self.outstanding[shard])
+            logger.error(f'Decode worker {process.pid} died with exit code {process.exitcode}, '
+                         f'requeuing its {len(tags)} unfinished messages')
+            for delivery_tag in tags:
+                del self.shard_of[delivery_tag]
+                self.channel.basic_reject(delivery_tag, requeue=True)
+            self.outstanding[shard].clear()
+            self.start_worker(shard)
+
+    def settle(self):
+        """Ack or reject all messages the workers have finished."""
+        while True:
+            try:
+                delivery_tag, ok = self.results.get_nowait()
+            except queue.Empty:
+                return
+            shard = self.shard_of.pop(delivery_tag, None)
+            if shard is None:  # Requeued already, because its worker died
+                continue
+            self.outstanding[shard].discard(delivery_tag)
+            if ok:
+                self.channel.basic_ack(delivery_tag)
+            else:
+                self.channel.basic_reject(delivery_tag, requeue=False)
+
+    def close(self):
+        """Let workers finish queued messages, then ack what can still be acked."""
+        for tasks in self.tasks:
+            tasks.put(None)
+        for p in self.processes:
+            p.join()
+        if self.channel is None:
+            return
+        try:
+            self.settle()
+        except Exception as err:
+            # Unacked messages will be redelivered by RabbitMQ
+            logger.warning(f'Could not ack finished messages on shutdown: {err}')
+
+
+def exit_on_sigterm(signum, frame):
+    sys.exit(0)
+
+
 class Command(RabbitCommand):
     help = 'Decode thingpark'
 
     def add_arguments(self, parser):
         parser.add_argument('--prefix', type=str,
                             help='queue and routing_key prefix, overrides settings.ROUTING_KEY_PREFIX')
+        parser.add_argument('--batch-size', type=int, default=1,
+                            help='Handle and ack messages in batches of this size (also sets prefetch count)')
+        parser.add_argument('--batch-timeout', type=float, default=1.0,
+                            help='Max seconds to wait for a batch to fill up')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of decode worker processes')
         super().add_arguments(parser)
 
     def handle(self, *args, **options):
@@ -116,5 +327,22 @@ class Command(RabbitCommand):
         options['exchange'] = settings.RAW_HTTP_EXCHANGE
         options['routing_key'] = f'{prefix}.{name}.#'
         options['queue'] = f'{prefix}_decode_{name}_http_queue'
-        options['consumer_callback'] = consumer_callback
-        super().handle(*args, **options)
+        if options['workers'] > 1 and options['batch_size'] > 1:
+            raise CommandError('--workers and --batch-size can not be used together')
+        if options['workers'] > 1:
+            pool = WorkerPoolConsumer(options['workers'])
+            options['consumer_callback'] = pool
+            signal.signal(signal.SIGTERM, exit_on_sigterm)
+            try:
+                super().handle(*args, **options)
+            finally:
+                pool.close()
+            return
+        if options['batch_size'] > 1:
+            options['consumer_callback'] = BatchConsumer(options['batch_size'], options['batch_timeout'])
+        else:
+            options['consumer_callback'] = consumer_callback
+        try:
+            super().handle(*args, **options)
+        finally:
+            logger.info(f'Payload cache: {payload_cache.stats()}')
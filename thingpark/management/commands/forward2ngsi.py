@@ -14,6 +14,7 @@ See also https://github.com/Fiware/dataModels/issues/292
 NOTE: this is deprecated and will be replaced with Forward
 """
 
+import copy
 import json
 import logging
 
@@ -23,6 +24,7 @@ from django.conf import settings
 from broker.management.commands import RabbitCommand
 from broker.models import Forward
 from broker.utils import data_unpack
+from thingpark.ngsi import get_coalescer, get_upserter, spool_entities, start_spool
 from thingpark.utils import get_datalogger
 
 logger = logging.getLogger('thingpark')
@@ -53,26 +55,6 @@ ORION_USERNAME = settings.ORION_USERNAME
 ORION_PASSWORD = settings.ORION_PASSWORD
 
 
-def push_ngsi_orion(data, url_root, username, password):
-    # device_id = data['id']
-    res = None
-    res = requests.post('{}/entities/'.format(url_root), auth=(username, password), json=data)
-    try:  # ...to update the entity...
-        patch_data = data.copy()
-        # Remove illegal keys from patch data
-        del patch_data['id']
-        del patch_data['type']
-        res = requests.patch('{}/entities/{}/attrs/?options=keyValues'.format(url_root, data['id']),
-                             auth=(username, password), json=patch_data)
-    except Exception as err:
-        # logger.error('Something went wrong! Exception: {}'.format(err))
-        print('Something went wrong PATCHing to Orion! Exception: {}'.format(err))
-    # ...if updating failed, the entity probably doesn't exist yet so create it
-    if not res or (res.status_code != 204):
-        res = requests.post('{}/entities/?options=keyValues'.format(url_root), auth=(username, password), json=data)
-    return res
-
-
 def send_to_ngsi(data, options=None):
     devid = data.pop('devid')
     dataline = data['datalines'][0]
@@ -104,17 +86,32 @@ def send_to_ngsi(data, options=None):
         NGSI_DATA['address']['addressCountry'] = ''
         NGSI_DATA['address']['addressLocality'] = ''
         NGSI_DATA['address']['streetAddress'] = ''
-    res = push_ngsi_orion(NGSI_DATA, ORION_URL_ROOT, ORION_USERNAME, ORION_PASSWORD)
-    return res
+    # Only the newest observation of each device within the coalescing window is upserted
+    get_coalescer(ORION_URL_ROOT, 'upsert', upsert_entities).add(copy.deepcopy(NGSI_DATA))
+    return True
+
+
+def upsert_entities(entities):
+    upserter = get_upserter(ORION_URL_ROOT, auth=(ORION_USERNAME, ORION_PASSWORD))
+    for entity in entities:
+        try:
+            res = upserter.upsert(entity)
+        except requests.RequestException as err:
+            logger.warning(f'Request to <{ORION_URL_ROOT}> failed: {err}')
+            spool_entities(ORION_URL_ROOT, [entity])
+            continue
+        if res.ok:
+            logger.info(f'Upsert of {entity["id"]} returned {res.status_code} from <{ORION_URL_ROOT}>')
+        else:
+            logger.warning(f'Upsert of {entity["id"]} FAILED with {res.status_code} <{ORION_URL_ROOT}>')
+            if res.status_code >= 500:
+                spool_entities(ORION_URL_ROOT, [entity])
 
 
 def consumer_callback(channel, method, properties, body, options=None):
     data = data_unpack(body)
-    res = send_to_ngsi(data, options=options)
-    if res:
-        logger.info(f'push_ngsi_orion returned {res.status_code} from <{ORION_URL_ROOT}>')
-    else:
-        logger.warning(f'push_ngsi_orion FAILED <{ORION_URL_ROOT}>')
+    if not send_to_ngsi(data, options=options):
+        logger.debug(f'Message was not forwarded to <{ORION_URL_ROOT}>')
     channel.basic_ack(method.delivery_tag)
 
 
@@ -138,4 +135,7 @@ class Command(RabbitCommand):
         options['routing_key'] = f'{prefix}.#'  # We want to catch all messages in this handler
         options['queue'] = f'{prefix}_{name}_queue'
         options['consumer_callback'] = consumer_callback
+        # Replay entities spooled before a restart, the upserter provides Orion's credentials for it
+        if start_spool(name) is not None:
+            get_upserter(ORION_URL_ROOT, auth=(ORION_USERNAME, ORION_PASSWORD))
         super().handle(*args, **options)
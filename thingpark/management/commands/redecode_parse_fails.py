@@ -0,0 +1,115 @@
+"""
+Re-decode archived ParseFailMessages, e.g. after fixing a decoder.
+
+Messages are paged through in id order and decoded in parallel. Recovered
+datalines are published one message per device and measurement per page,
+and recovered records are marked (or deleted with --prune), so running the
+command again only retries messages which still fail.
+"""
+
+import logging
+import multiprocessing
+import time
+from functools import partial
+
+from django import db
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from broker.utils import data_unpack, decode_json_body
+from thingpark.management.commands.decode_thingpark_http import decode_thingpark_request, send_to_exchange
+from thingpark.models import ParseFailMessage
+from thingpark.utils import find_datalogger, get_datalogger, imap_bounded
+
+logger = logging.getLogger('thingpark')
+
+
+def redecode_page(rows, dry_run=False):
+    """
+    Decode a page of (id, devid, message) tuples. A dry run doesn't create Dataloggers of unknown devids.
+    :return: tuple (list of (id, devid, [(override_measurement, datalines), ...]), list of failed ids)
+    """
+    recovered, failed = [], []
+    for pk, devid, message in rows:
+        serialised_request = data_unpack(bytes(message))
+        ok, data = decode_json_body(serialised_request['request.body'])
+        if not ok or 'DevEUI_uplink' not in data:
+            failed.append(pk)
+            continue
+        if dry_run:
+            datalogger = find_datalogger(devid)
+        else:
+            datalogger, created = get_datalogger(devid=devid, update_activity=False)
+        try:
+            recovered.append((pk, devid, decode_thingpark_request(serialised_request, data, datalogger)))
+        except ValueError as err:
+            logger.debug(f'ParseFailMessage {pk} of "{devid}" still fails: {err}')
+            failed.append(pk)
+    return recovered, failed
+
+
+class Command(BaseCommand):
+    help = 'Re-decode archived parse failures and publish recovered data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--decoder', type=str, help='Only messages which failed with this decoder')
+        parser.add_argument('--devid', type=str, nargs='+', help='Only messages of these devids')
+        parser.add_argument('--page-size', type=int, default=500, help='Number of messages fetched at once')
+        parser.add_argument('--workers', type=int, default=1, help='Number of decode processes')
+        parser.add_argument('--prune', action='store_true', help='Delete recovered messages instead of marking')
+        parser.add_argument('--dry-run', action='store_true', help='Decode but do not publish or mark anything')
+
+    def pages(self, queryset, page_size):
+        last_id = 0
+        while True:
+            rows = list(queryset.filter(id__gt=last_id).order_by('id').values_list('id', 'devid', 'message')[:page_size])
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            yield rows
+
+    def handle(self, *args, **options):
+        queryset = ParseFailMessage.objects.filter(recovered_at__isnull=True)
+        if options['decoder']:
+            queryset = queryset.filter(decoder=options['decoder'])
+        if options['devid']:
+            queryset = queryset.filter(devid__in=options['devid'])
+        pages = self.pages(queryset, options['page_size'])
+        redecode = partial(redecode_page, dry_run=options['dry_run'])
+
+        pool = None
+        if options['workers'] > 1:
+            db.connections.close_all()  # Forked children must not share parent's database connections
+            pool = multiprocessing.get_context('fork').Pool(options['workers'])
+            # Pages are queried in this thread, only as fast as the workers decode them
+            results = imap_bounded(pool, redecode, pages, 2 * options['workers'])
+        else:
+            results = map(redecode, pages)
+
+        start = time.time()
+        recovered_cnt, failed_cnt = 0, 0
+        try:
+            for recovered, failed in results:
+                recovered_cnt += len(recovered)
+                failed_cnt += len(failed)
+                if options['dry_run'] or not recovered:
+                    continue
+                # Publish datalines of each device and measurement in this page as one message
+                batches = {}
+                for pk, devid, measurements in recovered:
+                    for override_measurement, datalines in measurements:
+                        batches.setdefault((devid, override_measurement), []).extend(datalines)
+                for (devid, override_measurement), datalines in batches.items():
+                    datalogger, created = get_datalogger(devid=devid, update_activity=False)
+                    send_to_exchange(devid, datalogger, datalines, override_measurement=override_measurement)
+                recovered_ids = ParseFailMessage.objects.filter(id__in=[r[0] for r in recovered])
+                if options['prune']:
+                    recovered_ids.delete()
+                else:
+                    recovered_ids.update(recovered_at=timezone.now())
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        self.stdout.write(f'Recovered {recovered_cnt} messages, {failed_cnt} still fail '
+                          f'({time.time() - start:.2f} s)')
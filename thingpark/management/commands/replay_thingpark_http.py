@@ -0,0 +1,149 @@
+"""
+Re-decode raw Thingpark requests from a file without RabbitMQ.
+
+Input file contains serialised requests, as produced by serialize_django_request():
+either one JSON object per line (request.body as a string) or a stream of
+msgpack objects like the ones ThingparkEndpoint sends to RAW_HTTP_EXCHANGE.
+"""
+
+import json
+import logging
+import multiprocessing
+import time
+from functools import partial
+
+from django import db
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from broker.utils import create_parsed_data_message, decode_json_body
+from thingpark.dataline import as_dicts
+from thingpark.management.commands.decode_thingpark_http import decode_thingpark_request, send_to_exchange
+from thingpark.utils import find_datalogger, get_datalogger, imap_bounded
+
+logger = logging.getLogger('thingpark')
+
+
+def read_jsonl(f):
+    for line in f:
+        line = line.strip()
+        if line:
+            serialised_request = json.loads(line)
+            body = serialised_request['request.body']
+            if isinstance(body, str):
+                serialised_request['request.body'] = body.encode('utf8')
+            yield serialised_request
+
+
+def read_msgpack(f):
+    import msgpack
+
+    yield from msgpack.Unpacker(f, raw=False)
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def replay_chunk(serialised_requests, dry_run=False):
+    """
+    Decode a list of serialised requests. A dry run doesn't create Dataloggers of unknown devids.
+    :return: tuple (list of (devid, [(override_measurement, datalines), ...]), number of failures)
+    """
+    decoded = []
+    failures = 0
+    for serialised_request in serialised_requests:
+        ok, data = decode_json_body(serialised_request['request.body'])
+        if not ok or 'DevEUI_uplink' not in data:
+            continue
+        devid = data['DevEUI_uplink']['DevEUI']
+        if dry_run:
+            datalogger = find_datalogger(devid)
+        else:
+            datalogger, created = get_datalogger(devid=devid, update_activity=False)
+        try:
+            decoded.append((devid, decode_thingpark_request(serialised_request, data, datalogger)))
+        except ValueError as err:
+            logger.warning(f'Failed to parse request of "{devid}": {err}')
+            failures += 1
+    return decoded, failures
+
+
+class Command(BaseCommand):
+    help = 'Decode raw Thingpark requests from a JSONL or msgpack file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', type=str, help='File containing serialised requests')
+        parser.add_argument('--format', choices=['jsonl', 'msgpack'],
+                            help='Input format, guessed from file name by default')
+        parser.add_argument('--output', type=str, help='Write parsed data messages to this JSONL file')
+        parser.add_argument('--exchange', action='store_true',
+                            help='Publish parsed data to settings.PARSED_DATA_HEADERS_EXCHANGE')
+        parser.add_argument('--dry-run', action='store_true', help='Only decode and report throughput')
+        parser.add_argument('--workers', type=int, default=1, help='Number of decode processes')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Number of requests sent to a decode process at once')
+
+    def handle(self, *args, **options):
+        if not (options['dry_run'] or options['output'] or options['exchange']):
+            raise CommandError('Give --output, --exchange or --dry-run')
+        fmt = options['format']
+        if fmt is None:
+            fmt = 'jsonl' if options['input'].endswith(('.jsonl', '.json')) else 'msgpack'
+        if fmt == 'jsonl':
+            f = open(options['input'], 'rt')
+            serialised_requests = read_jsonl(f)
+        else:
+            f = open(options['input'], 'rb')
+            serialised_requests = read_msgpack(f)
+        out = open(options['output'], 'wt') if options['output'] and not options['dry_run'] else None
+        chunks = chunked(serialised_requests, options['chunk_size'])
+        replay = partial(replay_chunk, dry_run=options['dry_run'])
+
+        pool = None
+        if options['workers'] > 1:
+            db.connections.close_all()  # Forked children must not share parent's database connections
+            pool = multiprocessing.get_context('fork').Pool(options['workers'])
+            # Input is read only as fast as the workers decode it
+            results = imap_bounded(pool, replay, chunks, 2 * options['workers'])
+        else:
+            results = map(replay, chunks)
+
+        start = time.time()
+        uplinks, datalines_cnt, failures = 0, 0, 0
+        try:
+            for decoded, chunk_failures in results:
+                failures += chunk_failures
+                uplinks += len(decoded) + chunk_failures
+                for devid, measurements in decoded:
+                    for override_measurement, datalines in measurements:
+                        datalines_cnt += len(datalines)
+                        if options['dry_run']:
+                            continue
+                        if out is not None:
+                            message = create_parsed_data_message(devid, datalines=as_dicts(datalines))
+                            if override_measurement is not None:
+                                message['measurement'] = override_measurement
+                            out.write(json.dumps(message, default=str) + '\n')
+                        if options['exchange']:
+                            datalogger, created = get_datalogger(devid=devid, update_activity=False)
+                            send_to_exchange(devid, datalogger, datalines, override_measurement=override_measurement)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            f.close()
+            if out is not None:
+                out.close()
+        duration = time.time() - start
+        self.stdout.write(f'Decoded {uplinks} uplinks ({failures} failed) to {datalines_cnt} datalines '
+                          f'in {duration:.2f} s, {uplinks / max(duration, 1e-9):.0f} uplinks/s')
+        if options['exchange']:
+            self.stdout.write(f'Published to {settings.PARSED_DATA_HEADERS_EXCHANGE}')
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.25 on 2026-10-18 06:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('thingpark', '0002_rename_related'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParseFailMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('devid', models.CharField(db_index=True, max_length=256)),
+                ('decoder', models.CharField(blank=True, db_index=True, max_length=128)),
+                ('error_message', models.CharField(blank=True, max_length=10000)),
+                ('message', models.BinaryField(help_text='Serialised request packed with data_pack()')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('recovered_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+            ],
+        ),
+    ]
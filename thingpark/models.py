@@ -47,6 +47,19 @@ class DataloggerForward(models.Model):
         self.config = json.dumps(config, indent=1)
 
 
+class ParseFailMessage(models.Model):
+    """Raw request which failed to decode, kept for re-decoding after decoder fixes."""
+    devid = models.CharField(db_index=True, max_length=256)
+    decoder = models.CharField(db_index=True, max_length=128, blank=True)
+    error_message = models.CharField(max_length=10000, blank=True)
+    message = models.BinaryField(help_text='Serialised request packed with data_pack()')
+    created_at = models.DateTimeField(auto_now_add=True)
+    recovered_at = models.DateTimeField(blank=True, null=True, db_index=True)
+
+    def __str__(self):
+        return f'{self.devid} ({self.decoder}) {self.created_at}'
+
+
 # class LorawanMsg(models.Model):
 #     datalogger = models.ForeignKey(Datalogger, on_delete=models.CASCADE)
 #     rssi = models.CharField(max_length=256, blank=True)
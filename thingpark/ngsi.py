@@ -0,0 +1,556 @@
+"""
+NGSI v2 clients: a batching sink and a single entity upserter.
+
+Instead of one request per observation, NgsiBatchSink collects entities
+(in key-values format) of all devices for a short time and upserts them
+with a single
+
+    POST {url_root}/op/update?options=keyValues
+    {"actionType": "append", "entities": [...]}
+
+A batch is sent when it has max_batch_size entities or flush_interval
+seconds after its first entity was added. If Orion rejects a batch because
+of invalid entities (400 or 422), it is split in halves which are sent
+again, until the rejected entities are isolated and dropped. Other errors
+(e.g. 401, 413, 429 and 5xx) concern the whole batch, which is not split.
+Batches are sent one at a time, so observations of an entity reach Orion
+in the order they were added.
+
+Forwards put a thingpark.coalescer.Coalescer in front of the sink and the
+upserter, so that only the newest observation of an entity within a short
+window is sent.
+
+Entities which couldn't be sent because Orion was unreachable or failed
+(5xx) are stored in thingpark.spool.Spool, if THINGPARK_SPOOL_DIR is set,
+and replayed in batches when Orion recovers. Each forwarding process has
+a spool directory of its own, see start_spool(). Entities spooled before
+a restart are replayed once the process has started its spool, they are
+not left waiting for the next failure. A spooled entity is not
+replayed if a newer observation of it has been delivered, is queued or is
+being sent. Replays don't hold up live batches: a live batch sent while an
+older observation of one of its entities is replayed is sent again after
+the replay. Spooled entities of a target which isn't configured in this
+process (yet) are parked in a spool of their own, which is replayed once
+live data configures the target (and its credentials).
+
+NgsiUpserter updates one entity per call. It remembers (in an LRU) the ids
+of entities which exist in Orion: known entities are updated with one
+PATCH, unknown ones are created with one POST.
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import quote, urlsplit, urlunsplit
+
+import requests
+from django.conf import settings
+
+from thingpark.coalescer import Coalescer
+from thingpark.httpclient import get_client, get_option
+from thingpark.spool import Drainer, Spool, SpoolLocked
+
+logger = logging.getLogger('thingpark')
+
+
+class NgsiBatchSink:
+    """
+    :param str url_root: NGSI v2 root, e.g. http://orion:1026/v2
+    :param int max_batch_size: max number of entities in one request
+    :param float flush_interval: max seconds an entity waits before it is sent
+    :param auth: passed to requests, e.g. (username, password)
+    :param dict config: forward config, see thingpark.httpclient.get_client()
+    """
+
+    def __init__(self, url_root, max_batch_size=100, flush_interval=1.0, auth=None, config=None):
+        self.url_root = url_root.rstrip('/')
+        self.url = f'{self.url_root}/op/update'
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.auth = auth
+        self.client = get_client(self.url, config)
+        self._pending = []
+        self._first_added_at = None
+        self._sending = set()  # ids of the live batch being sent
+        self._replaying = set()  # ids of spooled entities being sent
+        self._resend = {}  # id -> live entity sent while an older observation of it was replayed
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.entities = 0
+        self.requests = 0
+        self.splits = 0
+        self.rejected = 0
+        self.failed = 0
+        self._flusher = threading.Thread(target=self._flush_periodically, name='ngsi-flusher', daemon=True)
+        self._flusher.start()
+
+    def add(self, entity):
+        """
+        Queue `entity` (key-values dict with id and type) to be sent in the next batch.
+        A full batch is sent in the caller's thread.
+        """
+        with self._lock:
+            if not self._pending:
+                self._first_added_at = time.monotonic()
+            self._pending.append(entity)
+            self.entities += 1
+            full = len(self._pending) >= self.max_batch_size
+        if full:
+            self.flush()
+
+    def add_many(self, entities):
+        for entity in entities:
+            self.add(entity)
+
+    def flush(self):
+        """Send all queued entities"""
+        with self._send_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            for i in range(0, len(pending), self.max_batch_size):
+                batch = pending[i:i + self.max_batch_size]
+                with self._lock:
+                    self._sending = {entity['id'] for entity in batch}
+                    for entity in batch:
+                        if entity['id'] in self._replaying:
+                            self._resend[entity['id']] = entity
+                try:
+                    failed = self.send(batch)
+                finally:
+                    with self._lock:
+                        self._sending = set()
+                if failed:
+                    spool_entities(self.url_root, failed)
+
+    def replay(self, entities):
+        """
+        Send spooled `entities` in batches without waiting for live batches. Entities whose newer
+        observation is queued or being sent are skipped.
+        :return: list of entities which were not sent, see send()
+        """
+        with self._lock:
+            busy = {entity['id'] for entity in self._pending} | self._sending | self._replaying
+            entities = [entity for entity in entities if entity['id'] not in busy]
+            ids = {entity['id'] for entity in entities}
+            self._replaying |= ids
+        try:
+            for i in range(0, len(entities), self.max_batch_size):
+                if self.send(entities[i:i + self.max_batch_size]):
+                    return entities[i:]  # Orion is still failing, don't try the rest now
+            return []
+        finally:
+            with self._lock:
+                self._replaying -= ids
+                resend = [self._resend.pop(entity_id) for entity_id in ids if entity_id in self._resend]
+            self.add_many(resend)  # Newer than the replayed ones, which may have landed after them
+
+    def send(self, entities):
+        """
+        Upsert `entities` in one request, split and retry rejected batches.
+        :return: list of entities which were not sent because of connection errors or errors which
+            concern the whole batch, e.g. 401, 429 or 5xx
+        """
+        with self._lock:  # Sends run in forward threads, the flusher and the spool drainer
+            self.requests += 1
+        try:
+            res = self.client.post(self.url, {'actionType': 'append', 'entities': entities},
+                                   params={'options': 'keyValues'}, auth=self.auth)
+        except requests.RequestException as err:
+            with self._lock:
+                self.failed += len(entities)
+            logger.warning(f'POST of {len(entities)} entities to {self.url} failed: {err}')
+            return entities
+        if 200 <= res.status_code < 300:
+            delivered(self.url_root, entities)
+            return []
+        if res.status_code in (400, 422):  # Some entities are invalid
+            if len(entities) > 1:
+                with self._lock:
+                    self.splits += 1
+                half = len(entities) // 2
+                return self.send(entities[:half]) + self.send(entities[half:])
+            with self._lock:
+                self.rejected += 1
+            logger.warning(f'{self.url} rejected entity {entities[0].get("id")}: {res.status_code} {res.text}')
+            return []
+        with self._lock:
+            self.failed += len(entities)
+        logger.warning(f'POST of {len(entities)} entities to {self.url} returned error code {res.status_code}')
+        return entities
+
+    def _flush_periodically(self):
+        while not self._stopped.is_set():
+            with self._lock:
+                first_added_at = self._first_added_at if self._pending else None
+            if first_added_at is None:
+                wait = self.flush_interval
+            else:
+                wait = first_added_at + self.flush_interval - time.monotonic()
+                if wait <= 0:
+                    self.flush()
+                    continue
+            self._stopped.wait(wait)
+
+    def close(self):
+        """Stop the flusher and send queued entities"""
+        self._stopped.set()
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entities': self.entities,
+                'pending': len(self._pending),
+                'requests': self.requests,
+                'splits': self.splits,
+                'rejected': self.rejected,
+                'failed': self.failed,
+            }
+
+
+class NgsiUpserter:
+    """
+    :param str url_root: NGSI v2 root, e.g. http://orion:1026/v2
+    :param auth: passed to requests, e.g. (username, password)
+    :param int max_known: max number of entity ids remembered
+    :param dict config: forward config, see thingpark.httpclient.get_client()
+    """
+
+    def __init__(self, url_root, auth=None, max_known=10000, config=None):
+        self.url_root = url_root.rstrip('/')
+        self.auth = auth
+        self.max_known = max_known
+        self.client = get_client(self.url_root, config)
+        self.known = OrderedDict()
+        self._lock = threading.Lock()
+        self.updates = 0
+        self.patches = 0
+        self.posts = 0
+        self.invalidations = 0
+
+    def remember(self, entity_id):
+        with self._lock:
+            self.known[entity_id] = True
+            self.known.move_to_end(entity_id)
+            if len(self.known) > self.max_known:
+                self.known.popitem(last=False)
+
+    def forget(self, entity_id):
+        with self._lock:
+            if self.known.pop(entity_id, None) is not None:
+                self.invalidations += 1
+
+    def is_known(self, entity_id):
+        with self._lock:
+            if entity_id in self.known:
+                self.known.move_to_end(entity_id)
+                return True
+            return False
+
+    def upsert(self, entity):
+        """
+        Update `entity` (key-values dict with id and type) in Orion, create it if it doesn't exist.
+        :return: requests.Response of the last request
+        :raises requests.RequestException: on connection errors and timeouts
+        """
+        self.updates += 1
+        entity_id = entity['id']
+        if self.is_known(entity_id):
+            res = self.patch(entity)
+            if res.status_code not in (404, 422):
+                if 200 <= res.status_code < 300:
+                    delivered(self.url_root, [entity])
+                return res
+            self.forget(entity_id)  # Removed from Orion or changed, create again
+        self.posts += 1
+        res = self.client.post(f'{self.url_root}/entities', entity, params={'options': 'keyValues'}, auth=self.auth)
+        if res.status_code == 422:  # Already exists, but we didn't know it, e.g. after a restart
+            res = self.patch(entity)
+        if 200 <= res.status_code < 300:
+            self.remember(entity_id)
+            delivered(self.url_root, [entity])
+        return res
+
+    def patch(self, entity):
+        self.patches += 1
+        attrs = {k: v for k, v in entity.items() if k not in ('id', 'type')}
+        return self.client.patch(f'{self.url_root}/entities/{quote(entity["id"], safe="")}/attrs', attrs,
+                                 params={'options': 'keyValues'}, auth=self.auth)
+
+    def stats(self):
+        return {
+            'updates': self.updates,
+            'requests': self.patches + self.posts,
+            'patches': self.patches,
+            'posts': self.posts,
+            'invalidations': self.invalidations,
+            'known': len(self.known),
+        }
+
+
+def url_root_of(url):
+    """Return NGSI v2 root of an entities URL, e.g. http://orion:1026/v2/entities?options=keyValues"""
+    parts = urlsplit(url)
+    path = parts.path.rstrip('/')
+    if path.endswith('/entities'):
+        path = path[:-len('/entities')]
+    return urlunsplit((parts.scheme, parts.netloc, path, '', ''))
+
+
+_sinks = {}
+_registry_lock = threading.Lock()
+
+
+def get_sink(url_root, config=None, auth=None):
+    """
+    Return the shared NgsiBatchSink of `url_root`.
+    batch_size and flush_interval are read from forward `config` or THINGPARK_NGSI_BATCH_SIZE and
+    THINGPARK_NGSI_FLUSH_INTERVAL settings when the sink is created.
+    """
+    sink = _sinks.get(url_root)
+    if sink is None:
+        with _registry_lock:
+            sink = _sinks.get(url_root)
+            if sink is None:
+                sink = NgsiBatchSink(
+                    url_root,
+                    max_batch_size=get_option(config, 'batch_size', 100, prefix='THINGPARK_NGSI_'),
+                    flush_interval=get_option(config, 'flush_interval', 1.0, prefix='THINGPARK_NGSI_'),
+                    auth=auth,
+                    config=config,
+                )
+                _sinks[url_root] = sink
+        start_spool()
+        start_parked(url_root)
+    return sink
+
+
+_upserters = {}
+
+
+def get_upserter(url_root, auth=None):
+    """
+    Return the shared NgsiUpserter of `url_root`, which remembers at most THINGPARK_NGSI_KNOWN_ENTITIES
+    (default 10000) entity ids.
+    """
+    upserter = _upserters.get(url_root)
+    if upserter is None:
+        with _registry_lock:
+            upserter = _upserters.get(url_root)
+            if upserter is None:
+                upserter = NgsiUpserter(url_root, auth=auth,
+                                        max_known=get_option(None, 'known_entities', 10000, prefix='THINGPARK_NGSI_'))
+                _upserters[url_root] = upserter
+        start_spool()
+        start_parked(url_root)
+    return upserter
+
+
+def get_forward_sink(config):
+    """
+    Return the sink of a forward config, which has NGSI v2 `url_root` or entities `url`,
+    and optionally `username` and `password`.
+    """
+    url_root = config['url_root'] if 'url_root' in config else url_root_of(config['url'])
+    auth = (config['username'], config['password']) if 'username' in config else None
+    return get_sink(url_root, config=config, auth=auth)
+
+
+_coalescers = {}
+
+
+def get_coalescer(url_root, kind, emit, config=None):
+    """
+    Return the shared Coalescer of `kind` (e.g. 'batch' or 'upsert') of `url_root`, which passes
+    entities to `emit`. Window is read from forward `config` (coalesce_window) or
+    THINGPARK_NGSI_COALESCE_WINDOW setting when the coalescer is created.
+    :raises ValueError: if the coalescer exists and passes entities to another function than `emit`
+    """
+    key = (url_root, kind)
+    coalescer = _coalescers.get(key)
+    if coalescer is None:
+        with _registry_lock:
+            coalescer = _coalescers.get(key)
+            if coalescer is None:
+                coalescer = Coalescer(emit, window=get_option(config, 'coalesce_window', 1.0,
+                                                              prefix='THINGPARK_NGSI_'))
+                _coalescers[key] = coalescer
+    if coalescer.emit != emit:
+        raise ValueError(f'{kind} coalescer of <{url_root}> emits to {coalescer.emit!r}, not to {emit!r}')
+    return coalescer
+
+
+def get_forward_coalescer(config):
+    """Return the coalescer in front of the batch sink of a forward config, see get_forward_sink()"""
+    sink = get_forward_sink(config)
+    return get_coalescer(sink.url_root, 'batch', sink.add_many, config)
+
+
+_delivered = {}  # (url_root, entity id) -> time.time() of the latest delivery
+SPOOL_SLOTS = 8  # max number of processes of one command spooling at the same time
+_spool = None
+_parked = {}  # url_root -> Spool of entities of a target which wasn't configured when they were replayed
+_parked_drainers = {}
+
+
+def delivered(url_root, entities):
+    now = time.time()
+    for entity in entities:
+        _delivered[(url_root, entity['id'])] = now
+
+
+def create_spool(directory):
+    return Spool(
+        directory,
+        segment_size=get_option(None, 'segment_size', 1024 * 1024, prefix='THINGPARK_SPOOL_'),
+        max_size=get_option(None, 'max_size', 100 * 1024 * 1024, prefix='THINGPARK_SPOOL_'),
+        fsync=get_option(None, 'fsync', 1.0, prefix='THINGPARK_SPOOL_'),
+    )
+
+
+def start_drainer(spool):
+    drainer = Drainer(spool, replay_entities,
+                      batch_size=get_option(None, 'batch_size', 100, prefix='THINGPARK_SPOOL_'),
+                      interval=get_option(None, 'retry_interval', 5.0, prefix='THINGPARK_SPOOL_'))
+    drainer.start()
+    return drainer
+
+
+def start_spool(name='forwards'):
+    """
+    Open the spool of failed entities in directory `name` of THINGPARK_SPOOL_DIR and start its drainer,
+    if it isn't started yet. The process which forwards to Orion calls this: forward2ngsi when it starts
+    (so that entities spooled before a restart are replayed) and the NGSI forwards when they create a sink.
+    Each process locks its directory, another process of the same command uses `name`-2 and so on.
+    :return: Spool, None if THINGPARK_SPOOL_DIR is not set or all SPOOL_SLOTS directories are in use
+    """
+    global _spool
+    root = getattr(settings, 'THINGPARK_SPOOL_DIR', None)
+    if _spool is None and root:
+        with _registry_lock:
+            if _spool is None:
+                for slot in range(1, SPOOL_SLOTS + 1):
+                    directory = os.path.join(root, name if slot == 1 else f'{name}-{slot}')
+                    try:
+                        spool = create_spool(directory)
+                    except SpoolLocked:
+                        continue
+                    start_drainer(spool)
+                    _spool = spool
+                    break
+                else:
+                    logger.error(f'Spool directories {name} in {root} are all in use, failed entities are dropped')
+    return _spool
+
+
+def get_spool():
+    """Return the spool of failed entities, None if it hasn't been started, see start_spool()"""
+    return _spool
+
+
+def get_parked(url_root, create=True):
+    """
+    Return the spool where spooled entities of `url_root` are parked until the target is configured in
+    this process, None if spooling is disabled or (unless `create`) nothing has been parked.
+    """
+    parked = _parked.get(url_root)
+    spool = get_spool()
+    if parked is None and spool is not None:
+        directory = os.path.join(spool.directory, 'parked', quote(url_root, safe=''))
+        if create or os.path.isdir(directory):
+            with _registry_lock:
+                parked = _parked.get(url_root)
+                if parked is None:
+                    parked = _parked[url_root] = create_spool(directory)
+    return parked
+
+
+def start_parked(url_root):
+    """Start replaying entities parked for `url_root`, whose target has been configured"""
+    parked = get_parked(url_root, create=False)
+    if parked is not None and url_root not in _parked_drainers:
+        with _registry_lock:
+            if url_root not in _parked_drainers:
+                _parked_drainers[url_root] = start_drainer(parked)
+
+
+def park(url_root, spooled):
+    """Move spooled (time spooled, entity) tuples of a target which isn't configured to its own spool"""
+    parked = get_parked(url_root)
+    for spooled_at, entity in spooled:
+        parked.append({'url_root': url_root, 'entity': entity}, appended_at=spooled_at)
+    logger.info(f'Parked {len(spooled)} spooled entities of <{url_root}> until it is configured')
+    if url_root in _sinks or url_root in _upserters:  # Configured meanwhile
+        start_parked(url_root)
+
+
+def spool_entities(url_root, entities):
+    """
+    Store entities which failed to be sent to `url_root` to be replayed later.
+    :return: False if spooling is disabled and the entities are lost
+    """
+    spool = get_spool()
+    if spool is None:
+        logger.warning(f'Dropped {len(entities)} entities, spooling is disabled (see THINGPARK_SPOOL_DIR)')
+        return False
+    for entity in entities:
+        spool.append({'url_root': url_root, 'entity': entity})
+    return True
+
+
+def replay_entities(records):
+    """
+    Drainer handler: send spooled entities with the batch sink of their url_root.
+    Entities whose newer observation has been delivered meanwhile are skipped. Entities of a target
+    which isn't configured in this process are parked, see park().
+    :return: True if all entities were delivered, skipped or parked
+    """
+    by_url_root = {}
+    for spooled_at, record in records:
+        by_url_root.setdefault(record['url_root'], []).append((spooled_at, record['entity']))
+    unconfigured = []
+    for url_root, spooled in by_url_root.items():
+        sink = _sinks.get(url_root)
+        if sink is None:
+            upserter = _upserters.get(url_root)
+            if upserter is None:  # Credentials of the target come with its live data
+                unconfigured.append((url_root, spooled))
+                continue
+            sink = get_sink(url_root, auth=upserter.auth)
+        entities = [entity for spooled_at, entity in spooled
+                    if _delivered.get((url_root, entity['id']), 0) <= spooled_at]
+        if sink.replay(entities):
+            return False
+    # Parked only when the whole batch is done, so that a retried batch isn't parked twice
+    for url_root, spooled in unconfigured:
+        park(url_root, spooled)
+    return True
+
+
+def stats():
+    """
+    :return: dict of url_root -> NgsiBatchSink.stats(), coalescer stats and spool stats if spooling is enabled
+    """
+    result = {url_root: sink.stats() for url_root, sink in list(_sinks.items())}
+    result['coalescers'] = {f'{kind} {url_root}': coalescer.stats()
+                            for (url_root, kind), coalescer in list(_coalescers.items())}
+    if _spool is not None:
+        result['spool'] = _spool.stats()
+        result['parked'] = {url_root: parked.stats() for url_root, parked in list(_parked.items())}
+    return result
+
+
+@atexit.register
+def close_sinks():
+    for coalescer in list(_coalescers.values()):
+        coalescer.close()
+    for sink in list(_sinks.values()):
+        sink.close()
+    for parked in list(_parked.values()):
+        parked.close()
+    if _spool is not None:
+        _spool.close()
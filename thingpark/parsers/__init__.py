@@ -4,28 +4,26 @@ from .keyval import parse_keyval
 from .paxcounter import parse_paxcounter
 from .energiaburk import parse_energiaburk
 from .sensornode import parse_sensornode
-from .decentlab import parse_decentlab
+from .decentlab import parse_decentlab, parse_decentlab_sht35
 from .decentlab_pm import parse_decentlab_pm
+from .bulk import decode_many, decode_many_bytes
+from .detect import registry
 
 
-def parse(payload_hex):
+def parse(payload_hex, port=None, devid=None):
     """
-    Try to guess payload format and return parsed data as a dict or None
+    Try to guess payload format and return parsed data as a dict or None.
+    Formats are detected using parser signatures registered in thingpark.parsers.detect.
     :param payload_hex: hex character string
+    :param port: LoRaWAN port
+    :param devid: remember detected format of this device and use it for its later payloads
     :return: dict data or None
     """
-    if len(payload_hex) == 8:
-        data = parse_paxcounter(payload_hex)
-    elif payload_hex[:2] == '13':
-        data = parse_clickey_tempsens(payload_hex)
-    elif payload_hex[:2].lower() == '2a':  # payload_hex[:4].lower() == '2a2a':
-        data = parse_aqburk(payload_hex)
-    elif len(payload_hex) >= 2:  # Assume we have key-val data
-        try:
-            data = parse_keyval(payload_hex)
-        except (UnicodeDecodeError, IndexError) as err:
-            data = None
-    else:
-        data = None
-        # TODO log error
-    return data
+    return registry.parse(payload_hex, port=port, devid=devid)
+
+
+def decode_bytes(buf, port=None, devid=None):
+    """
+    Same as parse(), but for payload as bytes or memoryview.
+    """
+    return registry.decode(buf, port=port, devid=devid)
@@ -1,3 +1,7 @@
+from .detect import registry
+from .layout import Field, Layout
+
+
 def hex2int(hex_str):
     """
     Convert hex characters (e.g. "23" or "011a") to int (35 or 282)
@@ -16,6 +20,38 @@ def hex2value10(hex_str):
     return hex2int(hex_str) / 10.0
 
 
+AQBURK = Layout([
+    Field(None, '2x'),  # "**" header
+    Field('pm25min', 'H', divisor=10),
+    Field('pm25max', 'H', divisor=10),
+    Field('pm25avg', 'H', divisor=10),
+    Field('pm25med', 'H', divisor=10),
+    Field('pm10min', 'H', divisor=10),
+    Field('pm10max', 'H', divisor=10),
+    Field('pm10avg', 'H', divisor=10),
+    Field('pm10med', 'H', divisor=10),
+], byteorder='>', exact=False)
+
+AQBURK_BME = Layout(AQBURK.fields + [
+    Field('temp', 'H', divisor=10, offset=-100, digits=1, unit='°C'),
+    Field('humi', 'H', divisor=10, unit='%'),
+    Field('pres', 'H', divisor=10, unit='hPa'),
+    Field('gas', 'H', divisor=10),
+], byteorder='>')
+
+
+def decode_bytes(buf, port=None):
+    """
+    Decode AQLoRaBurk payload
+    :param buf: payload as bytes or memoryview
+    :param port: LoRaWAN port
+    :return: dict containing float values
+    """
+    if len(buf) == AQBURK_BME.size:
+        return AQBURK_BME.decode(buf)
+    return AQBURK.decode(buf)
+
+
 def parse_aqburk(hex_str, port=None):
     """
     Parse payload like "2a2a0021002c002800300056003b0000" float values
@@ -23,19 +59,7 @@ def parse_aqburk(hex_str, port=None):
     :param port: LoRaWAN port
     :return: dict containing float values
     """
-    data = {
-        'pm25min': hex2value10(hex_str[4:8]),
-        'pm25max': hex2value10(hex_str[8:12]),
-        'pm25avg': hex2value10(hex_str[12:16]),
-        'pm25med': hex2value10(hex_str[16:20]),
-        'pm10min': hex2value10(hex_str[20:24]),
-        'pm10max': hex2value10(hex_str[24:28]),
-        'pm10avg': hex2value10(hex_str[28:32]),
-        'pm10med': hex2value10(hex_str[32:36]),
-    }
-    if len(hex_str) == 52:
-        data['temp'] = round(hex2value10(hex_str[36:40]) - 100, 1)
-        data['humi'] = hex2value10(hex_str[40:44])
-        data['pres'] = hex2value10(hex_str[44:48])
-        data['gas'] = hex2value10(hex_str[48:52])
-    return data
+    return decode_bytes(bytes.fromhex(hex_str), port)
+
+
+registry.register('aqburk', decode_bytes, prefix=b'*', priority=30)
@@ -0,0 +1,167 @@
+"""
+Vectorized decoding of many fixed layout payloads at once with NumPy.
+
+Payloads with the same Layout are joined into one contiguous buffer, which is
+viewed as a NumPy structured array, and the field conversions are applied to
+whole columns. Results are equal to the ones of the per-message parsers.
+
+NumPy is an optional dependency: pip install thingpark[bulk]
+"""
+
+import struct
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+from .aqburk import AQBURK, AQBURK_BME
+from .clickey import CLICKEY_TEMPSENS
+from .energiaburk import AURINKOPENKKI, DAVIS_WEATHER, VICTRON, VICTRON_PHOENIX
+
+# (payload prefix, Layout) in the order they are tried, exact layouts before non-exact ones
+BULK_LAYOUTS = [
+    (b'\x2a', AQBURK_BME),
+    (b'\x0a\x00', VICTRON),
+    (b'\x0a\x02', VICTRON_PHOENIX),
+    (b'\x07\x00', DAVIS_WEATHER),
+    (b'\x3a', AURINKOPENKKI),
+    (b'\x2a', AQBURK),
+    (b'\x13', CLICKEY_TEMPSENS),
+]
+
+NUMPY_TYPES = {'b': 'i1', 'B': 'u1', 'h': 'i2', 'H': 'u2', 'i': 'i4', 'I': 'u4',
+               'l': 'i4', 'L': 'u4', 'q': 'i8', 'Q': 'u8', 'f': 'f4', 'd': 'f8'}
+
+_dtypes = {}
+
+
+def require_numpy():
+    if np is None:
+        raise ImportError('Bulk decoding requires NumPy, install it with "pip install thingpark[bulk]"')
+
+
+def layout_dtype(layout):
+    """
+    Return NumPy structured dtype matching `layout`.
+    :raises ValueError: if layout contains fields NumPy can't represent (e.g. strings)
+    """
+    dtype = _dtypes.get(layout)
+    if dtype is None:
+        names, formats, offsets = [], [], []
+        offset = 0
+        value_index = 0
+        for field in layout.fields:
+            size = struct.calcsize(layout.byteorder + field.fmt)
+            if not field.is_padding:
+                if field.fmt not in NUMPY_TYPES:
+                    raise ValueError(f'Field "{field.name}" with format "{field.fmt}" can not be decoded in bulk')
+                names.append(f'f{value_index}')
+                formats.append(layout.byteorder + NUMPY_TYPES[field.fmt])
+                offsets.append(offset)
+                value_index += 1
+            offset += size
+        dtype = np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': layout.size})
+        _dtypes[layout] = dtype
+    return dtype
+
+
+def convert_column(field, column):
+    """
+    Apply field's conversions to a whole column, in the same order as Field.expression().
+    :return: list of Python values
+    """
+    with np.errstate(invalid='ignore'):  # NaNs are passed through like struct does
+        column = column.astype(np.float64 if column.dtype.kind == 'f' else np.int64)
+    if field.convert is not None:
+        column = field.convert(column)
+    if field.divisor is not None:
+        column = column / field.divisor
+    if field.scale is not None:
+        column = column * field.scale
+    if field.offset is not None:
+        column = column + field.offset
+    values = column.tolist()
+    if field.digits is not None:
+        # Python's round() differs from np.round() in some halfway cases
+        values = [round(v, field.digits) for v in values]
+    return values
+
+
+def decode_columns(buffers, layout):
+    """
+    Decode payloads which all have the same layout.
+    :param list buffers: payloads as bytes
+    :param Layout layout: layout of the payloads
+    :return: dict of field name -> NumPy array
+    """
+    require_numpy()
+    return {name: np.array(values) for name, values in _decode_columns(buffers, layout).items()}
+
+
+def _decode_columns(buffers, layout):
+    size = layout.size
+    buf = b''.join(b[:size] for b in buffers)
+    records = np.frombuffer(buf, dtype=layout_dtype(layout))
+    fields = [f for f in layout.fields if not f.is_padding]
+    return {f.name: convert_column(f, records[f'f{i}']) for i, f in enumerate(fields) if f.name is not None}
+
+
+def build_exact_layouts():
+    """
+    :return: dict of (first byte, second byte, length) -> Layout, for payloads matching a layout exactly
+    """
+    exact_layouts = {}
+    for prefix, layout in reversed(BULK_LAYOUTS):  # Earlier entries win
+        for second in ([prefix[1]] if len(prefix) == 2 else range(256)):
+            exact_layouts[(prefix[0], second, layout.size)] = layout
+    return exact_layouts
+
+
+_exact_layouts = build_exact_layouts()
+
+
+def detect_layout(buf):
+    """
+    Return the Layout of payload `buf` or None, if it isn't a fixed layout payload.
+    """
+    if len(buf) < 2:
+        return None
+    layout = _exact_layouts.get((buf[0], buf[1], len(buf)))
+    if layout is not None:
+        return layout
+    for prefix, layout in BULK_LAYOUTS:
+        if not layout.exact and len(buf) > layout.size and buf[:len(prefix)] == prefix:
+            return layout
+    return None
+
+
+def decode_many(payloads, port=None):
+    """
+    Decode a batch of hex payloads of the fixed length formats (AQBurk, Victron,
+    Victron Phoenix, Davis, Aurinkopenkki, Clickey) at once.
+    Formats are recognised from payload prefix and length, so `port` is not needed.
+    :param list payloads: hex payload strings
+    :param port: LoRaWAN port, not used
+    :return: list of dicts in the same order as payloads, None for unsupported payloads
+    """
+    return decode_many_bytes([bytes.fromhex(p) for p in payloads], port)
+
+
+def decode_many_bytes(buffers, port=None):
+    """
+    Same as decode_many(), but for payloads as bytes or memoryviews.
+    """
+    require_numpy()
+    groups = {}
+    for i, buf in enumerate(buffers):
+        layout = detect_layout(buf)
+        if layout is not None:
+            groups.setdefault(layout, []).append(i)
+    results = [None] * len(buffers)
+    for layout, indexes in groups.items():
+        columns = _decode_columns([buffers[i] for i in indexes], layout)
+        names = list(columns.keys())
+        for i, values in zip(indexes, zip(*columns.values())):
+            results[i] = dict(zip(names, values))
+    return results
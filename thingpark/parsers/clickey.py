@@ -1,12 +1,32 @@
+from .detect import registry
+from .layout import Field, Layout
+
+
+def adc_to_temp(adc):
+    """
+    Convert ADC reading (e.g. 1035) to float temp (25.824175824175825)
+    :param int adc: ADC reading
+    :return: float temperature
+    """
+    return (300 * adc / 4095) - 50
+
+
+def raw_to_volts(value):
+    """
+    Convert raw battery reading (e.g. 254) to float volts (3.5043478260869567)
+    :param int value: raw value
+    :return: float volts
+    """
+    return ((value / 0.23) + 2400) / 1000
+
+
 def calc_temp(hex_str):
     """
     Convert 4 hex characters (e.g. "040b") to float temp (25.824175824175825)
     :param hex_str: hex character string
     :return: float temperature
     """
-    adc = int(hex_str[0:2], 16) * 256 + int(hex_str[2:4], 16)
-    temp = (300 * adc / 4095) - 50
-    return temp
+    return adc_to_temp(int(hex_str[0:4], 16))
 
 
 def calc_volts(hex_str):
@@ -15,16 +35,23 @@ def calc_volts(hex_str):
     :param hex_str: hex character string
     :return: float volts
     """
-    volts = ((int(hex_str, 16) / 0.23) + 2400) / 1000
-    return volts
+    return raw_to_volts(int(hex_str, 16))
+
+
+CLICKEY_TEMPSENS = Layout([
+    Field(None, 'x'),  # message type
+    Field('temp1', 'H', convert=adc_to_temp, unit='°C'),
+    Field('temp2', 'H', convert=adc_to_temp, unit='°C'),
+    Field('volt', 'B', convert=raw_to_volts, unit='V'),
+], byteorder='>', exact=False)
+
+
+def decode_bytes(buf, port=None):
+    return CLICKEY_TEMPSENS.decode(buf)
+
+
+def parse_clickey_tempsens(hex_str, port=None):
+    return decode_bytes(bytes.fromhex(hex_str), port)
 
 
-def parse_clickey_tempsens(hex_str):
-    temp1 = calc_temp(hex_str[2:6])
-    temp2 = calc_temp(hex_str[6:10])
-    volts = calc_volts(hex_str[10:12])
-    return {
-        'temp1': temp1,
-        'temp2': temp2,
-        'volt': volts
-    }
+registry.register('clickey_tempsens', decode_bytes, prefix=b'\x13', priority=20)
@@ -1,105 +1,183 @@
 """
-https://github.com/decentlab/decentlab-decoders/blob/master/DL-TRS12/DL-TRS12.py
+Decoder for Decentlab DL-* sensor payloads, protocol version 2.
+https://github.com/decentlab/decentlab-decoders
+
+All Decentlab models share the same frame format:
+
+    version (1 byte), device id (2 bytes), sensor flags (2 bytes), 16 bit words...
+
+Bit n of flags tells if sensor n of the model is present in the frame, so a
+model is just a list of Sensors. New models are added by registering a
+DecentlabModel, see DECENTLAB_MODELS at the end of this file.
 """
 
 import struct
-from base64 import binascii
+from functools import lru_cache
 
 PROTOCOL_VERSION = 2
 
-SENSORS = [
-    {'length': 3,
-     'values': [{'name': 'Dielectric permittivity',
-                 'convert': lambda x: pow(
-                     0.000000002887 * pow(x[0] / 10, 3) - 0.0000208 * pow(x[0] / 10, 2) + 0.05276 * (
-                             x[0] / 10) - 43.39, 2)},
-                {'name': 'Volumetric water content',
-                 'convert': lambda x: x[0] / 10 * 0.0003879 - 0.6956,
-                 'unit': 'm³⋅m⁻³'},
-                {'name': 'Soil temperature',
-                 'convert': lambda x: (x[1] - 32768) / 10,
-                 'unit': '°C'},
-                {'name': 'Electrical conductivity',
-                 'convert': lambda x: x[2],
-                 'unit': 'µS⋅cm⁻¹'}]},
-    {'length': 1,
-     'values': [{'name': 'Battery voltage',
-                 'convert': lambda x: x[0] / 1000,
-                 'unit': 'V'}]}
-]
-
-
-def decode(msg, hex=False):
+
+class Sensor:
+    """
+    One sensor of a Decentlab model.
+    :param int length: number of 16 bit words the sensor sends
+    :param list fields: (name, unit) of each value `convert` returns
+    :param convert: function taking `length` words as arguments and returning a tuple of values
+    """
+    __slots__ = ('length', 'names', 'units', 'convert')
+
+    def __init__(self, length, fields, convert):
+        self.length = length
+        self.names = tuple(name for name, unit in fields)
+        self.units = {name: unit for name, unit in fields if unit is not None}
+        self.convert = convert
+
+
+class DecentlabModel:
     """
-    msg: payload as one of hex string, list, or bytearray
-
-    return:
-
-    {
-     "Device ID": 4838,
-     "Protocol version": 2,
-     "Dielectric permittivity": {
-      "value": 1.0392113047231324,
-      "unit": null
-     },
-     "Volumetric water content": {
-      "value": 0.002387260000000002,
-      "unit": "m\u00b3\u22c5m\u207b\u00b3"
-     },
-     "Soil temperature": {
-      "value": 20.6,
-      "unit": "\u00b0C"
-     },
-     "Electrical conductivity": {
-      "value": 0,
-      "unit": "\u00b5S\u22c5cm\u207b\u00b9"
-     },
-     "Battery voltage": {
-      "value": 3.037,
-      "unit": "V"
-     }
-    }
+    Decentlab sensor model, e.g. DL-TRS12.
+    :param str name: model name
+    :param list sensors: Sensors in flag bit order
     """
-    bytes_ = bytearray(binascii.a2b_hex(msg)
-                       if hex
-                       else msg)
-    version = bytes_[0]
-    if version != PROTOCOL_VERSION:
-        raise ValueError("protocol version {} doesn't match v2".format(version))
 
-    devid = struct.unpack('>H', bytes_[1:3])[0]
-    bin_flags = bin(struct.unpack('>H', bytes_[3:5])[0])
-    flags = bin_flags[2:].zfill(struct.calcsize('>H') * 8)[::-1]
+    def __init__(self, name, sensors):
+        self.name = name
+        self.sensors = sensors
+        self.units = {}
+        for sensor in sensors:
+            self.units.update(sensor.units)
+
+    def decode(self, buf):
+        """
+        Decode a frame to a flat dict of values of the sensors present in it.
+        :param buf: bytes, bytearray or memoryview
+        :return: dict of field name -> value
+        :raises ValueError: if frame is not a valid protocol v2 frame of this model, or its length
+            doesn't match its sensor flags
+        """
+        if len(buf) < 5 or len(buf) % 2 == 0:
+            raise ValueError(f'Invalid {self.name} frame length {len(buf)}')
+        version, devid, flags, *words = frame_struct(len(buf)).unpack(buf)
+        if version != PROTOCOL_VERSION:
+            raise ValueError(f"protocol version {version} doesn't match v2")
+        data = {}
+        cur = 0
+        for sensor in self.sensors:
+            if flags & 1:
+                end = cur + sensor.length
+                if end > len(words):
+                    raise ValueError(f'{self.name} frame is too short for its sensor flags')
+                data.update(zip(sensor.names, sensor.convert(*words[cur:end])))
+                cur = end
+            flags >>= 1
+        if flags:
+            raise ValueError(f'{self.name} frame has flags of sensors the model does not have')
+        if cur != len(words):
+            raise ValueError(f'{self.name} frame is too long for its sensor flags')
+        return data
+
+
+@lru_cache(maxsize=64)
+def frame_struct(length):
+    """Struct unpacking the whole frame of `length` bytes at once"""
+    return struct.Struct('>BHH' + 'H' * ((length - 5) // 2))
+
+
+def battery(x):
+    return (x / 1000,)
+
+
+BATTERY = Sensor(1, [('batt', 'V')], battery)
+
+
+def trs12_soil(permittivity, temp, conductivity):
+    x = permittivity / 10
+    return (
+        pow(0.000000002887 * pow(x, 3) - 0.0000208 * pow(x, 2) + 0.05276 * x - 43.39, 2),
+        x * 0.0003879 - 0.6956,
+        (temp - 32768) / 10,
+        conductivity,
+    )
+
+
+DL_TRS12 = DecentlabModel('DL-TRS12', [
+    Sensor(3, [('dielectric_permittivity', None),
+               ('volumetric_water_content', 'm³⋅m⁻³'),
+               ('temp_soil', '°C'),
+               ('electrical_conductivity', 'µS⋅cm⁻¹')], trs12_soil),
+    BATTERY,
+])
 
-    words = [struct.unpack('>H', bytes_[i:i + 2])[0]
-             for i
-             in range(5, len(bytes_), 2)]
 
-    cur = 0
-    result = {'Device ID': devid, 'Protocol version': version}
-    for flag, sensor in zip(flags, SENSORS):
-        if flag != '1':
-            continue
+def pm_particles(*x):
+    return (x[0] / 10, x[1] / 10, x[2] / 10, x[3] / 10, x[4],
+            x[5] / 10, x[6] / 10, x[7] / 10, x[8] / 10, x[9] / 10)
 
-        x = words[cur:cur + sensor["length"]]
-        cur += sensor["length"]
-        for value in sensor['values']:
-            if 'convert' not in value:
-                continue
 
-            result[value['name']] = {'value': value['convert'](x),
-                                     'unit': value.get('unit', None)}
+def sht21_air(temp, humi):
+    return 175.72 * temp / 65536 - 46.85, 125 * humi / 65536 - 6
 
-    return result
+
+def pm_pressure(x):
+    return (x * 2,)
+
+
+# Field names are the ones Decentlab uses, because stored PM data already has them
+DL_PM = DecentlabModel('DL-PM', [
+    Sensor(1, [('Battery voltage', 'V')], battery),
+    Sensor(10, [('PM1.0 mass concentration', 'µg⋅m⁻³'),
+                ('PM2.5 mass concentration', 'µg⋅m⁻³'),
+                ('PM4 mass concentration', 'µg⋅m⁻³'),
+                ('PM10 mass concentration', 'µg⋅m⁻³'),
+                ('Typical particle size', 'nm'),
+                ('PM0.5 number concentration', None),
+                ('PM1.0 number concentration', None),
+                ('PM2.5 number concentration', None),
+                ('PM4 number concentration', None),
+                ('PM10 number concentration', None)], pm_particles),
+    Sensor(2, [('Air temperature', '°C'), ('Air humidity', '%')], sht21_air),
+    Sensor(1, [('Barometric pressure', 'Pa')], pm_pressure),
+])
+
+
+def sht35_air(temp, humi):
+    return 175 * temp / 65535 - 45, 100 * humi / 65535
+
+
+DL_SHT35 = DecentlabModel('DL-SHT35', [
+    Sensor(2, [('temp', '°C'), ('humi', '%')], sht35_air),
+    BATTERY,
+])
+
+DECENTLAB_MODELS = {}
+
+
+def register_model(model):
+    DECENTLAB_MODELS[model.name] = model
+    return model
+
+
+for _model in [DL_TRS12, DL_PM, DL_SHT35]:
+    register_model(_model)
+
+
+def decode_decentlab(buf, model):
+    """
+    Decode a Decentlab frame.
+    :param buf: bytes, bytearray or memoryview
+    :param str model: registered model name, e.g. 'DL-TRS12'
+    :return: dict of field name -> value
+    """
+    return DECENTLAB_MODELS[model].decode(buf)
+
+
+def decode_bytes(buf, port=None):
+    return DL_TRS12.decode(buf)
 
 
 def parse_decentlab(hex_str, port=None):
-    decoded = decode(hex_str, hex=True)
-    data = {
-        'dielectric_permittivity': decoded['Dielectric permittivity']['value'],
-        'volumetric_water_content': decoded['Volumetric water content']['value'],
-        'electrical_conductivity': decoded['Electrical conductivity']['value'],
-        'temp_soil': decoded['Soil temperature']['value'],
-        'batt': decoded['Battery voltage']['value'],
-    }
-    return data
+    return decode_bytes(bytes.fromhex(hex_str), port)
+
+
+def parse_decentlab_sht35(hex_str, port=None):
+    return DL_SHT35.decode(bytes.fromhex(hex_str))
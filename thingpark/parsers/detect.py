@@ -0,0 +1,174 @@
+"""
+Payload format auto-detection.
+
+Parsers register a Detector with the signature of their payloads: first
+bytes, possible payload lengths (in bytes) and LoRaWAN ports. Prefixes are
+indexed in a trie and lengths in a dict, so finding the candidates for a
+payload doesn't depend on the number of registered parsers. Candidates are
+tried in priority order (smallest first) and the first one which parses
+the payload wins. A parser wins only if it returns non-empty data, since
+some parsers (e.g. paxcounter) return {} for payloads they don't
+understand. Detectors without prefix and lengths are fallbacks, which are
+tried last.
+
+The detector which parsed a device's payload is remembered per devid, so
+later uplinks of the same device skip detection as long as they match the
+detector's signature and parse to non-empty data.
+"""
+
+from collections import Counter, OrderedDict
+
+
+class Detector:
+    """
+    Payload format signature and parser.
+    :param str name: format name
+    :param decode: function(buf, port=None) returning parsed data, see decode_bytes() of parser modules
+    :param bytes prefix: payload starts with these bytes
+    :param lengths: payload length in bytes is one of these
+    :param ports: LoRaWAN port is one of these (as int)
+    :param int priority: candidates are tried in priority order, smallest first
+    :param check: optional function(bytes) returning False if payload can't be of this format
+    """
+    __slots__ = ('name', 'decode', 'prefix', 'lengths', 'ports', 'priority', 'check')
+
+    def __init__(self, name, decode, prefix=None, lengths=None, ports=None, priority=100, check=None):
+        self.name = name
+        self.decode = decode
+        self.prefix = prefix
+        self.lengths = frozenset(lengths) if lengths is not None else None
+        self.ports = frozenset(int(p) for p in ports) if ports is not None else None
+        self.priority = priority
+        self.check = check
+
+    def matches(self, buf, port):
+        if self.prefix is not None and buf[:len(self.prefix)] != self.prefix:
+            return False
+        if self.lengths is not None and len(buf) not in self.lengths:
+            return False
+        if self.ports is not None and (port is None or int(port) not in self.ports):
+            return False
+        return self.check is None or self.check(buf)
+
+
+def priority(detector):
+    return detector.priority
+
+
+class DetectionRegistry:
+    """
+    Registered Detectors indexed by prefix and length.
+    :param int learned_size: max number of devids whose format is remembered
+    """
+
+    def __init__(self, learned_size=10000):
+        self.detectors = {}
+        self.trie = {}  # byte -> (detectors ending here, child node)
+        self.by_length = {}
+        self.fallbacks = []
+        self.learned = OrderedDict()
+        self.learned_size = learned_size
+        self.fired = Counter()
+        self.failed = Counter()
+        self.learned_hits = 0
+        self.undetected = 0
+
+    def register(self, name, decode, **signature):
+        """Register parser `decode` for payloads matching `signature`, see Detector."""
+        detector = Detector(name, decode, **signature)
+        self.detectors[name] = detector
+        if detector.prefix:
+            node = self.trie
+            for i, b in enumerate(detector.prefix):
+                ending, children = node.setdefault(b, ([], {}))
+                if i == len(detector.prefix) - 1:
+                    ending.append(detector)
+                node = children
+        elif detector.lengths is not None:
+            for length in detector.lengths:
+                self.by_length.setdefault(length, []).append(detector)
+        else:
+            self.fallbacks.append(detector)
+        return detector
+
+    def candidates(self, buf, port=None):
+        """Return Detectors matching the payload, in priority order."""
+        found = []
+        node = self.trie
+        for b in buf:
+            entry = node.get(b)
+            if entry is None:
+                break
+            ending, node = entry
+            found += ending
+        found += self.by_length.get(len(buf), ())
+        if found:
+            found = [d for d in found if d.matches(buf, port)]
+            if len(found) > 1:
+                found.sort(key=priority)
+        for d in self.fallbacks:
+            if d.matches(buf, port):
+                found.append(d)
+        return found
+
+    def try_decode(self, detector, buf, port):
+        try:
+            data = detector.decode(buf, port)
+        except (ValueError, IndexError, KeyError):
+            data = None
+        if not data:
+            self.failed[detector.name] += 1
+            return None
+        self.fired[detector.name] += 1
+        return data
+
+    def parse(self, payload_hex, port=None, devid=None):
+        """
+        Detect hex payload's format and parse it, see decode().
+        """
+        try:
+            buf = bytes.fromhex(payload_hex)
+        except ValueError:
+            self.undetected += 1
+            return None
+        return self.decode(buf, port=port, devid=devid)
+
+    def decode(self, buf, port=None, devid=None):
+        """
+        Detect payload format and parse it.
+        :param buf: payload as bytes or memoryview
+        :param port: LoRaWAN port
+        :param str devid: remember the detected format of this device
+        :return: dict data or None
+        """
+        if devid is not None:
+            detector = self.learned.get(devid)
+            if detector is not None:
+                data = self.try_decode(detector, buf, port) if detector.matches(buf, port) else None
+                if data is not None:
+                    self.learned_hits += 1
+                    self.learned.move_to_end(devid)
+                    return data
+                del self.learned[devid]  # Device changed its format, detect again
+        for detector in self.candidates(buf, port):
+            data = self.try_decode(detector, buf, port)
+            if data is not None:
+                if devid is not None:
+                    self.learned[devid] = detector
+                    if len(self.learned) > self.learned_size:
+                        self.learned.popitem(last=False)
+                return data
+        self.undetected += 1
+        return None
+
+    def stats(self):
+        return {
+            'fired': dict(self.fired),
+            'failed': dict(self.failed),
+            'learned_hits': self.learned_hits,
+            'learned': len(self.learned),
+            'undetected': self.undetected,
+        }
+
+
+registry = DetectionRegistry()
@@ -1,37 +1,94 @@
-def get_value(hex_str, data):
-    if hex_str[:2] == '01':
-        end = 6
-        data['temp'] = int(hex_str[2:end], 16) / 10
-        hex_str = hex_str[end:]
-    elif hex_str[:2] == '02':
-        end = 4
-        data['humi'] = int(hex_str[2:end], 16)
-        hex_str = hex_str[end:]
-    elif hex_str[:2] == '04':
-        end = 6
-        data['lux'] = int(hex_str[2:end], 16)
-        hex_str = hex_str[end:]
-    elif hex_str[:2] == '05':
-        end = 4
-        data['motion'] = int(hex_str[2:end], 16)
-        hex_str = hex_str[end:]
-    elif hex_str[:2] == '06':
-        end = 6
-        data['co2'] = int(hex_str[2:end], 16)
-        hex_str = hex_str[end:]
-    elif hex_str[:2] == '07':
-        end = 6
-        data['volt'] = int(hex_str[2:end], 16) / 1000
-        hex_str = hex_str[end:]
-    elif hex_str[:2] == '15':
-        end = 6
-        data['soundPeak'] = int(hex_str[2:4], 16)
-        data['soundAvg'] = int(hex_str[4:end], 16)
-        hex_str = hex_str[end:]
-    else:
-        data['error'] = hex_str
-        hex_str = ''
-    return hex_str, data
+"""
+Elsys TLV payload decoder.
+Type table is from document "Elsys LoRa payload" at https://www.elsys.se/en/lora-doc/
+"""
+
+from .layout import Field, Layout
+
+
+def tlv(*fields):
+    """Layout of one TLV value, decoded from a cursor position in the payload"""
+    return Layout(list(fields), byteorder='>', exact=False)
+
+
+def int24le(value):
+    return int.from_bytes(value, byteorder='little', signed=True)
+
+
+def decode_grideye(buf, pos):
+    """Grideye: 1 byte reference temperature and 64 pixels relative to it in 0.1 °C"""
+    ref = buf[pos]
+    data = {'grideye_ref': ref}
+    for j in range(64):
+        data[f'grideye_{j}'] = ref + buf[pos + 1 + j] / 10.0
+    return data
+
+
+ELSYS_LAYOUTS = {
+    0x01: tlv(Field('temp', 'h', divisor=10, unit='°C')),
+    0x02: tlv(Field('humi', 'B', unit='%')),
+    0x03: tlv(Field('acc_x', 'b'), Field('acc_y', 'b'), Field('acc_z', 'b')),  # 63 = 1G
+    0x04: tlv(Field('lux', 'H', unit='lux')),
+    0x05: tlv(Field('motion', 'B')),
+    0x06: tlv(Field('co2', 'H', unit='ppm')),
+    0x07: tlv(Field('volt', 'H', divisor=1000, unit='V')),
+    0x08: tlv(Field('analog1', 'H', unit='mV')),
+    0x09: tlv(Field('lat', '3s', convert=int24le, divisor=10000),
+              Field('lon', '3s', convert=int24le, divisor=10000)),
+    0x0A: tlv(Field('pulse1', 'H')),
+    0x0B: tlv(Field('pulse1_abs', 'I')),
+    0x0C: tlv(Field('ext_temp1', 'h', divisor=10, unit='°C')),
+    0x0D: tlv(Field('digital', 'B')),
+    0x0E: tlv(Field('distance', 'H', unit='mm')),
+    0x0F: tlv(Field('acc_motion', 'B')),
+    0x10: tlv(Field('ir_int_temp', 'h', divisor=10, unit='°C'),
+              Field('ir_ext_temp', 'h', divisor=10, unit='°C')),
+    0x11: tlv(Field('occupancy', 'B')),
+    0x12: tlv(Field('waterleak', 'B')),
+    0x14: tlv(Field('pres', 'I', divisor=1000, unit='hPa')),
+    0x15: tlv(Field('soundPeak', 'B', unit='dB'), Field('soundAvg', 'B', unit='dB')),
+    0x16: tlv(Field('pulse2', 'H')),
+    0x17: tlv(Field('pulse2_abs', 'I')),
+    0x18: tlv(Field('analog2', 'H', unit='mV')),
+    0x19: tlv(Field('ext_temp2', 'h', divisor=10, unit='°C')),
+    0x1A: tlv(Field('digital2', 'B')),
+    0x1B: tlv(Field('analog_uv', 'i', unit='µV')),
+    0x1C: tlv(Field('tvoc', 'H', unit='ppb')),
+    0x3D: tlv(Field('debug', 'I')),
+}
+
+# Type code -> (value length in bytes, decoder(buf, pos) returning a dict)
+ELSYS_TYPES = {t: (layout.size, layout.decode) for t, layout in ELSYS_LAYOUTS.items()}
+ELSYS_TYPES[0x13] = (65, decode_grideye)
+
+
+def decode_elsys(buf):
+    """
+    Walk through TLV payload once and decode all values.
+    Decoding stops at an unknown type, because its length is unknown,
+    and the rest of the payload is returned in 'error' field.
+    :param buf: bytes or memoryview
+    :return: dict containing values
+    :raises ValueError: if payload ends in the middle of a value
+    """
+    data = {}
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        entry = ELSYS_TYPES.get(buf[pos])
+        if entry is None:
+            data['error'] = bytes(buf[pos:]).hex()
+            break
+        size, decode = entry
+        if pos + 1 + size > end:
+            raise ValueError(f'Elsys payload ends in the middle of type {buf[pos]:02x} value')
+        data.update(decode(buf, pos + 1))
+        pos += 1 + size
+    return data
+
+
+def decode_bytes(buf, port=None):
+    return decode_elsys(buf)
 
 
 def parse_elsys(hex_str, port=None):
@@ -43,12 +100,7 @@ def parse_elsys(hex_str, port=None):
     :param port: LoRaWAN port
     :return: dict containing float values
     """
-    data = {}
-    # This while loop is just in case here, get_value seems to parse all values
-    # when they are in numeric order (01, 02, 04, 05, 06, 07)
-    while len(hex_str) > 0:
-        hex_str, data = get_value(hex_str, data)
-    return data
+    return decode_bytes(bytes.fromhex(hex_str), port)
 
 
 def decode_hex(hex_str: str, port: int = None):
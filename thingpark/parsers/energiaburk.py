@@ -1,4 +1,4 @@
-import struct
+from .layout import Field, Layout
 
 
 def hex2int(hex_str):
@@ -19,6 +19,27 @@ def hex2value10(hex_str):
     return hex2int(hex_str) / 10.0
 
 
+def decode_bytes(buf, port=None):
+    """
+    Decode EnergiaBurk payload, type is recognised from its first bytes
+    :param buf: payload as bytes or memoryview
+    :param port: LoRaWAN port
+    :return: dict containing values or None, if payload type is unknown
+    """
+    if buf[:1] == b'\x3a':
+        return AURINKOPENKKI.decode(buf)
+    elif buf[:1] == b'\x09':
+        return VOLTAGEBURK.decode(buf[-4:])
+    elif buf[:2] == b'\x0a\x00':
+        return VICTRON.decode(buf)
+    elif buf[:2] == b'\x0a\x02':
+        return VICTRON_PHOENIX.decode(buf)
+    elif buf[:2] == b'\x07\x00':
+        return DAVIS_WEATHER.decode(buf)
+    elif buf[:2] == b'\xd7\x7e':
+        return decode_ircounter(buf)
+
+
 def parse_energiaburk(hex_str, port=None):
     """
     Parse payload like "3a2c007d0003002a000000000000000000000000" float values
@@ -26,18 +47,128 @@ def parse_energiaburk(hex_str, port=None):
     :param port: LoRaWAN port
     :return: dict containing float values
     """
-    if hex_str.startswith('3a'):
-        return parse_aurinkopenkki(hex_str)
-    elif hex_str.startswith('09'):
-        return parse_voltageburk(hex_str)
-    elif hex_str.startswith('0a00'):
-        return parse_victron(hex_str)
-    elif hex_str.startswith('0a02'):
-        return parse_victronphoenix(hex_str)
-    elif hex_str.startswith('0700'):
-        return parse_davisweather(hex_str)
-    elif hex_str.startswith('d77e'):
-        return parse_ircounter(hex_str)
+    return decode_bytes(bytes.fromhex(hex_str), port)
+
+
+def bcd(value):
+    """
+    Read bytes as decimal digits of their hex representation (e.g. b'\x00\x04' -> 4)
+    :param bytes value: bytes
+    :return: int
+    """
+    return int(value.hex())
+
+
+def fahrenheit10_to_celsius(value):
+    """
+    Convert temperature in tenths of Fahrenheit degrees to Celsius
+    """
+    return ((value / 10) - 32) / 1.8
+
+
+IRCOUNTER_07 = Layout([
+    Field(None, '3x'),  # message header and type
+    Field('voltage', 'H'),  # millivolts in pcb not at car battery
+    Field(None, 'x'),
+    Field('in', '2s', convert=bcd),
+    Field('out', '2s', convert=bcd),
+], byteorder='>', exact=False)
+
+IRCOUNTER_37 = Layout([
+    Field(None, '3x'),  # message header and type
+    Field('in', '2s', convert=bcd),
+    Field('out', '2s', convert=bcd),
+], byteorder='>', exact=False)
+
+VICTRON = Layout([
+    Field(None, 'B'),  # msgtype
+    Field(None, 'b'),  # msg_ver
+    Field(None, '2x'),
+    Field('mainvoltage', 'f', unit='mV'),
+    Field('panelvoltage', 'f', unit='mV'),
+    Field('panelpower', 'f', unit='W'),
+    Field('batterycurrent', 'f', unit='mA'),
+    # float yieldTotal_H19, yieldToday_H20, maxPowerToday_H21, yieldYesterday_H22, maxPowerYesterday_H23
+    Field(None, '20x'),
+    Field('errorcode', 'i'),
+    Field('state', 'i'),
+])
+
+VICTRON_PHOENIX = Layout([
+    Field(None, 'B'),  # msgtype
+    Field(None, 'b'),  # msg_ver
+    # MPPT
+    Field('mpptmainvoltage', 'H', unit='mV'),
+    Field('mpptpanelvoltage', 'H', divisor=10),
+    Field('mpptpanelpower', 'H', unit='W'),
+    Field('mpptbatterycurrent', 'h', divisor=10),
+    Field('mpptyieldTotal', 'H', unit='0.01 kWh'),
+    Field('mpptyieldToday', 'H', unit='0.01 kWh'),
+    Field('mpptmaxPowerToday', 'H', unit='W'),
+    Field('mpptyieldYesterday', 'H', unit='0.01 kWh'),
+    Field('mpptmaxPowerYesterday', 'H', unit='W'),
+    Field('mppterrorcode', 'B'),
+    Field('mpptstate', 'B'),
+    # Phoenix
+    Field('p_V', 'H', unit='mV'),
+    Field('p_AC_OUT_V', 'H'),
+    Field('p_AC_OUT_S', 'H'),
+    Field('p_AC_OUT_I', 'B'),
+    Field('p_WARN', 'B'),  # Same as ar but for now can be multiple bits
+    Field('p_AR', 'B'),  # alarm convert to 8 bit
+    Field('p_CS', 'B'),  # convert to 8 bit
+    Field('p_MODE', 'B'),
+    Field(None, 'x'),
+])
+
+DAVIS_WEATHER = Layout([
+    Field(None, 'B'),  # DavisDataCode 07
+    Field(None, 'b'),  # data version 0
+    Field('barometer', 'H', divisor=1000, scale=33.86389, digits=1, unit='hPa'),  # Hg / 1000
+    Field('in_temperature', 'h', convert=fahrenheit10_to_celsius, digits=1, unit='°C'),  # DegF / 10
+    Field('in_humity', 'B', unit='%'),
+    Field(None, 'x'),
+    Field('out_temperature', 'h', convert=fahrenheit10_to_celsius, digits=1, unit='°C'),  # DegF / 10
+    Field('windspeed', 'B'),
+    Field('10minwind', 'B'),  # 10-Minute Average Wind Speed
+    Field('winddirection', 'H', unit='°'),
+    Field('out_humity', 'B', unit='%'),
+    Field('rain', 'H'),  # Rain Rate
+    # uint8 UV Level, uint16 Solar Radiation, uint16 Total Storm Rain, uint16 Start date of current storm
+    Field(None, '7x'),
+    Field('raintoday', 'H'),
+    # uint16 Rain this Month, uint16 Rain this Year, uint8 Transmitter battery status,
+    # uint16 Console Battery Level, uint8 Forecast Icon
+    Field(None, '8x'),
+])
+
+AURINKOPENKKI = Layout([
+    Field(None, 'B'),  # msg_type
+    Field(None, 'b'),  # msg_ver
+    Field(None, '2x'),
+    Field('voltage', 'f', unit='V'),
+    Field('current', 'f', unit='A'),
+    Field('power', 'f', unit='W'),
+    Field('runtime', 'I'),
+    Field('inEnergy', 'I'),
+    Field('outEnergy', 'I'),
+    Field('inmAh', 'I', unit='mAh'),
+    Field('outmAh', 'I', unit='mAh'),
+])
+
+VOLTAGEBURK = Layout([
+    Field('voltage', 'f', unit='V'),
+])
+
+
+def decode_ircounter(buf):
+    message_type = buf[2:3]
+    if message_type == b'\x07':
+        return IRCOUNTER_07.decode(buf)
+    if message_type == b'\x37':
+        return IRCOUNTER_37.decode(buf)
+    return None
+
 
 def parse_ircounter(hex_str, port=None):
     """
@@ -46,22 +177,7 @@ def parse_ircounter(hex_str, port=None):
     :param port: LoRaWAN port
     :return: dict containing values
     """
-    data = None
-
-    if (hex_str[4:6] == "07"):
-        data = {
-            'voltage': int(hex_str[6:10], 16),  # millivolts in pcb not at car battery
-            'in': int(hex_str[12:16]),
-            'out': int(hex_str[16:20]),
-        }
-
-    if (hex_str[4:6] == "37"):
-        data = {
-            'in': int(hex_str[6:10]),
-            'out': int(hex_str[10:14]),
-        }
-
-    return data
+    return decode_ircounter(bytes.fromhex(hex_str))
 
 
 def parse_victron(hex_str, port=None):
@@ -71,30 +187,7 @@ def parse_victron(hex_str, port=None):
     :param port: LoRaWAN port
     :return: dict containing values
     """
-
-    b = bytes.fromhex(hex_str)
-    val = struct.unpack('<Bbxxfffffffffii', b)
-
-    data = {
-        # 2  float mainVoltage_V;      // mV
-        # 3  float panelVoltage_VPV;   // mV
-        # 4  float panelPower_PPV;     // W
-        # 5  float batteryCurrent_I;   // mA
-        # 6  float yieldTotal_H19;     // 0.01 kWh
-        # 7  float yieldToday_H20;     // 0.01 kWh
-        # 8  float maxPowerToday_H21;  // W
-        # 9  float yieldYesterday_H22; // 0.01 kWh
-        # 10  float maxPowerYesterday_H23; // W
-        # 11  int errorCode_ERR;
-        # 12  int stateOfOperation_CS;
-        'mainvoltage': val[2],
-        'panelvoltage': val[3],
-        'panelpower': val[4],
-        'batterycurrent': val[5],
-        'errorcode': val[11],  # int
-        'state': val[12],  # int
-    }
-    return data
+    return VICTRON.decode(bytes.fromhex(hex_str))
 
 
 def parse_victronphoenix(hex_str, port=None):
@@ -103,62 +196,8 @@ def parse_victronphoenix(hex_str, port=None):
     :param hex_str: Victron hex payload
     :param port: LoRaWAN port
     :return: dict containing values
-    :c uint8 = B
-    :c uint16 = H x = filling
     """
-
-    b = bytes.fromhex(hex_str)
-    val = struct.unpack('<BbHHHhHHHHHBBHHHBBBBBx', b)
-
-    data = {
-        # 0  msgtype
-        # 1  msg_ver
-
-        #MPPT
-        # 2  uint16 mainVoltage_V;      // mV
-        # 3  uint16 panelVoltage_VPV;   // mV ( value needs to be divided by 10 )
-        # 4  uint16 panelPower_PPV;     // W
-        # 5  int6 batteryCurrent_I;   // mA ( value needs to be divided by 10 )
-        # 6  uint16 yieldTotal_H19;     // 0.01 kWh
-        # 7  uint16 yieldToday_H20;     // 0.01 kWh
-        # 8  uint16 maxPowerToday_H21;  // W
-        # 9  uint16 yieldYesterday_H22; // 0.01 kWh
-        # 10  uint16 maxPowerYesterday_H23; // W
-        # 11  uint8 errorCode_ERR;
-        # 12  uint8 stateOfOperation_CS;
-
-        #Phoenix
-        # 13 uint16_t p_V;      // mV
-        # 14 uint16_t p_AC_OUT_V;
-        # 15 uint16_t p_AC_OUT_S;
-        # 16 uint8_t p_AC_OUT_I;
-        # 17 uint8_t p_WARN; // Same as ar but for now can be multiple bits
-        # 18 uint8_t p_AR; // alarm convert to 8 bit
-        # 19 uint8_t p_CS; // convert to 8 bit
-        # 20 uint8_t p_MODE;
-
-        'mpptmainvoltage': val[2],
-        'mpptpanelvoltage': val[3]/10,
-        'mpptpanelpower': val[4],
-        'mpptbatterycurrent': val[5]/10,
-        'mpptyieldTotal': val[6],
-        'mpptyieldToday': val[7],
-        'mpptmaxPowerToday': val[8],
-        'mpptyieldYesterday': val[9],
-        'mpptmaxPowerYesterday': val[10],
-        'mppterrorcode': val[11],  # int
-        'mpptstate': val[12],  # int
-
-        'p_V': val[13],
-        'p_AC_OUT_V': val[14],
-        'p_AC_OUT_S': val[15],
-        'p_AC_OUT_I': val[16],
-        'p_WARN': val[17],
-        'p_AR': val[18],
-        'p_CS': val[19],
-        'p_MODE': val[20]
-    }
-    return data
+    return VICTRON_PHOENIX.decode(bytes.fromhex(hex_str))
 
 
 def parse_davisweather(hex_str, port=None):
@@ -168,44 +207,7 @@ def parse_davisweather(hex_str, port=None):
     :param port: LoRaWAN port
     :return: dict containing values
     """
-
-    b = bytes.fromhex(hex_str)
-    val = struct.unpack('<BbHhBxhBBHBHBHHHHHHBHB', b)  # Capital is unsigned, b 8bit h 16bit, x 8bit padding
-    data = {
-        # 0  int DavisDataCode 07
-        # 1  data version 0
-        # 2  uint16_t Current barometer as (Hg / 1000)
-        # 3  int16_t Inside Temperature as (DegF / 10)
-        # 4  uint8_t Inside Humidity as percentage
-        # 5  int16_t Outside Temperature as (DegF / 10)
-        # 6  uint8_t Wind Speed
-        # 7  uint8_t 10-Minute Average Wind Speed
-        # 8  uint16_t Wind Direction in degress
-        # 9  uint8_t Outside Humidity
-        # 10 uint16_t Rain Rate
-        # 11 uint8_t UV Level
-        # 12 uint16_t Solar Radiation
-        # 13 uint16_t Total Storm Rain
-        # 14 uint16_t Start date of current storm
-        # 15 uint16_t Rain Today
-        # 16 uint16_t Rain this Month
-        # 17 uint16_t Rain this Year
-        # 18 uint8_t Transmitter battery status
-        # 19 uint16_t Console Battery Level:
-        # 20 uint8_t Forecast Icon
-        # 21 uint8_t Forecast rule number
-        'barometer': round(((val[2] / 1000) * 33.86389), 1),
-        'in_temperature': round((((val[3] / 10) - 32) / 1.8), 1),
-        'in_humity': val[4],
-        'out_temperature': round((((val[5] / 10) - 32) / 1.8), 1),
-        'windspeed': val[6],
-        '10minwind': val[7],
-        'winddirection': val[8],
-        'out_humity': val[9],
-        'rain': val[10],
-        'raintoday': val[15],
-    }
-    return data
+    return DAVIS_WEATHER.decode(bytes.fromhex(hex_str))
 
 
 def parse_aurinkopenkki(hex_str, port=None):
@@ -215,32 +217,7 @@ def parse_aurinkopenkki(hex_str, port=None):
     :param port: LoRaWAN port
     :return: dict containing float values
     """
-    b = bytes.fromhex(hex_str)
-    val = struct.unpack('<BbxxfffIIIII', b)
-
-    #struct t_AcudcDATA { 
-    # uint8_t msg_type;
-    # uint8_t msg_ver;
-    # float volt;
-    # float amp;
-    # float watt;
-    # uint32_t runTime;
-    # uint32_t inEnergy;
-    # uint32_t outEnergy;
-    # uint32_t inAh;
-    # uint32_t outAh;
-    
-    data = {
-        'voltage': val[2],
-        'current': val[3],
-        'power': val[4],
-        'runtime': val[5],
-        'inEnergy': val[6],
-        'outEnergy': val[7],
-        'inmAh': val[8],
-        'outmAh': val[9],
-    }
-    return data
+    return AURINKOPENKKI.decode(bytes.fromhex(hex_str))
 
 
 def parse_voltageburk(hex_str, port=None):
@@ -250,12 +227,7 @@ def parse_voltageburk(hex_str, port=None):
     :param port: LoRaWAN port
     :return: dict containing float values
     """
-    b1 = bytes.fromhex(hex_str[-8:])
-    volt = struct.unpack('<f', b1)[0]
-    data = {
-        'voltage': volt,
-    }
-    return data
+    return VOLTAGEBURK.decode(bytes.fromhex(hex_str[-8:]))
 
 
 if __name__ == '__main__':
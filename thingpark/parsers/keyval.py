@@ -1,15 +1,27 @@
-import binascii
+from .detect import registry
 
 
-def parse_keyval(hex_str):
+def decode_bytes(buf, port=None):
     """
-    :param hex_str: key-value hex payload
+    :param buf: key-value payload as bytes or memoryview
     :return: dict containing parsed balues
-    :raises UnicodeDecodeError: if hex_str contains illegal bytes for utf8
+    :raises UnicodeDecodeError: if buf contains illegal bytes for utf8
     """
-    _str = binascii.unhexlify(hex_str)  # --> b'temp=24.61,hum=28.69'
-    _str = _str.decode()  # --> 'temp=24.61,hum=28.69'
+    _str = bytes(buf).decode()  # --> 'temp=24.61,hum=28.69'
     keyvals = [x.split('=') for x in _str.split(',')]  # --> [['temp', '24.61'], ['hum', '28.69']]
     keyvals = [[x[0], float(x[1])] for x in keyvals]  # --> [['temp', 24.61], ['hum', 28.69]]
     data = dict(keyvals)  # --> {'temp': 24.61, 'hum': 28.69}
     return data
+
+
+def parse_keyval(hex_str, port=None):
+    """
+    :param hex_str: key-value hex payload
+    :return: dict containing parsed balues
+    :raises UnicodeDecodeError: if hex_str contains illegal bytes for utf8
+    """
+    return decode_bytes(bytes.fromhex(hex_str), port)  # --> b'temp=24.61,hum=28.69'
+
+
+# Fallback: payloads containing a '=' are tried as key-value data
+registry.register('keyval', decode_bytes, priority=100, check=lambda buf: ord('=') in buf)
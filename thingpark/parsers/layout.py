@@ -0,0 +1,116 @@
+"""
+Declarative layouts for fixed binary payloads.
+
+A Layout is a list of Fields. It is compiled once into a struct.Struct and
+a generated decode function, so decoding a payload is one function call
+doing one unpack() and building the result dict inline.
+
+Example:
+
+    AQBURK = Layout([
+        Field(None, '2x'),  # "**" header
+        Field('pm25min', 'H', divisor=10),
+        ...
+    ], byteorder='>')
+    data = AQBURK.decode(bytes.fromhex(hex_str))
+"""
+
+import math
+import struct
+
+
+class Field:
+    """
+    One value in a binary payload.
+
+    Value is converted in this order: convert(), / divisor, * scale, + offset, round(digits).
+    Fields without a name are skipped like padding and not included in the result,
+    fields with a pad format (e.g. '3x') are not decoded at all.
+    """
+    __slots__ = ('name', 'fmt', 'divisor', 'scale', 'offset', 'digits', 'unit', 'convert')
+
+    def __init__(self, name, fmt, divisor=None, scale=None, offset=None, digits=None, unit=None, convert=None):
+        self.name = name
+        self.fmt = fmt
+        self.divisor = divisor
+        self.scale = scale
+        self.offset = offset
+        self.digits = digits
+        self.unit = unit
+        self.convert = convert
+
+    @property
+    def is_padding(self):
+        return self.fmt.endswith('x')
+
+    def expression(self, i, namespace):
+        """
+        Return Python expression converting unpacked value `values<i>` and
+        add the objects it refers to into `namespace`. Plain numbers are
+        written into the expression as literals.
+        """
+        expr = f'values{i}'
+        if self.convert is not None:
+            namespace[f'convert{i}'] = self.convert
+            expr = f'convert{i}({expr})'
+        for op, attr in (('/', 'divisor'), ('*', 'scale'), ('+', 'offset')):
+            value = getattr(self, attr)
+            if value is None:
+                continue
+            if type(value) in (int, float) and math.isfinite(value):
+                expr = f'({expr} {op} {value!r})'
+            else:
+                namespace[f'{attr}{i}'] = value
+                expr = f'({expr} {op} {attr}{i})'
+        if self.digits is not None:
+            expr = f'round({expr}, {self.digits})'
+        return expr
+
+
+class Layout:
+    """
+    Fixed binary layout of a payload.
+    :param list fields: Fields in payload order
+    :param str byteorder: struct byte order character, '<' or '>'
+    :param bool exact: require payload length to match the layout exactly
+    """
+
+    def __init__(self, fields, byteorder='<', exact=True):
+        self.fields = fields
+        self.byteorder = byteorder
+        self.exact = exact
+        # Unnamed values are skipped like padding, they would be thrown away anyway
+        self.struct = struct.Struct(byteorder + ''.join(
+            f.fmt if f.is_padding or f.name is not None else f'{struct.calcsize(byteorder + f.fmt)}x'
+            for f in fields))
+        self.size = self.struct.size
+        self.units = {f.name: f.unit for f in fields if f.name is not None and f.unit is not None}
+        self.decode = self.compile()
+
+    def compile(self):
+        """
+        Generate the decode function: one unpack call into local variables
+        and one dict display, without per-field function calls or indexing.
+        """
+        namespace = {'unpack': self.struct.unpack, 'unpack_from': self.struct.unpack_from, 'error': struct.error}
+        named = [f for f in self.fields if not f.is_padding and f.name is not None]
+        targets = ''.join(f'values{i}, ' for i in range(len(named))) or '()'
+        items = ', '.join(f'{f.name!r}: {f.expression(i, namespace)}' for i, f in enumerate(named))
+        unpack = 'unpack(buf[offset:] if offset else buf)' if self.exact else 'unpack_from(buf, offset)'
+        exec(
+            'def decode(buf, offset=0):\n'
+            '    try:\n'
+            f'        {targets} = {unpack}\n'
+            '    except error as err:\n'
+            "        raise ValueError(f'Failed to unpack payload: {err}') from err\n"
+            f'    return {{{items}}}\n',
+            namespace)
+        decode = namespace['decode']
+        decode.__doc__ = """
+        Decode payload to a dict.
+        :param buf: bytes, bytearray or memoryview
+        :param int offset: start position in buf
+        :return: dict of field name -> value
+        :raises ValueError: if payload is too short (or too long, if layout is exact)
+        """
+        return decode
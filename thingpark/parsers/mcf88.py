@@ -1,38 +1,93 @@
+"""
+Parser for MCF88 LW12 payloads.
+
+First byte of an uplink is the frame type. Frame types are registered in
+MCF88_FRAMES, each with a function decoding the whole uplink (bytes) to a
+list of datalines (thingpark.dataline.Dataline). Only the T/H/P frame
+(0x04) is implemented, uplinks of other frame types are skipped.
+
+decode_bytes(), which the decode path uses, returns Datalines. The hex
+parser parse_mcf88() (and so Mcf88Decoder.decode_payload()) returns dicts,
+like broker.utils.create_dataline() creates.
+"""
+
 import datetime
 import struct
+from functools import lru_cache
+
 import pytz
 
-from broker.utils import create_dataline, create_parsed_data_message
+from thingpark.dataline import Dataline, as_dicts
 
 
-def extract_bits(value, first, last):
+def get_timestamp(value):
     """
-    Extract some bits from int `value`
-    :param int value:
-    :param int first:
-    :param int last:
-    :return: int
+    Convert mcf88 bit packed date to datetime
+    :param int value: date as 32 bit unsigned int
+    :return: datetime in UTC (timezone aware)
     """
-    value >>= first
-    mask = ~((-1) << (last - first + 1))
-    return value & mask
+    return datetime.datetime((value >> 25) + 2000,  # year, bits 25-31
+                             (value >> 21) & 0x0f,  # month, bits 21-24
+                             (value >> 16) & 0x1f,  # day, bits 16-20
+                             (value >> 11) & 0x1f,  # hour, bits 11-15
+                             (value >> 5) & 0x3f,  # minute, bits 5-10
+                             (value & 0x1f) * 2,  # second / 2, bits 0-4
+                             tzinfo=pytz.UTC)
 
 
-def get_timestamp(value):
+THP_RECORD_SIZE = 10
+THP_NAMES = ('temp', 'humi', 'pres')  # °C, %, hPa
+
+
+@lru_cache(maxsize=8)
+def thp_struct(records):
+    """
+    Struct unpacking frame type byte and `records` T/H/P records at once.
+    Record is date (4), temp (2), humi (1) and pres (3), pres is split to low 16 and high 8 bits.
+    """
+    return struct.Struct('<B' + 'IhBHB' * records)
+
+
+def decode_thp(buf):
+    """Frame type 0x04: temperature, humidity and pressure records, usually 3 per uplink"""
+    records = (len(buf) - 1) // THP_RECORD_SIZE
+    if records == 0:
+        raise ValueError(f'mcf88 T/H/P uplink of {len(buf)} bytes contains no records')
+    s = thp_struct(records)
+    values = s.unpack_from(buf)
+    datalines = []
+    for i in range(1, len(values), 5):
+        date, temp, humi, pres_lo, pres_hi = values[i:i + 5]
+        datalines.append(Dataline(get_timestamp(date), THP_NAMES,
+                                  (temp / 100, humi / 2, (pres_lo | pres_hi << 16) / 100)))
+    return datalines
+
+
+# Frame type -> decoder(buf) returning list of datalines
+# TODO: CO2, light and VOC frame types are not implemented yet. Add them here once
+#       their record layouts are checked against the LW12 documentation and real payloads.
+MCF88_FRAMES = {
+    0x04: decode_thp,
+}
+
+
+def decode_mcf88(buf):
     """
-    Extract timezone aware datetime from mcf88 measurement
-    :param bytes value: measurement converted to bytes
-    :return: datetime
+    Decode an mcf88 uplink.
+    :param buf: bytes or memoryview
+    :return: list of datalines, None if frame type is not supported
+    :raises ValueError: if payload is too short for its frame type
     """
-    timestamp, = struct.unpack('<I6x', value)
-    year = extract_bits(timestamp, 25, 31) + 2000
-    month = extract_bits(timestamp, 21, 24)
-    day = extract_bits(timestamp, 16, 20)
-    hour = extract_bits(timestamp, 11, 15)
-    minute = extract_bits(timestamp, 5, 10)
-    second = extract_bits(timestamp, 0, 4) * 2
-    dt = pytz.UTC.localize(datetime.datetime(year, month, day, hour, minute, second))
-    return dt
+    if len(buf) == 0:
+        return None
+    decode = MCF88_FRAMES.get(buf[0])
+    if decode is None:
+        return None
+    return decode(buf)
+
+
+def decode_bytes(buf, port=None):
+    return decode_mcf88(buf)
 
 
 def parse_mcf88(hex_str, port=None):
@@ -40,28 +95,10 @@ def parse_mcf88(hex_str, port=None):
     Parse payload like "0462651527da078e4d8e01a4691527dd078f488e01676d1527e9078d1a8e015d" float values
     :param hex_str: MCF88 hex payload
     :param port: LoRaWAN port
-    :return: dict containing float values
+    :return: list of dataline dicts, None if frame type is not supported
     """
-    if hex_str[:2] == '04':
-        line = hex_str[2:62]
-        n = 20
-        datas = [line[i:i + n] for i in range(0, len(line), n)]
-        datalines = []
-        for data in datas:
-            value = bytes.fromhex(data)
-            ts = get_timestamp(value)  # datetime in UTC (timezone aware)
-            # print("'{}'".format(data[8:10]))
-            parsed_data = {
-                'temp': struct.unpack('<h', bytes.fromhex(data[8:12]))[0] / 100,  # °C
-                'humi': int(data[12:14], 16) / 2,
-                'pres': struct.unpack('<I', bytes.fromhex(data[14:20] + '00'))[0] / 100  # hPa
-            }
-            dataline = create_dataline(ts, parsed_data)
-            datalines.append(dataline)
-        return datalines
-    return None
-
-
+    datalines = decode_bytes(bytes.fromhex(hex_str), port)
+    return as_dicts(datalines) if datalines is not None else None
 
 
 def decode_hex(hex_str: str, port: int = None):
@@ -3,26 +3,31 @@ See example here:
 https://github.com/cyberman54/ESP32-Paxcounter/blob/master/src/TTN/plain_decoder.js
 """
 
+from .detect import registry
 
-def parse_paxcounter(payload_hex, port=None):
+
+def decode_bytes(buf, port=None):
     data = {}
-    b = bytearray.fromhex(payload_hex)
-    len_b = len(b)
     if port == '1':
-        payload_len = len(payload_hex)
-        print(payload_len)
         # We assume here PAXCOUNTER is configured to send data in "plain" format
         # paxcounter.conf: #define PAYLOAD_ENCODER                 1
-        if payload_len == 4:
-            data['wifi'] = float(int(payload_hex[0:4], 16))
-        elif payload_len == 8:
-            data['wifi'] = float(int(payload_hex[0:4], 16))
-            data['ble'] = float(int(payload_hex[4:8], 16))
+        if len(buf) == 2:
+            data['wifi'] = float(int.from_bytes(buf[0:2], 'big'))
+        elif len(buf) == 4:
+            data['wifi'] = float(int.from_bytes(buf[0:2], 'big'))
+            data['ble'] = float(int.from_bytes(buf[2:4], 'big'))
     # TODO: Other ports and payload formats are not implemented yet
     # else:
     #     raise ValueError(f'Unknown port "{port}"')
     return data
 
+
+def parse_paxcounter(payload_hex, port=None):
+    return decode_bytes(bytes.fromhex(payload_hex), port)
+
+
+registry.register('paxcounter', decode_bytes, lengths=[4], ports=[1], priority=10)
+
 if __name__ == '__main__':
     import sys
 
@@ -1,77 +1,119 @@
 """
 Parser for Digital Matter's Sensornode data format
 https://digmat.freshdesk.com/helpdesk/attachments/16046195706
-"""
 
-import struct
-
-SENSORNODE_CSV = """ID;Table;Name;Size;Units
-1;;System Firmware version (reset message);4;Struct
-10;;GPS Position;6;Struct
-20;batt;Battery Voltage;2;UINT16 (mV)
-21;analog1;Analog In 1;2; UINT16 (mV)
-22;analog2;Analog In 2;2; UINT16 (mV)
-23;analog3;Analog In 3;2; UINT16 (mV)
-30;digin1;Digital Input State;1;Bitfield
-31;pulse1;Input 1 Pulse Count;2;UINT16
-32;pulse2;Input 2 Pulse Count;2;UINT16
-33;pulse3;Input 3 Pulse Count;2;UINT16
-40;temp_in;Internal Temperature;2;INT16 (x100 degC)
-41;temp_out1;Digital Matter I2C Temperature Probe 1 (Red);2;INT16 (x100 degC)
-42;temp_out2;Digital Matter I2C Temperature Probe 2 (Blue);2;INT16 (x100 degC)
-43;;Digital Matter I2C Temperature & Relative Humidity;3;Struct
-50;battused;Battery Energy Used Since Power Up. 65535 = Unknown;2;UINT16 (mAh)
-51;battleft;Estimated Battery % Remaining. 255 = Unknown;1;BYTE (0.5%)
+Payload is a sequence of fields, each prefixed by its id, except the first
+one whose id is the LoRaWAN port.
 """
 
+from .layout import Field, Layout
 
-def parse_sensornode_table():
-    lines = SENSORNODE_CSV.splitlines()
-    lines.pop(0)
-    sensornode_map = {}
-    for l in lines:
-        c = l.split(';')
-        if len(c) == 5:
-            sensornode_map[int(c[0])] = {'table': c[1], 'name': c[2], 'size': int(c[3]), 'type': c[4].split(' ')[0]}
-    return sensornode_map
 
+class SensornodeParseError(ValueError):
+    """Payload can't be parsed, `field_id` and value `offset` in bytes tell where it failed"""
 
-def parse_sensornode(hex_str, port=None):
-    _id = int(port)
-    tab = parse_sensornode_table()
+    def __init__(self, message, field_id, offset):
+        super().__init__(f'{message} (field id {field_id} at byte {offset})')
+        self.field_id = field_id
+        self.offset = offset
+
+
+def field(*fields):
+    """Layout of one field value, decoded from a cursor position in the payload"""
+    return Layout(list(fields), byteorder='<', exact=False)
+
+
+def unless(unknown, layout):
+    """Decode with `layout`, unless value bytes equal `unknown`, which means value is unknown"""
+
+    def decode(buf, pos):
+        if buf[pos:pos + layout.size] == unknown:
+            return {}
+        return layout.decode(buf, pos)
+
+    return decode
+
+
+def skip(buf, pos):
+    return {}
+
+
+def int24le(value):
+    return int.from_bytes(value, byteorder='little', signed=True)
+
+
+GPS = field(Field('lat', '3s', convert=int24le, divisor=10 ** 7, scale=256.0),
+            Field('lon', '3s', convert=int24le, divisor=10 ** 7, scale=256.0))
+
+
+def decode_gps(buf, pos):
+    """GPS position, first byte 0xff means there is no fix"""
+    if buf[pos] == 0xff:
+        return {}
+    return GPS.decode(buf, pos)
+
+
+SENSORNODE_LAYOUTS = {
+    20: field(Field('batt', 'H', divisor=1000, unit='V')),  # Battery Voltage
+    21: field(Field('analog1', 'H', divisor=1000, unit='V')),  # Analog In 1
+    22: field(Field('analog2', 'H', divisor=1000, unit='V')),  # Analog In 2
+    23: field(Field('analog3', 'H', divisor=1000, unit='V')),  # Analog In 3
+    30: field(Field('digin1', 'B')),  # Digital Input State, bitfield
+    31: field(Field('pulse1', 'H')),  # Input 1 Pulse Count
+    32: field(Field('pulse2', 'H')),  # Input 2 Pulse Count
+    33: field(Field('pulse3', 'H')),  # Input 3 Pulse Count
+    40: field(Field('temp_in', 'h', divisor=100, unit='°C')),  # Internal Temperature
+    41: field(Field('temp_out1', 'h', divisor=100, unit='°C')),  # I2C Temperature Probe 1 (Red)
+    42: field(Field('temp_out2', 'h', divisor=100, unit='°C')),  # I2C Temperature Probe 2 (Blue)
+    43: field(Field('temprh_temp', 'h', divisor=100, unit='°C'),  # I2C Temperature & Relative Humidity
+              Field('temprh_rh', 'B', divisor=2, unit='%')),
+    50: field(Field('battused', 'H', unit='mAh')),  # Battery Energy Used Since Power Up
+    51: field(Field('battleft', 'B', scale=0.5, unit='%')),  # Estimated Battery % Remaining
+}
+
+# Field id -> (value length in bytes, decoder(buf, pos) returning a dict)
+SENSORNODE_TYPES = {_id: (layout.size, layout.decode) for _id, layout in SENSORNODE_LAYOUTS.items()}
+SENSORNODE_TYPES.update({
+    1: (4, skip),  # System Firmware version (reset message)
+    10: (6, decode_gps),  # GPS Position
+    50: (2, unless(b'\xff\xff', SENSORNODE_LAYOUTS[50])),  # 65535 = Unknown
+    51: (1, unless(b'\xff', SENSORNODE_LAYOUTS[51])),  # 255 = Unknown
+})
+
+
+def decode_sensornode(buf, port):
+    """
+    Walk through payload once and decode all fields.
+    :param buf: bytes or memoryview
+    :param port: LoRaWAN port, which is the id of the first field
+    :return: dict containing values
+    :raises SensornodeParseError: if payload contains an unknown field id or ends in the middle of a value
+    """
     data = {}
-    while len(hex_str) >= 0:
-        t = tab[_id]
-        s = t['size'] * 2  # Remove bytes * 2 because of hex format
-        # Remove next chunk from hex payload
-        chunk = hex_str[:s]
-        hex_str = hex_str[s:]
-        if _id in [1]:  # List contains fields not to parse
-            # print(hex_str[:2])
-            # Get and remove next id from hex payload
-            _id = int(hex_str[:2], 16)
-            hex_str = hex_str[2:]
-            continue
-        x = bytes.fromhex(chunk)
-        if _id in [10] and x[0] != 255:  # GPS data with fix 
-            def convert_deg(b):
-                return int.from_bytes(b, byteorder='little', signed=True) / 10 ** 7 * 256.0
-
-            data['lat'], data['lon'] = convert_deg(x[0:3]), convert_deg(x[3:6])
-        if _id in [20, 21, 22, 23]:  # mV
-            data[t['table']] = struct.unpack('<H', x)[0] / 1000
-        if _id in [30, 31, 32, 33]:  # count
-            data[t['table']] = struct.unpack('<H', x)[0]
-        if _id in [40, 41, 42]:  # °C * 100
-            data[t['table']] = struct.unpack('<h', x)[0] / 100
-        if _id in [43]:  # temp & humidity
-            data['temprh_temp'] = struct.unpack('<h', x[:2])[0] / 100
-            data['temprh_rh'] = x[2] / 2
-        if (len(hex_str) == 0):
-            break
-        _id = int(hex_str[:2], 16)
-        hex_str = hex_str[2:]
-    return data
+    _id = int(port)
+    pos = 0
+    end = len(buf)
+    while True:
+        entry = SENSORNODE_TYPES.get(_id)
+        if entry is None:
+            raise SensornodeParseError('Unknown Sensornode field id', _id, pos)
+        size, decode = entry
+        if pos + size > end:
+            raise SensornodeParseError('Sensornode payload ends in the middle of a value', _id, pos)
+        data.update(decode(buf, pos))
+        pos += size
+        if pos >= end:
+            return data
+        _id = buf[pos]
+        pos += 1
+
+
+def decode_bytes(buf, port=None):
+    return decode_sensornode(buf, port)
+
+
+def parse_sensornode(hex_str, port=None):
+    return decode_bytes(bytes.fromhex(hex_str), port)
 
 
 if __name__ == '__main__':
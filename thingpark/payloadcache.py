@@ -0,0 +1,97 @@
+"""
+LRU cache of decoded payloads.
+
+Many devices send byte-identical payloads over and over again (paxcounters at
+night, idle energy meters), so the result of decoding a payload can be reused.
+Only decoders which declare `pure = True` are cached, i.e. decoders whose
+result depends on nothing else than the payload and the port.
+
+Cached results are never handed out as such: the caller gets a fresh copy,
+because decode results (e.g. datalines) are modified after decoding.
+"""
+
+import threading
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+
+from thingpark.dataline import Dataline
+
+MISSING = object()
+
+
+def fresh_copy(value):
+    """Copy dicts, lists and Datalines of a decode result recursively, other values are immutable"""
+    if isinstance(value, Dataline):
+        return value.copy()
+    if isinstance(value, dict):
+        return {k: fresh_copy(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [fresh_copy(v) for v in value]
+    return value
+
+
+class PayloadCache:
+    """
+    Bounded LRU cache of decode results keyed by (decoder name, port, payload_hex).
+    :param int max_size: max number of cached results, 0 disables caching
+    """
+
+    def __init__(self, max_size=None):
+        if max_size is None:
+            max_size = getattr(settings, 'THINGPARK_PAYLOAD_CACHE_SIZE', 10000)
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = Counter()
+        self.misses = Counter()
+        self.evictions = 0
+
+    def decode(self, name, func, payload_hex, port, **kwargs):
+        """
+        Return a copy of the cached result of decoder `name`, or call `func` and cache its result.
+        Exceptions are not cached.
+        """
+        if self.max_size <= 0:
+            return func(payload_hex, port, **kwargs)
+        key = (name, port, payload_hex)
+        with self._lock:
+            result = self._entries.get(key, MISSING)
+            if result is not MISSING:
+                self._entries.move_to_end(key)
+                self.hits[name] += 1
+            else:
+                self.misses[name] += 1
+        if result is not MISSING:
+            return fresh_copy(result)
+        result = func(payload_hex, port, **kwargs)
+        cached = fresh_copy(result)
+        with self._lock:
+            self._entries[key] = cached
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        :return: dict of totals and hit rate, and hits and misses of each decoder
+        """
+        with self._lock:
+            hits, misses = sum(self.hits.values()), sum(self.misses.values())
+            return {
+                'size': len(self._entries),
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+                'evictions': self.evictions,
+                'decoders': {name: {'hits': self.hits[name], 'misses': self.misses[name]}
+                             for name in set(self.hits) | set(self.misses)},
+            }
+
+
+payload_cache = PayloadCache()
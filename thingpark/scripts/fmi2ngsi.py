@@ -3,7 +3,6 @@ import os
 import sys
 import datetime
 import json
-import requests
 import urllib
 from dateutil.parser import parse
 
@@ -14,6 +13,7 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "httpbroker.settings")
 django.setup()
 
 from django.conf import settings
+from thingpark.ngsi import get_upserter
 from thingpark.scripts.fmiapiget import get_fmi_data, get_args, get_fmi_api_url, create_datetime
 
 
@@ -40,26 +40,6 @@ ORION_USERNAME = settings.ORION_USERNAME
 ORION_PASSWORD = settings.ORION_PASSWORD
 
 
-def push_ngsi_orion(data, url_root, username, password):
-    # device_id = data['id']
-    res = None
-    res = requests.post('{}/entities/'.format(url_root), auth=(username, password), json=data)
-    try:  # ...to update the entity...
-        patch_data = data.copy()
-        # Remove illegal keys from patch data
-        del patch_data['id']
-        del patch_data['type']
-        res = requests.patch('{}/entities/{}/attrs/?options=keyValues'.format(url_root, data['id']),
-                             auth=(username, password), json=patch_data)
-    except Exception as err:
-        # logger.error('Something went wrong! Exception: {}'.format(err))
-        print('Something went wrong PATCHing to Orion! Exception: {}'.format(err))
-    # ...if updating failed, the entity probably doesn't exist yet so create it
-    if not res or (res.status_code != 204):
-        res = requests.post('{}/entities/?options=keyValues'.format(url_root), auth=(username, password), json=data)
-    return res
-
-
 def add_key(ngsidata, ngsikey, fmidata, fmikey):
     # if fmikey in fmidata and fmidata[fmikey] is not None:
     if fmikey in fmidata:
@@ -95,7 +75,7 @@ def send_to_ngsi(data, options=None):
     NGSI_DATA['dateObservedFrom'] = (ts - datetime.timedelta(hours=1)).isoformat()
     NGSI_DATA['dateObservedTo'] = ts.isoformat()
     # print(json.dumps(NGSI_DATA, indent=1))
-    res = push_ngsi_orion(NGSI_DATA, ORION_URL_ROOT, ORION_USERNAME, ORION_PASSWORD)
+    res = get_upserter(ORION_URL_ROOT, auth=(ORION_USERNAME, ORION_PASSWORD)).upsert(NGSI_DATA)
     return res
 
 
@@ -0,0 +1,38 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from thingpark.dispatch import decoder_table
+from thingpark.utils import datalogger_cache
+
+
+def invalidate_datalogger(sender, instance, **kwargs):
+    datalogger_cache.invalidate(devid=instance.devid)
+    decoder_table.invalidate(devid=instance.devid)
+
+
+def invalidate_datalogger_forward(sender, instance, **kwargs):
+    datalogger_cache.invalidate(pk=instance.datalogger_id)
+
+
+def invalidate_datalogger_forwards(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        datalogger_cache.invalidate(devid=instance.devid)
+    elif pk_set:  # Forward side of the relation, affected Dataloggers are in pk_set
+        for pk in pk_set:
+            datalogger_cache.invalidate(pk=pk)
+    else:  # post_clear doesn't tell which Dataloggers were affected
+        datalogger_cache.invalidate()
+
+
+def connect_signals():
+    from broker.models import Datalogger, DataloggerForward
+
+    post_save.connect(invalidate_datalogger, sender=Datalogger, dispatch_uid='thingpark_datalogger_save')
+    post_delete.connect(invalidate_datalogger, sender=Datalogger, dispatch_uid='thingpark_datalogger_delete')
+    post_save.connect(invalidate_datalogger_forward, sender=DataloggerForward,
+                      dispatch_uid='thingpark_dataloggerforward_save')
+    post_delete.connect(invalidate_datalogger_forward, sender=DataloggerForward,
+                        dispatch_uid='thingpark_dataloggerforward_delete')
+    m2m_changed.connect(invalidate_datalogger_forwards, sender=Datalogger.forwards.through,
+                        dispatch_uid='thingpark_datalogger_forwards_changed')
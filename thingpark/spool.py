@@ -0,0 +1,286 @@
+"""
+Disk-backed append-only spool for data which failed to be forwarded.
+
+Records are JSON lines in segment files (000000000001.spool, ...) in the
+spool directory. Records are appended to the newest segment, which is
+closed when it grows over segment_size. When the spool grows over
+max_size, the oldest segments are deleted (evicted).
+
+A Drainer thread replays the oldest records in batches. A segment is
+deleted when all of its records have been replayed. The position inside
+the oldest segment is kept only in memory, so after a restart the records
+of a partly replayed segment are replayed again.
+
+A spool directory is used by one process at a time: the Spool holds an
+exclusive flock() on its .lock file until it is closed, and raises
+SpoolLocked if another process holds it.
+
+fsync policy: None never calls fsync (the OS writes data when it wants),
+0 calls it after each record and a positive number at most every that
+many seconds (and when a segment is closed).
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # Not on Windows, spool directories are not locked there
+
+logger = logging.getLogger('thingpark')
+
+SEGMENT_NAME = re.compile(r'^(\d{12})\.spool$')
+
+
+class SpoolLocked(OSError):
+    """Spool directory is used by another process"""
+
+
+class Segment:
+    __slots__ = ('seq', 'path', 'size', 'records')
+
+    def __init__(self, seq, path, size=0, records=0):
+        self.seq = seq
+        self.path = path
+        self.size = size
+        self.records = records
+
+
+class Spool:
+    """
+    :param str directory: directory of segment files, created if needed
+    :param int segment_size: max size of a segment in bytes (a segment is closed after the record which exceeds it)
+    :param int max_size: max total size in bytes, the oldest segments are evicted beyond it
+    :param fsync: None, 0 or seconds, see module docstring
+    :raises SpoolLocked: if another process uses the directory
+    """
+
+    def __init__(self, directory, segment_size=1024 * 1024, max_size=100 * 1024 * 1024, fsync=1.0):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_size = max_size
+        self.fsync = fsync
+        self.segments = OrderedDict()  # seq -> Segment, oldest first
+        self.current = None  # file of the newest segment, None if it is closed
+        self.synced_at = 0.0
+        self.head_offset = 0  # position of the first unreplayed record in the oldest segment
+        self.head_records = 0  # number of replayed records in the oldest segment
+        self.appended = 0
+        self.replayed = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._lock_file = self._acquire(directory)
+        for name in sorted(os.listdir(directory)):
+            match = SEGMENT_NAME.match(name)
+            if match:
+                path = os.path.join(directory, name)
+                with open(path, 'rb') as f:
+                    records = sum(1 for line in f if line.endswith(b'\n'))
+                self.segments[int(match.group(1))] = Segment(int(match.group(1)), path, os.path.getsize(path), records)
+
+    @staticmethod
+    def _acquire(directory):
+        lock_file = open(os.path.join(directory, '.lock'), 'a')
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                raise SpoolLocked(f'Spool {directory} is used by another process')
+        return lock_file
+
+    def append(self, record, appended_at=None):
+        """Append JSON serialisable `record`, appended_at (time.time()) defaults to now"""
+        if appended_at is None:
+            appended_at = time.time()
+        line = (json.dumps({'t': appended_at, 'r': record}, separators=(',', ':'), default=str) + '\n').encode()
+        with self._lock:
+            if self.current is None:
+                self._open_segment()
+            segment = next(reversed(self.segments.values()))
+            self.current.write(line)
+            self.current.flush()
+            segment.size += len(line)
+            segment.records += 1
+            self.appended += 1
+            if segment.size >= self.segment_size:
+                self._close_segment()
+            elif self.fsync is not None and time.monotonic() - self.synced_at >= self.fsync:
+                self._sync()
+            self._evict()
+
+    def _open_segment(self):
+        seq = next(reversed(self.segments)) + 1 if self.segments else 1
+        path = os.path.join(self.directory, f'{seq:012d}.spool')
+        self.current = open(path, 'ab')
+        self.segments[seq] = Segment(seq, path)
+
+    def _close_segment(self):
+        if self.fsync is not None:
+            self._sync()
+        self.current.close()
+        self.current = None
+
+    def _sync(self):
+        os.fsync(self.current.fileno())
+        self.synced_at = time.monotonic()
+
+    def _evict(self):
+        while self.size() > self.max_size and len(self.segments) > 1:
+            seq, segment = next(iter(self.segments.items()))
+            self.evicted += segment.records - self.head_records
+            logger.warning(f'Spool {self.directory} is full, evicted {segment.records - self.head_records} records')
+            self._remove_oldest()
+
+    def _remove_oldest(self):
+        seq, segment = self.segments.popitem(last=False)
+        try:
+            os.remove(segment.path)
+        except FileNotFoundError:
+            pass
+        self.head_offset = 0
+        self.head_records = 0
+
+    def size(self):
+        return sum(segment.size for segment in self.segments.values())
+
+    def depth(self):
+        """Return number of records waiting to be replayed"""
+        return sum(segment.records for segment in self.segments.values()) - self.head_records
+
+    def peek(self, max_records):
+        """
+        Read up to `max_records` oldest records. Records are not removed before commit().
+        :return: tuple (seq, end offset, list of (time appended, record))
+        """
+        with self._lock:
+            if not self.segments:
+                return None, 0, []
+            seq, segment = next(iter(self.segments.items()))
+            if self.current is not None and len(self.segments) == 1:
+                if segment.records == self.head_records:
+                    return None, 0, []
+                self._close_segment()  # Replay the newest segment too, new records go to a new one
+            end, records = self._read(segment, max_records)
+            return seq, end, records
+
+    def _read(self, segment, max_records):
+        records = []
+        end = self.head_offset
+        with open(segment.path, 'rb') as f:
+            f.seek(self.head_offset)
+            while len(records) < max_records:
+                line = f.readline()
+                if not line.endswith(b'\n'):  # End of segment or a partly written record
+                    break
+                end += len(line)
+                try:
+                    entry = json.loads(line)
+                    records.append((entry['t'], entry['r']))
+                except (ValueError, KeyError):
+                    logger.warning(f'Skipping invalid record in {segment.path}')
+                    records.append(None)
+        return end, records
+
+    def commit(self, seq, end, count):
+        """Remove `count` records up to offset `end` of segment `seq`, which peek() returned"""
+        with self._lock:
+            if not self.segments or next(iter(self.segments)) != seq:
+                return  # Evicted meanwhile
+            segment = self.segments[seq]
+            self.head_offset = end
+            self.head_records += count
+            self.replayed += count
+            if self.head_records >= segment.records and (self.current is None or len(self.segments) > 1):
+                self._remove_oldest()
+
+    def oldest_age(self):
+        """Return age in seconds of the oldest record, None if spool is empty"""
+        with self._lock:
+            if not self.segments:
+                return None
+            segment = next(iter(self.segments.values()))
+            if segment.records == self.head_records:
+                return None
+            end, records = self._read(segment, 1)
+        if records and records[0] is not None:
+            return time.time() - records[0][0]
+        return None
+
+    def close(self):
+        """Close the newest segment and release the directory"""
+        with self._lock:
+            if self.current is not None:
+                self._close_segment()
+            if not self._lock_file.closed:
+                self._lock_file.close()  # Releases the flock
+
+    def stats(self):
+        return {
+            'depth': self.depth(),
+            'bytes': self.size(),
+            'segments': len(self.segments),
+            'oldest_age': self.oldest_age(),
+            'appended': self.appended,
+            'replayed': self.replayed,
+            'evicted': self.evicted,
+        }
+
+
+class Drainer(threading.Thread):
+    """
+    Replay spooled records in the background.
+    :param Spool spool:
+    :param handler: function(list of (time appended, record)) returning True if the records were delivered
+    :param int batch_size: max number of records passed to handler at once
+    :param float interval: seconds before the first replay, between checks of an empty spool and before
+        the first retry after a failure
+    :param float max_interval: retry interval is doubled after each failure up to this
+    """
+
+    def __init__(self, spool, handler, batch_size=100, interval=5.0, max_interval=300.0):
+        super().__init__(name='spool-drainer', daemon=True)
+        self.spool = spool
+        self.handler = handler
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_interval = max_interval
+        self.failures = 0
+        self._stopped = threading.Event()
+
+    def run(self):
+        wait = self.interval
+        retry_interval = self.interval
+        while not self._stopped.wait(wait):
+            seq, end, records = self.spool.peek(self.batch_size)
+            if seq is None:
+                wait = self.interval
+                continue
+            valid = [r for r in records if r is not None]
+            try:
+                delivered = not valid or self.handler(valid)
+            except Exception:
+                logger.exception('Replaying spooled records failed')
+                delivered = False
+            if delivered:
+                self.spool.commit(seq, end, len(records))
+                if self.failures:
+                    logger.info(f'Replaying spooled records succeeded again: {self.spool.stats()}')
+                self.failures = 0
+                retry_interval = self.interval
+                wait = 0
+            else:
+                self.failures += 1
+                wait = retry_interval
+                retry_interval = min(retry_interval * 2, self.max_interval)
+                logger.warning(f'Replaying spooled records failed, retrying in {wait:.1f} s: {self.spool.stats()}')
+
+    def stop(self):
+        self._stopped.set()
@@ -1,8 +1,17 @@
 import base64
+import functools
 import json
 import datetime
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from types import MappingProxyType
+
 import influxdb
 import pytz
+from dateutil.parser import parse
+from django.conf import settings
 from django.contrib.auth import authenticate
 from django.utils import timezone
 from django.utils.timezone import get_default_timezone
@@ -35,6 +44,40 @@ def create_influxdb_obj(devid, measurement, fields, timestamp=None, extratags=No
     return measurement
 
 
+# Thingpark sends times like "2019-03-19T06:52:52.652+01:00"
+LORAWAN_TIME_RE = re.compile(r'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.(\d{1,6})\d*)?(Z|[+-]\d\d:\d\d)$')
+
+
+@functools.lru_cache(maxsize=64)
+def get_utc_offset(offset_str):
+    """
+    Convert UTC offset string (e.g. "+03:00" or "Z") to timedelta
+    :param str offset_str: offset string
+    :return: timedelta
+    """
+    if offset_str == 'Z':
+        return datetime.timedelta(0)
+    offset = datetime.timedelta(hours=int(offset_str[1:3]), minutes=int(offset_str[4:6]))
+    return -offset if offset_str[0] == '-' else offset
+
+
+def parse_lorawan_time(time_str):
+    """
+    Parse ISO 8601 time string with UTC offset to timezone aware datetime in UTC.
+    Formats not emitted by Thingpark are passed to dateutil's parser.
+    :param str time_str: e.g. "2019-03-19T06:52:52.652+01:00"
+    :return: datetime in UTC
+    """
+    m = LORAWAN_TIME_RE.match(time_str)
+    if m is None:
+        return parse(time_str).astimezone(pytz.UTC)
+    year, month, day, hour, minute, second, fraction, offset = m.groups()
+    microsecond = int(fraction.ljust(6, '0')) if fraction else 0
+    timestamp = datetime.datetime(int(year), int(month), int(day), int(hour), int(minute), int(second),
+                                  microsecond, tzinfo=pytz.UTC)
+    return timestamp - get_utc_offset(offset)
+
+
 def basicauth(request):
     """Check for valid basic auth header."""
     uname, passwd, user = None, None, None
@@ -49,6 +92,79 @@ def basicauth(request):
     return uname, passwd, user
 
 
+class DataloggerCache:
+    """
+    Bounded LRU cache of Datalogger instances keyed by devid.
+
+    Entries are dropped by post_save / post_delete signals (see thingpark.signals),
+    but signals only reach the process which saved the object, so `ttl` seconds
+    is the upper limit for how long other processes may use a stale instance.
+    """
+
+    def __init__(self, max_size=None, ttl=None):
+        if max_size is None:
+            max_size = getattr(settings, 'THINGPARK_DATALOGGER_CACHE_SIZE', 10000)
+        if ttl is None:
+            ttl = getattr(settings, 'THINGPARK_DATALOGGER_CACHE_TTL', 60)
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, devid):
+        with self._lock:
+            entry = self._entries.get(devid)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self._entries[devid]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(devid)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, devid, datalogger):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[devid] = (datalogger, time.monotonic() + self.ttl)
+            self._entries.move_to_end(devid)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, devid=None, pk=None):
+        """
+        Remove one Datalogger by devid or primary key, or everything if neither is given.
+        """
+        with self._lock:
+            if devid is None and pk is None:
+                self.invalidations += len(self._entries)
+                self._entries.clear()
+                return
+            if devid is None:
+                devid = next((k for k, v in self._entries.items() if v[0].pk == pk), None)
+            if self._entries.pop(devid, None) is not None:
+                self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+datalogger_cache = DataloggerCache()
+
+
 def get_datalogger(devid, name='', update_activity=False):
     # FIXME: Shit, this import can't be in the beginning of the file or we'll get:
     # "django.core.exceptions.AppRegistryNotReady: Apps aren't loaded yet."
@@ -57,7 +173,16 @@ def get_datalogger(devid, name='', update_activity=False):
     # django.setup()
     from broker.models import Datalogger
 
-    datalogger, created = Datalogger.objects.get_or_create(devid=devid)
+    if not update_activity:
+        datalogger = datalogger_cache.get(devid)
+        if datalogger is not None:
+            return datalogger, False
+    # Fetch application and forwards now, so that cached instances don't query them later
+    queryset = Datalogger.objects.select_related('application').prefetch_related('forwards')
+    datalogger = queryset.filter(devid=devid).first()
+    created = False
+    if datalogger is None:
+        datalogger, created = Datalogger.objects.get_or_create(devid=devid)
     changed = False
     if created:
         datalogger.name = name
@@ -67,9 +192,71 @@ def get_datalogger(devid, name='', update_activity=False):
         changed = True
     if changed:
         datalogger.save()
+    datalogger_cache.set(devid, datalogger)
     return datalogger, created
 
 
+def find_datalogger(devid):
+    """
+    Return the Datalogger of `devid` like get_datalogger(), but never create or save one.
+    An unknown devid gets an unsaved Datalogger (without decoder), e.g. for dry runs.
+    """
+    from broker.models import Datalogger
+
+    datalogger = datalogger_cache.get(devid)
+    if datalogger is None:
+        queryset = Datalogger.objects.select_related('application').prefetch_related('forwards')
+        datalogger = queryset.filter(devid=devid).first()
+        if datalogger is None:
+            return Datalogger(devid=devid)
+        datalogger_cache.set(devid, datalogger)
+    return datalogger
+
+
+def imap_bounded(pool, func, iterable, window):
+    """
+    Like pool.imap(func, iterable), but `iterable` is consumed in the calling thread and at most
+    `window` items are sent to the pool before their results are taken, so a large input isn't
+    read into memory ahead of the workers.
+    """
+    pending = deque()
+    for item in iterable:
+        if len(pending) >= window:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(func, (item,)))
+    while pending:
+        yield pending.popleft().get()
+
+
+_application_headers = {}
+EMPTY_HEADERS = MappingProxyType({})
+
+
+def get_application_headers(application):
+    """
+    Return message headers built from Application's JSON config.
+    The result is memoized by application id and updated_at (or the config itself,
+    if Application has no updated_at), so config is parsed only when it changes.
+    :param application: broker.models.Application or None
+    :return: tuple (read-only headers dict, bool influxdb enabled)
+    """
+    if application is None:
+        return EMPTY_HEADERS, False
+    key = (application.pk, getattr(application, 'updated_at', None) or application.config)
+    entry = _application_headers.get(key)
+    if entry is None:
+        config = json.loads(application.config)
+        # TODO: get influxdb variables from Application / Datalogger / Forward etc config
+        influxdb_enabled = 'influxdb_database' in config and 'influxdb_measurement' in config
+        if influxdb_enabled:
+            config['influxdb'] = '1'
+        entry = (MappingProxyType(config), influxdb_enabled)
+        if len(_application_headers) >= 1000:  # Old versions of configs are never used again
+            _application_headers.clear()
+        _application_headers[key] = entry
+    return entry
+
+
 def decode_json_body(body):
     body_str = body.decode('utf8', "backslashreplace")
     try: